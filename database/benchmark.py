@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# 用户数据库性能基准测试
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+# 添加当前目录的父目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import db_utils, init_db, passwords
+from database.session_cache import SessionCache
+
+
+def setup_temp_database(directory):
+    """在临时目录中创建测试数据库，并返回一个有效的会话令牌"""
+    db_utils.close_all_connections()
+    db_utils.DB_PATH = os.path.join(directory, 'bench.db')
+    init_db.init_database(db_utils.DB_PATH)
+
+    user = db_utils.verify_user(init_db.DEFAULT_USERNAME, init_db.DEFAULT_PASSWORD)
+    return db_utils.create_session(user['id'])
+
+
+def validate_session_baseline(token):
+    """旧版validate_session：每次调用新建连接，查询后关闭"""
+    conn = sqlite3.connect(db_utils.DB_PATH)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute(db_utils.SQL_VALIDATE_SESSION, (token,))
+    result = cursor.fetchone()
+    conn.close()
+    return dict(result) if result else None
+
+
+def measure(func, token, iterations):
+    """返回每秒调用次数"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        assert func(token) is not None
+    return iterations / (time.perf_counter() - start)
+
+
+def bench_validate_session(iterations):
+    with tempfile.TemporaryDirectory() as directory:
+        token = setup_temp_database(directory)
+
+        session_cache = db_utils.session_cache
+        db_utils.session_cache = SessionCache(max_size=0)
+        results = [
+            ("新建连接（旧实现）", measure(validate_session_baseline, token, iterations)),
+            ("连接池 + WAL", measure(db_utils.validate_session, token, iterations)),
+        ]
+
+        db_utils.session_cache = session_cache
+        results.append(("连接池 + 会话缓存", measure(db_utils.validate_session, token, iterations)))
+
+        db_utils.close_all_connections()
+
+    print(f"validate_session 吞吐量（{iterations} 次调用）:")
+    for name, rate in results:
+        print(f"  {name:<16} {rate:>10.0f} 次/秒")
+    for name, rate in results[1:]:
+        print(f"  {name} 相对旧实现: {rate / results[0][1]:.1f}x")
+
+
+def bench_login(workers, duration, budget_ms, peak_rate):
+    """测量不同哈希算法/代价参数下的验证延迟和并发吞吐量，用于选择代价参数"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    candidates = [passwords.ScryptHasher(n=2 ** k) for k in range(12, 17)]
+    candidates += [passwords.Pbkdf2Hasher(iterations=i) for i in (100000, 300000, 600000, 1000000)]
+
+    print(f"{workers} 个认证线程, 延迟预算 {budget_ms} ms, 峰值登录速率 {peak_rate} 次/秒:")
+    print(f"  {'算法':<36} {'单次延迟':>10} {'吞吐量':>12}  满足要求")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for hasher in candidates:
+            encoded = hasher.encode('benchmark password')
+            verify = lambda _: hasher.verify('benchmark password', encoded)  # noqa: B023
+
+            start = time.perf_counter()
+            verify(None)
+            latency = time.perf_counter() - start
+
+            iterations = max(workers, int(duration / max(latency, 1e-6)) * workers)
+            start = time.perf_counter()
+            list(executor.map(verify, range(iterations)))
+            rate = iterations / (time.perf_counter() - start)
+
+            ok = latency * 1000 <= budget_ms and rate >= peak_rate
+            label = encoded.rsplit('$', 2)[0]
+            print(f"  {label:<36} {latency * 1000:>8.1f}ms {rate:>8.1f}次/秒  {'是' if ok else '否'}")
+
+    print(f"当前配置: {passwords.get_hasher().encode('x').rsplit('$', 2)[0]}")
+
+
+def legacy_is_exempt(path):
+    """旧版中间件：每个请求重新构建豁免列表并逐个startswith"""
+    from modules import custom_auth
+
+    exempt_paths = list(custom_auth.AUTH_EXEMPT_PATHS)
+    exempt_prefixes = list(custom_auth.AUTH_EXEMPT_PREFIXES)
+    return path in exempt_paths or any(path.startswith(prefix) for prefix in exempt_prefixes)
+
+
+def bench_middleware(iterations):
+    """测量认证中间件每个请求的额外开销"""
+    import asyncio
+    from modules import custom_auth
+
+    paths = ["/", "/queue/join", "/internal/progress", "/file=outputs/a.png", "/assets/index.js", "/login", "/sdapi/v1/options", "/run/predict"]
+
+    with tempfile.TemporaryDirectory() as directory:
+        token = setup_temp_database(directory)
+        scopes = [{
+            "type": "http",
+            "path": path,
+            "query_string": b"",
+            "headers": [(b"cookie", f"session_token={token}".encode())],
+        } for path in paths]
+
+        middleware = custom_auth.AuthMiddleware(app=None)
+
+        async def run_requests():
+            for _ in range(iterations):
+                for scope in scopes:
+                    assert await middleware.check_request(scope) is None
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for path in paths:
+                legacy_is_exempt(path)
+        legacy_match = (time.perf_counter() - start) / (iterations * len(paths))
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for path in paths:
+                middleware.is_exempt(path)
+        compiled_match = (time.perf_counter() - start) / (iterations * len(paths))
+
+        start = time.perf_counter()
+        asyncio.run(run_requests())
+        per_request = (time.perf_counter() - start) / (iterations * len(paths))
+
+        db_utils.close_all_connections()
+
+    print(f"认证中间件开销（{len(paths)} 种路径 x {iterations} 次）:")
+    print(f"  豁免匹配（旧: 每次构建列表 + startswith）: {legacy_match * 1e6:.2f} us")
+    print(f"  豁免匹配（预编译正则）:                    {compiled_match * 1e6:.2f} us")
+    print(f"  check_request 每请求（含会话缓存命中）:     {per_request * 1e6:.2f} us")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def login_loop(base_url, account, password, stop, counts):
+    """不断登录并用新会话访问主页，模拟并发登录"""
+    import requests
+
+    session = requests.Session()
+    while not stop.is_set():
+        response = session.post(f"{base_url}/login_check", json={"username": account, "password": password})
+        session.get(f"{base_url}/", allow_redirects=False)
+        counts.append(response.status_code)
+
+
+def progress_loop(base_url, stop, latencies):
+    """不断轮询/internal/progress并记录延迟"""
+    import requests
+
+    session = requests.Session()
+    while not stop.is_set():
+        start = time.perf_counter()
+        session.post(f"{base_url}/internal/progress", json={"id_task": "bench", "id_live_preview": -1})
+        latencies.append(time.perf_counter() - start)
+
+
+def bench_auth_load(base_url, account, password, logins, pollers, duration):
+    """对运行中的WebUI进行压测：并发登录的同时测量进度轮询的延迟"""
+    stop = threading.Event()
+    counts = []
+    latencies = []
+
+    threads = [threading.Thread(target=login_loop, args=(base_url, account, password, stop, counts)) for _ in range(logins)]
+    threads += [threading.Thread(target=progress_loop, args=(base_url, stop, latencies)) for _ in range(pollers)]
+    for thread in threads:
+        thread.start()
+
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    if not latencies:
+        print("没有完成任何进度请求")
+        return
+
+    print(f"{logins} 个并发登录线程, {pollers} 个进度轮询线程, 持续 {duration} 秒:")
+    print(f"  登录请求: {len(counts)} 次 ({len(counts) / duration:.1f} 次/秒), 失败 {sum(1 for c in counts if c != 200)} 次")
+    print(f"  /internal/progress: {len(latencies)} 次")
+    for p in (50, 95, 99):
+        print(f"    p{p}: {percentile(latencies, p) * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用户数据库性能基准测试')
+    subparsers = parser.add_subparsers(dest='command', help='命令')
+
+    session_parser = subparsers.add_parser('validate-session', help='测试validate_session吞吐量')
+    session_parser.add_argument('--iterations', '-n', type=int, default=10000, help='调用次数')
+
+    login_parser = subparsers.add_parser('login', help='比较密码哈希代价参数下的登录延迟和吞吐量')
+    login_parser.add_argument('--workers', type=int, default=int(os.environ.get('SD_WEBUI_AUTH_DB_WORKERS', 4)), help='认证线程数（SD_WEBUI_AUTH_DB_WORKERS）')
+    login_parser.add_argument('--duration', '-t', type=float, default=1, help='每种参数的测量时间（秒）')
+    login_parser.add_argument('--budget-ms', type=float, default=250, help='单次登录延迟预算（毫秒）')
+    login_parser.add_argument('--peak-rate', type=float, default=20, help='峰值登录速率（次/秒）')
+
+    middleware_parser = subparsers.add_parser('middleware', help='测量认证中间件每个请求的开销')
+    middleware_parser.add_argument('--iterations', '-n', type=int, default=20000, help='每种路径的请求次数')
+
+    load_parser = subparsers.add_parser('auth-load', help='在并发登录下测量/internal/progress延迟（需要WebUI正在运行）')
+    load_parser.add_argument('--url', default='http://127.0.0.1:7860', help='WebUI地址')
+    load_parser.add_argument('--account', '-a', default=init_db.DEFAULT_USERNAME, help='登录账号')
+    load_parser.add_argument('--password', '-p', default=init_db.DEFAULT_PASSWORD, help='登录密码')
+    load_parser.add_argument('--logins', type=int, default=16, help='并发登录线程数')
+    load_parser.add_argument('--pollers', type=int, default=4, help='进度轮询线程数')
+    load_parser.add_argument('--duration', '-t', type=float, default=10, help='持续时间（秒）')
+
+    args = parser.parse_args()
+
+    if args.command == 'validate-session':
+        bench_validate_session(args.iterations)
+    elif args.command == 'login':
+        bench_login(args.workers, args.duration, args.budget_ms, args.peak_rate)
+    elif args.command == 'middleware':
+        bench_middleware(args.iterations)
+    elif args.command == 'auth-load':
+        bench_auth_load(args.url.rstrip('/'), args.account, args.password, args.logins, args.pollers, args.duration)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
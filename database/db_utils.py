@@ -1,105 +1,233 @@
 import os
 import sqlite3
+import threading
 import time
-import hashlib
+from contextlib import contextmanager
 from typing import Dict, Optional, Tuple, List, Any
 
-# 数据库文件路径
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'user.db')
+from database import passwords
+from database.session_cache import SessionCache
 
-def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(DB_PATH)
+# 数据库文件路径（全局唯一，custom_auth / user_api / user_mgmt 均通过本模块访问）
+DB_PATH = os.environ.get('SD_WEBUI_USER_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'user.db'))
+
+# 每个连接缓存的预编译语句数量
+STATEMENT_CACHE_SIZE = 128
+
+# 等待写锁的超时时间（秒）
+BUSY_TIMEOUT = 30
+
+# 是否复用连接；关闭后每次调用都会新建连接（仅用于基准测试对比）
+POOL_ENABLED = True
+
+# 会话缓存：认证中间件的热路径在缓存命中时不访问数据库
+SESSION_CACHE_SIZE = int(os.environ.get('SD_WEBUI_SESSION_CACHE_SIZE', 4096))
+SESSION_CACHE_TTL = float(os.environ.get('SD_WEBUI_SESSION_CACHE_TTL', 60))
+session_cache = SessionCache(max_size=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+
+# 账号不存在时用来验证的哈希，使登录耗时不暴露账号是否存在
+DUMMY_PASSWORD_HASH = passwords.get_hasher().encode(os.urandom(16).hex())
+
+# 连接池：线程ID -> 连接，每个线程独占一个连接
+_pool: Dict[int, sqlite3.Connection] = {}
+_pool_lock = threading.Lock()
+
+# 常用SQL语句，保持字符串完全一致以命中sqlite3的语句缓存
+SQL_VERIFY_USER = 'SELECT id, username, account, email, points, password FROM users WHERE account = ?'
+SQL_UPDATE_PASSWORD = 'UPDATE users SET password = ? WHERE id = ?'
+SQL_UPDATE_LAST_LOGIN = 'UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?'
+SQL_INSERT_SESSION = 'INSERT INTO sessions (token, user_id, expires_at) VALUES (?, ?, ?)'
+SQL_VALIDATE_SESSION = '''
+    SELECT
+        s.token, s.user_id, s.expires_at,
+        u.username, u.account, u.email, u.points
+    FROM sessions s
+    JOIN users u ON s.user_id = u.id
+    WHERE s.token = ?
+'''
+SQL_DELETE_SESSION = 'DELETE FROM sessions WHERE token = ?'
+SQL_UPDATE_POINTS = 'UPDATE users SET points = points + ? WHERE id = ?'
+SQL_DELETE_EXPIRED_SESSIONS = 'DELETE FROM sessions WHERE expires_at < ?'
+SQL_DELETE_EXPIRED_SESSIONS_BATCH = 'DELETE FROM sessions WHERE rowid IN (SELECT rowid FROM sessions WHERE expires_at < ? LIMIT ?)'
+SQL_GET_POINTS = 'SELECT points FROM users WHERE id = ?'
+SQL_DEDUCT_POINTS = 'UPDATE users SET points = points + ? WHERE id = ? AND points >= ?'
+SQL_FIND_LEDGER_ENTRY = 'SELECT delta, balance FROM points_ledger WHERE user_id = ? AND idempotency_key = ?'
+SQL_INSERT_LEDGER_ENTRY = 'INSERT INTO points_ledger (user_id, delta, balance, reason, idempotency_key, created_at) VALUES (?, ?, ?, ?, ?, ?)'
+
+# 在users/sessions之后新增的表和索引，已有数据库在启动时通过ensure_schema补齐
+SCHEMA = [
+    # 积分流水：每次积分变化一行，idempotency_key（例如生成任务ID）保证同一用户的同一操作只扣一次
+    '''
+    CREATE TABLE IF NOT EXISTS points_ledger (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        delta INTEGER NOT NULL,         -- 积分变化量
+        balance INTEGER NOT NULL,       -- 变化后的积分
+        reason TEXT,                    -- 原因
+        idempotency_key TEXT,           -- 幂等键，每个用户内唯一
+        created_at REAL NOT NULL,
+        UNIQUE (user_id, idempotency_key),
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_points_ledger_user_id ON points_ledger (user_id)',
+    # 过期会话清理按expires_at范围删除
+    'CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)',
+]
+
+
+def connect(path: Optional[str] = None) -> sqlite3.Connection:
+    """创建一个新的数据库连接（WAL模式）"""
+    conn = sqlite3.connect(
+        path or DB_PATH,
+        timeout=BUSY_TIMEOUT,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,  # 连接只在所属线程中使用，但允许在其他线程中关闭
+    )
     conn.row_factory = sqlite3.Row  # 使查询结果可以通过列名访问
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
     return conn
 
+
+def _prune_pool():
+    """关闭已退出线程遗留的连接，调用方需持有_pool_lock"""
+    alive = {t.ident for t in threading.enumerate()}
+    for ident in [ident for ident in _pool if ident not in alive]:
+        _pool.pop(ident).close()
+
+
+def get_db_connection() -> sqlite3.Connection:
+    """获取当前线程的数据库连接；连接由连接池持有，调用方不要关闭"""
+    if not POOL_ENABLED:
+        return connect()
+
+    ident = threading.get_ident()
+    conn = _pool.get(ident)
+    if conn is None:
+        conn = connect()
+        with _pool_lock:
+            _prune_pool()
+            _pool[ident] = conn
+
+    return conn
+
+
+def close_all_connections():
+    """关闭连接池中的全部连接，修改DB_PATH后或进程退出前调用"""
+    session_cache.clear()
+
+    with _pool_lock:
+        for conn in _pool.values():
+            conn.close()
+        _pool.clear()
+
+
+def migrate_points_ledger(conn: sqlite3.Connection):
+    """旧版本的points_ledger中idempotency_key全局唯一，重建为按(user_id, idempotency_key)唯一"""
+    for index in conn.execute('PRAGMA index_list(points_ledger)').fetchall():
+        columns = [row['name'] for row in conn.execute(f'PRAGMA index_info("{index["name"]}")')]
+        if index['unique'] and columns == ['idempotency_key']:
+            break
+    else:
+        return
+
+    conn.execute('ALTER TABLE points_ledger RENAME TO points_ledger_old')
+    conn.execute(SCHEMA[0])
+    conn.execute('INSERT INTO points_ledger SELECT id, user_id, delta, balance, reason, idempotency_key, created_at FROM points_ledger_old')
+    conn.execute('DROP TABLE points_ledger_old')
+
+
+def ensure_schema(conn: Optional[sqlite3.Connection] = None):
+    """创建SCHEMA中尚不存在的表和索引"""
+    conn = conn or get_db_connection()
+    with conn:
+        conn.execute(SCHEMA[0])
+        migrate_points_ledger(conn)
+        for statement in SCHEMA[1:]:
+            conn.execute(statement)
+
+
+@contextmanager
+def cursor():
+    """获取一个游标，退出时提交事务，出错时回滚"""
+    conn = get_db_connection()
+    try:
+        with conn:
+            yield conn.cursor()
+    finally:
+        if not POOL_ENABLED:
+            conn.close()
+
+
 def hash_password(password: str) -> str:
-    """使用SHA-256哈希密码"""
-    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+    """使用当前配置的算法（见passwords.py）哈希密码"""
+    return passwords.hash_password(password)
 
 def verify_user(account: str, password: str) -> Optional[Dict[str, Any]]:
-    """验证用户凭据并返回用户数据"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 哈希输入的密码进行比较
-    hashed_password = hash_password(password)
-    
-    cursor.execute(
-        'SELECT id, username, account, email, points FROM users WHERE account = ? AND password = ?', 
-        (account, hashed_password)
-    )
-    user = cursor.fetchone()
-    
-    if user:
+    """验证用户凭据并返回用户数据；旧格式或旧代价参数的密码哈希会在验证成功后升级"""
+    with cursor() as cur:
+        cur.execute(SQL_VERIFY_USER, (account,))
+        user = cur.fetchone()
+
+    if not user:
+        passwords.verify_password(password, DUMMY_PASSWORD_HASH)
+        return None
+
+    # 哈希计算较慢，不在事务中进行
+    valid, needs_rehash = passwords.verify_password(password, user['password'])
+    if not valid:
+        return None
+
+    with cursor() as cur:
+        if needs_rehash:
+            cur.execute(SQL_UPDATE_PASSWORD, (passwords.hash_password(password), user['id']))
+
         # 更新最后登录时间
-        cursor.execute(
-            'UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?', 
-            (user['id'],)
-        )
-        conn.commit()
-        
-        # 转换为字典
-        user_dict = dict(user)
-    else:
-        user_dict = None
-    
-    conn.close()
+        cur.execute(SQL_UPDATE_LAST_LOGIN, (user['id'],))
+
+    # 转换为字典
+    user_dict = dict(user)
+    del user_dict['password']
     return user_dict
 
 def create_session(user_id: int, expiry_seconds: int = 86400) -> str:
     """创建用户会话并返回会话令牌"""
     import secrets
-    
+
     # 生成随机令牌
     token = secrets.token_hex(32)
     expires_at = time.time() + expiry_seconds
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+
     # 存储会话信息
-    cursor.execute(
-        'INSERT INTO sessions (token, user_id, expires_at) VALUES (?, ?, ?)',
-        (token, user_id, expires_at)
-    )
-    conn.commit()
-    conn.close()
-    
+    with cursor() as cur:
+        cur.execute(SQL_INSERT_SESSION, (token, user_id, expires_at))
+
     return token
 
 def validate_session(token: str) -> Optional[Dict[str, Any]]:
     """验证会话并返回用户数据"""
     if not token:
         return None
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 获取会话信息和关联的用户数据
-    cursor.execute('''
-        SELECT 
-            s.token, s.user_id, s.expires_at,
-            u.username, u.account, u.email, u.points
-        FROM sessions s
-        JOIN users u ON s.user_id = u.id
-        WHERE s.token = ?
-    ''', (token,))
-    
-    result = cursor.fetchone()
-    
-    if not result:
-        conn.close()
-        return None
-    
-    # 检查会话是否过期
-    if result['expires_at'] < time.time():
-        # 清理过期会话
-        cursor.execute('DELETE FROM sessions WHERE token = ?', (token,))
-        conn.commit()
-        conn.close()
-        return None
-    
+
+    cached = session_cache.get(token)
+    if cached is not None:
+        return cached
+
+    with cursor() as cur:
+        # 获取会话信息和关联的用户数据
+        cur.execute(SQL_VALIDATE_SESSION, (token,))
+        result = cur.fetchone()
+
+        if not result:
+            return None
+
+        # 检查会话是否过期
+        if result['expires_at'] < time.time():
+            # 清理过期会话
+            cur.execute(SQL_DELETE_SESSION, (token,))
+            return None
+
     # 会话有效，返回用户数据
     user_data = {
         'user_id': result['user_id'],
@@ -110,85 +238,158 @@ def validate_session(token: str) -> Optional[Dict[str, Any]]:
         'session_token': result['token'],
         'expires_at': result['expires_at']
     }
-    
-    conn.close()
+
+    session_cache.put(token, user_data)
     return user_data
 
 def delete_session(token: str) -> bool:
     """删除会话"""
     if not token:
         return False
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM sessions WHERE token = ?', (token,))
-    deleted = cursor.rowcount > 0
-    
-    conn.commit()
-    conn.close()
-    
-    return deleted
+
+    session_cache.invalidate(token)
+
+    with cursor() as cur:
+        cur.execute(SQL_DELETE_SESSION, (token,))
+        return cur.rowcount > 0
 
 def get_all_users() -> List[Dict[str, Any]]:
     """获取所有用户数据"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT id, username, account, email, points, created_at, last_login FROM users')
-    users = [dict(row) for row in cursor.fetchall()]
-    
-    conn.close()
-    return users
+    with cursor() as cur:
+        cur.execute('SELECT id, username, account, email, points, created_at, last_login FROM users')
+        return [dict(row) for row in cur.fetchall()]
+
+def get_user_by_account(account: str) -> Optional[Dict[str, Any]]:
+    """根据账号获取用户数据"""
+    with cursor() as cur:
+        cur.execute('SELECT id, username, account, email, points FROM users WHERE account = ?', (account,))
+        user = cur.fetchone()
+
+    return dict(user) if user else None
+
+def get_user_points(user_id: int) -> Optional[int]:
+    """获取用户当前积分"""
+    with cursor() as cur:
+        row = cur.execute(SQL_GET_POINTS, (user_id,)).fetchone()
+
+    return row['points'] if row else None
+
+def update_user_profile(account: str, username: str, email: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """更新用户名和邮箱，返回更新后的用户数据"""
+    with cursor() as cur:
+        if email:
+            cur.execute('UPDATE users SET username = ?, email = ? WHERE account = ?', (username, email, account))
+        else:
+            cur.execute('UPDATE users SET username = ? WHERE account = ?', (username, account))
+
+    user = get_user_by_account(account)
+    if user:
+        session_cache.invalidate_user(user['id'])
+
+    return user
 
 def add_user(username: str, account: str, password: str, email: str = "", points: int = 0) -> Optional[int]:
     """添加新用户并返回用户ID"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
         hashed_password = hash_password(password)
-        cursor.execute('''
-            INSERT INTO users (username, account, password, email, points)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (username, account, hashed_password, email, points))
-        
-        user_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return user_id
+        with cursor() as cur:
+            cur.execute('''
+                INSERT INTO users (username, account, password, email, points)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (username, account, hashed_password, email, points))
+            return cur.lastrowid
     except sqlite3.IntegrityError:
         # 用户名或账号已存在
-        conn.close()
         return None
 
 def update_user_points(user_id: int, points_delta: int) -> bool:
-    """更新用户积分"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+    """更新用户积分（管理操作，不检查余额）"""
     try:
-        cursor.execute(
-            'UPDATE users SET points = points + ? WHERE id = ?',
-            (points_delta, user_id)
-        )
-        success = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
-        return success
-    except:
-        conn.close()
+        with cursor() as cur:
+            cur.execute(SQL_UPDATE_POINTS, (points_delta, user_id))
+            if cur.rowcount == 0:
+                return False
+
+            balance = cur.execute(SQL_GET_POINTS, (user_id,)).fetchone()['points']
+            cur.execute(SQL_INSERT_LEDGER_ENTRY, (user_id, points_delta, balance, 'manual', None, time.time()))
+            return True
+    except sqlite3.Error:
         return False
+    finally:
+        session_cache.invalidate_user(user_id)
+
+def apply_points_change(conn: sqlite3.Connection, user_id: int, delta: int, idempotency_key: Optional[str] = None, reason: str = '') -> Dict[str, Any]:
+    """在调用方的事务中修改积分并写入流水
+
+    扣除（delta < 0）使用带条件的UPDATE，余额不足时不修改任何数据；
+    同一用户相同idempotency_key、相同delta的重复请求直接返回第一次的结果；
+    delta不同则拒绝，返回结果中带'conflict': True。
+    返回 {'success': bool, 'points': 变化后（或当前）积分, 'duplicate': bool}
+    """
+    if idempotency_key:
+        entry = conn.execute(SQL_FIND_LEDGER_ENTRY, (user_id, idempotency_key)).fetchone()
+        if entry and entry['delta'] == delta:
+            return {'success': True, 'points': entry['balance'], 'duplicate': True}
+        if entry:
+            row = conn.execute(SQL_GET_POINTS, (user_id,)).fetchone()
+            return {'success': False, 'points': row['points'] if row else None, 'duplicate': True, 'conflict': True}
+
+    if delta < 0:
+        updated = conn.execute(SQL_DEDUCT_POINTS, (delta, user_id, -delta)).rowcount
+    else:
+        updated = conn.execute(SQL_UPDATE_POINTS, (delta, user_id)).rowcount
+
+    row = conn.execute(SQL_GET_POINTS, (user_id,)).fetchone()
+    balance = row['points'] if row else None
 
-def clean_expired_sessions():
-    """清理所有过期会话"""
+    if not updated:
+        return {'success': False, 'points': balance, 'duplicate': False}
+
+    conn.execute(SQL_INSERT_LEDGER_ENTRY, (user_id, delta, balance, reason, idempotency_key, time.time()))
+    return {'success': True, 'points': balance, 'duplicate': False}
+
+def change_points(user_id: int, delta: int, idempotency_key: Optional[str] = None, reason: str = '') -> Dict[str, Any]:
+    """在单个事务中修改积分，结果格式见apply_points_change"""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM sessions WHERE expires_at < ?', (time.time(),))
-    deleted_count = cursor.rowcount
-    
-    conn.commit()
-    conn.close()
-    
-    return deleted_count 
\ No newline at end of file
+    try:
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            return apply_points_change(conn, user_id, delta, idempotency_key, reason)
+    finally:
+        session_cache.invalidate_user(user_id)
+
+def get_points_ledger(user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+    """获取用户最近的积分流水"""
+    with cursor() as cur:
+        cur.execute('SELECT delta, balance, reason, idempotency_key, created_at FROM points_ledger WHERE user_id = ? ORDER BY id DESC LIMIT ?', (user_id, limit))
+        return [dict(row) for row in cur.fetchall()]
+
+def clean_expired_sessions(batch_size: Optional[int] = None, pause: float = 0) -> int:
+    """清理所有过期会话，返回删除的数量
+
+    指定batch_size时分批删除，每批一个短事务，批次之间等待pause秒，避免长时间占用写锁。
+    """
+    now = time.time()
+
+    if not batch_size:
+        with cursor() as cur:
+            cur.execute(SQL_DELETE_EXPIRED_SESSIONS, (now,))
+            return cur.rowcount
+
+    deleted = 0
+    while True:
+        with cursor() as cur:
+            cur.execute(SQL_DELETE_EXPIRED_SESSIONS_BATCH, (now, batch_size))
+            count = cur.rowcount
+
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+        if pause:
+            time.sleep(pause)
+
+def count_sessions() -> int:
+    """会话表的行数"""
+    with cursor() as cur:
+        return cur.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
@@ -1,26 +1,30 @@
 import os
-import sqlite3
-import hashlib
 import sys
 
+# 添加当前目录的父目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import db_utils
+
 # 数据库文件路径
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'user.db')
+DB_PATH = db_utils.DB_PATH
 
 # 默认凭据
 DEFAULT_USERNAME = "admin"
 DEFAULT_PASSWORD = "123456"
 
 def hash_password(password):
-    """使用SHA-256哈希密码"""
-    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+    """哈希密码（算法见passwords.py）"""
+    return db_utils.hash_password(password)
 
-def init_database():
+def init_database(db_path=None):
     """初始化数据库和用户表"""
+    db_path = db_path or DB_PATH
+
     # 确保目录存在
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
     
-    # 连接到数据库（如果不存在则创建）
-    conn = sqlite3.connect(DB_PATH)
+    # 连接到数据库（如果不存在则创建），同时将数据库切换为WAL模式
+    conn = db_utils.connect(db_path)
     cursor = conn.cursor()
     
     # 创建用户表
@@ -48,6 +52,9 @@ def init_database():
     )
     ''')
     
+    # 创建后续新增的表和索引（积分流水等）
+    db_utils.ensure_schema(conn)
+    
     # 检查是否已存在默认用户
     cursor.execute('SELECT id FROM users WHERE account = ?', (DEFAULT_USERNAME,))
     default_user = cursor.fetchone()
@@ -65,7 +72,7 @@ def init_database():
     conn.commit()
     conn.close()
     
-    print(f"数据库初始化完成: {DB_PATH}")
+    print(f"数据库初始化完成: {db_path}")
 
 if __name__ == "__main__":
     init_database() 
\ No newline at end of file
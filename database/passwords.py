@@ -0,0 +1,134 @@
+import os
+import hmac
+import base64
+import hashlib
+from typing import Dict, Tuple
+
+# 密码哈希格式（带版本前缀，便于以后调整算法和代价参数）:
+#   scrypt$n=16384,r=8,p=1$<盐>$<哈希>
+#   pbkdf2_sha256$600000$<盐>$<哈希>
+# 没有前缀的64位十六进制字符串是旧版无盐SHA-256哈希，登录成功后会自动升级
+
+# 新密码使用的算法
+PASSWORD_HASHER = os.environ.get('SD_WEBUI_PASSWORD_HASHER', 'scrypt')
+
+# scrypt代价参数；n每翻一倍，耗时和内存（128 * n * r 字节）也翻一倍
+SCRYPT_N = int(os.environ.get('SD_WEBUI_SCRYPT_N', 2 ** 14))
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# PBKDF2迭代次数
+PBKDF2_ITERATIONS = int(os.environ.get('SD_WEBUI_PBKDF2_ITERATIONS', 600000))
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+
+def b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def b64decode(text: str) -> bytes:
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+class ScryptHasher:
+    name = 'scrypt'
+
+    def __init__(self, n: int = SCRYPT_N, r: int = SCRYPT_R, p: int = SCRYPT_P):
+        self.n = n
+        self.r = r
+        self.p = p
+
+    @staticmethod
+    def parse_params(params: str) -> Dict[str, int]:
+        return {key: int(value) for key, value in (item.split('=') for item in params.split(','))}
+
+    @staticmethod
+    def derive(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024, dklen=HASH_BYTES)
+
+    def encode(self, password: str) -> str:
+        salt = os.urandom(SALT_BYTES)
+        digest = self.derive(password, salt, self.n, self.r, self.p)
+        return f'{self.name}$n={self.n},r={self.r},p={self.p}${b64encode(salt)}${b64encode(digest)}'
+
+    def verify(self, password: str, encoded: str) -> bool:
+        _, params, salt, digest = encoded.split('$')
+        params = self.parse_params(params)
+        return hmac.compare_digest(self.derive(password, b64decode(salt), params['n'], params['r'], params['p']), b64decode(digest))
+
+    def needs_rehash(self, encoded: str) -> bool:
+        return encoded.split('$')[1] != f'n={self.n},r={self.r},p={self.p}'
+
+
+class Pbkdf2Hasher:
+    name = 'pbkdf2_sha256'
+
+    def __init__(self, iterations: int = PBKDF2_ITERATIONS):
+        self.iterations = iterations
+
+    def encode(self, password: str) -> str:
+        salt = os.urandom(SALT_BYTES)
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, self.iterations, HASH_BYTES)
+        return f'{self.name}${self.iterations}${b64encode(salt)}${b64encode(digest)}'
+
+    def verify(self, password: str, encoded: str) -> bool:
+        _, iterations, salt, digest = encoded.split('$')
+        derived = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), b64decode(salt), int(iterations), HASH_BYTES)
+        return hmac.compare_digest(derived, b64decode(digest))
+
+    def needs_rehash(self, encoded: str) -> bool:
+        return encoded.split('$')[1] != str(self.iterations)
+
+
+class LegacySha256Hasher:
+    """旧版无盐SHA-256，只用于验证已有密码"""
+
+    name = 'sha256'
+
+    def encode(self, password: str) -> str:
+        return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+    def verify(self, password: str, encoded: str) -> bool:
+        return hmac.compare_digest(self.encode(password), encoded)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        return True
+
+
+hashers = {
+    ScryptHasher.name: ScryptHasher,
+    Pbkdf2Hasher.name: Pbkdf2Hasher,
+}
+
+
+def get_hasher(name: str = None):
+    """返回指定算法（默认为PASSWORD_HASHER）的哈希器，使用当前配置的代价参数"""
+    return hashers[name or PASSWORD_HASHER]()
+
+
+def identify(encoded: str):
+    """根据哈希字符串的前缀返回能验证它的哈希器"""
+    name = encoded.split('$', 1)[0] if '$' in encoded else LegacySha256Hasher.name
+    if name == LegacySha256Hasher.name:
+        return LegacySha256Hasher()
+
+    return get_hasher(name)
+
+
+def hash_password(password: str) -> str:
+    """使用当前配置的算法和代价参数哈希密码"""
+    return get_hasher().encode(password)
+
+
+def verify_password(password: str, encoded: str) -> Tuple[bool, bool]:
+    """验证密码，返回 (是否正确, 是否需要用当前配置重新哈希)"""
+    try:
+        hasher = identify(encoded)
+        if not hasher.verify(password, encoded):
+            return False, False
+    except (KeyError, ValueError):
+        return False, False
+
+    return True, hasher.name != PASSWORD_HASHER or hasher.needs_rehash(encoded)
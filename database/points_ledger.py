@@ -0,0 +1,103 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Optional, Any
+
+from database import db_utils
+
+
+class LedgerWriter:
+    """批量写入积分变化的后台线程
+
+    积分变化请求进入队列，由单个线程合并成批次，每批只占用一次SQLite写锁、一次提交；
+    批次中的每个请求都在自己的SAVEPOINT中执行，互不影响。
+    """
+
+    def __init__(self, max_batch: int = 256, max_delay: float = 0.005):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+        self.batches = 0
+        self.requests = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="points_ledger", daemon=True)
+                self.thread.start()
+
+    def submit(self, user_id: int, delta: int, idempotency_key: Optional[str] = None, reason: str = '') -> Future:
+        """提交一次积分变化，返回的Future结果格式见db_utils.apply_points_change"""
+        self.start()
+
+        future = Future()
+        self.queue.put(((user_id, delta, idempotency_key, reason), future))
+        return future
+
+    async def submit_async(self, user_id: int, delta: int, idempotency_key: Optional[str] = None, reason: str = '') -> Dict[str, Any]:
+        return await asyncio.wrap_future(self.submit(user_id, delta, idempotency_key, reason))
+
+    def run(self):
+        conn = db_utils.connect()
+        conn.isolation_level = None  # 手动管理事务和SAVEPOINT
+
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_delay
+
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            self.write_batch(conn, batch)
+
+    def write_batch(self, conn, batch):
+        results = []
+
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for args, _ in batch:
+                conn.execute('SAVEPOINT points_change')
+                try:
+                    results.append(db_utils.apply_points_change(conn, *args))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO points_change')
+                    results.append(e)
+                conn.execute('RELEASE points_change')
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            results = [e] * len(batch)
+
+        self.batches += 1
+        self.requests += len(batch)
+
+        for (args, future), result in zip(batch, results):
+            db_utils.session_cache.invalidate_user(args[0])
+
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queued': self.queue.qsize(),
+            'batches': self.batches,
+            'requests': self.requests,
+            'average_batch_size': self.requests / self.batches if self.batches else 0.0,
+        }
+
+
+ledger_writer = LedgerWriter()
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Any
+
+
+class SessionCache:
+    """按会话令牌缓存validate_session结果的LRU+TTL缓存
+
+    只在当前进程内有效：其他进程（例如user_mgmt.py）修改的数据最多在ttl秒后可见。
+    """
+
+    def __init__(self, max_size: int = 4096, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple] = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """返回缓存的会话数据副本；未命中、缓存过期或会话本身已过期时返回None"""
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            cached_at, session = entry
+            if now - cached_at > self.ttl or session['expires_at'] < now:
+                del self.entries[token]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(token)
+            self.hits += 1
+
+        return dict(session)
+
+    def put(self, token: str, session: Dict[str, Any]):
+        with self.lock:
+            self.entries[token] = (time.time(), dict(session))
+            self.entries.move_to_end(token)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, token: str):
+        with self.lock:
+            if self.entries.pop(token, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_user(self, user_id: int):
+        """移除某个用户的全部会话，用于积分或资料变化后"""
+        with self.lock:
+            tokens = [token for token, (_, session) in self.entries.items() if session['user_id'] == user_id]
+            for token in tokens:
+                del self.entries[token]
+            self.invalidations += len(tokens)
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
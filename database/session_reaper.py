@@ -0,0 +1,88 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Any
+
+from database import db_utils
+
+logger = logging.getLogger("session_reaper")
+
+# 清理间隔（秒）
+REAP_INTERVAL = float(os.environ.get('SD_WEBUI_SESSION_REAP_INTERVAL', 600))
+
+# 每个事务最多删除的会话数，以及批次之间的等待时间（秒）
+REAP_BATCH_SIZE = int(os.environ.get('SD_WEBUI_SESSION_REAP_BATCH_SIZE', 500))
+REAP_BATCH_PAUSE = 0.05
+
+
+class SessionReaper:
+    """定期分批删除过期会话的后台线程"""
+
+    def __init__(self, interval: float = REAP_INTERVAL, batch_size: int = REAP_BATCH_SIZE, pause: float = REAP_BATCH_PAUSE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.thread = None
+        self.stop_event = threading.Event()
+
+        self.runs = 0
+        self.total_deleted = 0
+        self.last_deleted = 0
+        self.last_duration = 0.0
+        self.last_run = None
+        self.table_size = None
+        self.last_error = None
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="session_reaper", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.reap()
+            self.stop_event.wait(self.interval)
+
+    def reap(self) -> int:
+        """执行一次清理，返回删除的会话数"""
+        start = time.perf_counter()
+
+        try:
+            deleted = db_utils.clean_expired_sessions(batch_size=self.batch_size, pause=self.pause)
+            self.table_size = db_utils.count_sessions()
+            self.last_error = None
+        except Exception as e:
+            logger.exception("清理过期会话时出错")
+            self.last_error = str(e)
+            deleted = 0
+
+        self.runs += 1
+        self.last_deleted = deleted
+        self.total_deleted += deleted
+        self.last_duration = time.perf_counter() - start
+        self.last_run = time.time()
+
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'table_size': self.table_size,
+            'runs': self.runs,
+            'last_run': self.last_run,
+            'last_duration': self.last_duration,
+            'last_deleted': self.last_deleted,
+            'total_deleted': self.total_deleted,
+            'last_error': self.last_error,
+            'interval': self.interval,
+            'batch_size': self.batch_size,
+        }
+
+
+session_reaper = SessionReaper()
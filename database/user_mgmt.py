@@ -3,6 +3,7 @@
 
 import os
 import sys
+import time
 import argparse
 import sqlite3
 from pathlib import Path
@@ -45,9 +46,24 @@ def update_points(user_id, points_delta):
     else:
         print(f"更新积分失败：用户ID可能不存在")
 
+def show_ledger(user_id, limit):
+    """列出用户最近的积分流水"""
+    entries = db_utils.get_points_ledger(user_id, limit)
+
+    if not entries:
+        print(f"用户(ID: {user_id})没有积分流水")
+        return
+
+    print(f"{'时间':<20} | {'变化':<6} | {'余额':<6} | {'原因':<15} | {'幂等键'}")
+    print("-" * 80)
+
+    for entry in entries:
+        created_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['created_at']))
+        print(f"{created_at:<20} | {entry['delta']:<6} | {entry['balance']:<6} | {entry['reason'] or '':<15} | {entry['idempotency_key'] or ''}")
+
 def clean_sessions():
     """清理过期会话"""
-    deleted_count = db_utils.clean_expired_sessions()
+    deleted_count = db_utils.clean_expired_sessions(batch_size=500)
     print(f"已清理 {deleted_count} 个过期会话")
 
 def main():
@@ -70,6 +86,11 @@ def main():
     points_parser.add_argument('--user-id', '-id', type=int, required=True, help='用户ID')
     points_parser.add_argument('--delta', '-d', type=int, required=True, help='积分变化量（可为负）')
     
+    # 积分流水命令
+    ledger_parser = subparsers.add_parser('ledger', help='查看用户积分流水')
+    ledger_parser.add_argument('--user-id', '-id', type=int, required=True, help='用户ID')
+    ledger_parser.add_argument('--limit', '-n', type=int, default=50, help='显示条数')
+    
     # 清理会话命令
     clean_parser = subparsers.add_parser('clean', help='清理过期会话')
     
@@ -81,6 +102,8 @@ def main():
         add_user(args.username, args.account, args.password, args.email, args.points)
     elif args.command == 'points':
         update_points(args.user_id, args.delta)
+    elif args.command == 'ledger':
+        show_ledger(args.user_id, args.limit)
     elif args.command == 'clean':
         clean_sessions()
     else:
@@ -55,6 +55,9 @@ class ExtraNetworkLora(extra_networks.ExtraNetwork):
             if p.lora_hashes:
                 p.extra_generation_params["Lora hashes"] = ', '.join(f'{k}: {v}' for k, v in p.lora_hashes.items())
 
+        if shared.opts.lora_functional and networks.loaded_networks:
+            p.extra_generation_params["Lora runtime"] = True
+
     def deactivate(self, p):
         if self.errors:
             p.comment("Networks with errors: " + ", ".join(f"{k} ({v})" for k, v in self.errors.items()))
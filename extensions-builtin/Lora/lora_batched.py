@@ -0,0 +1,101 @@
+"""
+Computing Lora up @ down products for many layers at once.
+
+Layers whose up and down matrices have the same shapes are stacked and multiplied with a single torch.bmm call on the
+layer's device, instead of one matmul and one host-to-device copy per layer.
+
+Run `python extensions-builtin/Lora/lora_batched.py` to compare the time to apply 5 Loras to the linear layers of an
+SDXL-sized UNet one layer at a time and in batches. The UNet weights alone take about 5 GB.
+"""
+
+import time
+
+import torch
+
+# upper limit for the size of results of a single bmm call
+max_batch_bytes = 256 * 1024 * 1024
+
+
+def batched_products(pairs, device, dtype=None):
+    """
+    Takes a list of (up, down) 2D matrices; yields (index into pairs, up @ down on device) for all of them.
+    Results for matrices with the same shapes are calculated together.
+    """
+
+    groups = {}
+    for i, (up, down) in enumerate(pairs):
+        groups.setdefault((up.shape, down.shape, up.dtype), []).append(i)
+
+    for (up_shape, down_shape, up_dtype), indices in groups.items():
+        element_size = torch.empty((), dtype=dtype or up_dtype).element_size()
+        batch_size = max(1, max_batch_bytes // (up_shape[0] * down_shape[1] * element_size))
+
+        for start in range(0, len(indices), batch_size):
+            batch = indices[start:start + batch_size]
+            ups = torch.stack([pairs[i][0] for i in batch]).to(device=device, dtype=dtype)
+            downs = torch.stack([pairs[i][1] for i in batch]).to(device=device, dtype=dtype)
+
+            for i, product in zip(batch, torch.bmm(ups, downs)):
+                yield i, product
+
+
+def sdxl_unet_linear_shapes():
+    """(out features, in features) of linear layers in transformer blocks of SDXL UNet, which is what Loras usually train."""
+
+    shapes = []
+    for dim, transformer_blocks, attention_blocks in [(640, 10, 5), (1280, 60, 6)]:
+        for _ in range(transformer_blocks):
+            shapes += [(dim, dim)] * 4  # attn1 q, k, v, out
+            shapes += [(dim, dim), (dim, 2048), (dim, 2048), (dim, dim)]  # attn2 q, k, v, out
+            shapes += [(dim * 8, dim), (dim, dim * 4)]  # ff
+
+        shapes += [(dim, dim)] * 2 * attention_blocks  # proj_in, proj_out
+
+    return shapes
+
+
+def benchmark(networks=5, rank=32, device="cuda", dtype=torch.float16):
+    """Returns seconds it takes to apply networks Loras of the given rank to SDXL UNet layers, per layer and batched."""
+
+    shapes = sdxl_unet_linear_shapes()
+    weights = [torch.zeros(shape, device=device, dtype=dtype) for shape in shapes]
+    loras = [[(torch.randn(out_features, rank, dtype=dtype) / rank, torch.randn(rank, in_features, dtype=dtype)) for out_features, in_features in shapes] for _ in range(networks)]
+
+    def synchronize():
+        if torch.device(device).type == 'cuda':
+            torch.cuda.synchronize()
+
+    def apply_per_layer():
+        for pairs in loras:
+            for weight, (up, down) in zip(weights, pairs):
+                weight += up.to(device) @ down.to(device)
+
+    def apply_batched():
+        for pairs in loras:
+            for i, product in batched_products(pairs, device):
+                weights[i] += product
+
+    res = {}
+    for mode, func in [("per layer", apply_per_layer), ("batched", apply_batched)]:
+        func()
+        synchronize()
+
+        start = time.perf_counter()
+        func()
+        synchronize()
+        res[mode] = time.perf_counter() - start
+
+    return res
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark applying Loras to SDXL UNet linear layers per layer and in batches")
+    parser.add_argument("--networks", type=int, default=5)
+    parser.add_argument("--rank", type=int, default=32)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    for mode, seconds in benchmark(args.networks, args.rank, args.device).items():
+        print(f"{mode:>10}: {seconds * 1000:.0f} ms for {args.networks} Loras")
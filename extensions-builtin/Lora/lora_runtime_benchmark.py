@@ -0,0 +1,86 @@
+"""
+Compares the two ways of using Lora networks on the linear layers of an SDXL-sized UNet:
+
+- merged (default): Lora weights are added to the layer weights when the set of networks changes. Switching networks costs
+  one merge; after that every step runs at the speed of the model without networks.
+- runtime ("Lora/Networks: use old method" option): layer weights are not changed, and every layer computes
+  x @ down @ up * scale for each network in addition to its own output. Switching networks is free, but every step
+  is slower, more so with more networks, and Lora weights stay in VRAM while in use.
+
+Runtime mode is faster when networks change more often than every (merge time / extra time per step) steps, which is
+what the benchmark reports. Run `python extensions-builtin/Lora/lora_runtime_benchmark.py`; the UNet weights take about 5 GB.
+"""
+
+import time
+
+import torch
+
+import lora_batched
+
+tokens_for_dim = {640: 4096, 1280: 1024}
+context_dim = 2048
+context_tokens = 77
+
+
+def benchmark(networks=5, rank=32, batch_size=2, device="cuda", dtype=torch.float16):
+    """Returns a dict with seconds it takes to merge networks into weights and to run a step in each mode."""
+
+    shapes = lora_batched.sdxl_unet_linear_shapes()
+    weights = [torch.zeros(shape, device=device, dtype=dtype) for shape in shapes]
+    loras = [[(torch.randn(out_features, rank, device=device, dtype=dtype) / rank, torch.randn(rank, in_features, device=device, dtype=dtype)) for out_features, in_features in shapes] for _ in range(networks)]
+    inputs = [torch.randn(batch_size * (context_tokens if in_features == context_dim else tokens_for_dim[min(out_features, in_features)]), in_features, device=device, dtype=dtype) for out_features, in_features in shapes]
+
+    def synchronize():
+        if torch.device(device).type == 'cuda':
+            torch.cuda.synchronize()
+
+    def merge():
+        for pairs in loras:
+            for i, product in lora_batched.batched_products(pairs, device):
+                weights[i] += product
+
+    def merged_step():
+        for x, weight in zip(inputs, weights):
+            torch.nn.functional.linear(x, weight)
+
+    def runtime_step():
+        for i, (x, weight) in enumerate(zip(inputs, weights)):
+            y = torch.nn.functional.linear(x, weight)
+            for pairs in loras:
+                up, down = pairs[i]
+                y += torch.nn.functional.linear(torch.nn.functional.linear(x, down), up)
+
+    res = {}
+    for name, func in [("merge", merge), ("merged step", merged_step), ("runtime step", runtime_step)]:
+        func()
+        synchronize()
+
+        start = time.perf_counter()
+        func()
+        synchronize()
+        res[name] = time.perf_counter() - start
+
+    res["lora weights MB"] = sum(t.numel() * t.element_size() for pairs in loras for pair in pairs for t in pair) / 1024 / 1024
+
+    return res
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark merged and runtime Lora modes on SDXL UNet linear layers")
+    parser.add_argument("--networks", type=int, default=5)
+    parser.add_argument("--rank", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=2, help="2 for one image with CFG")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    res = benchmark(args.networks, args.rank, args.batch_size, args.device)
+
+    print(f"merge networks: {res['merge'] * 1000:.0f} ms")
+    print(f"  merged step: {res['merged step'] * 1000:.1f} ms")
+    print(f" runtime step: {res['runtime step'] * 1000:.1f} ms, +{res['lora weights MB']:.0f} MB of Lora weights on device")
+
+    extra = res["runtime step"] - res["merged step"]
+    if extra > 0:
+        print(f"runtime mode is faster when networks change at least every {res['merge'] / extra:.0f} steps")
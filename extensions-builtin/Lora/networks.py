@@ -3,7 +3,10 @@ import gradio as gr
 import logging
 import os
 import re
+import weakref
+from collections import OrderedDict
 
+import lora_batched
 import lora_patches
 import network
 import network_lora
@@ -18,7 +21,7 @@ import network_oft
 import torch
 from typing import Union
 
-from modules import shared, devices, sd_models, errors, scripts, sd_hijack
+from modules import shared, devices, sd_models, errors, scripts, sd_hijack, hashing_service, dir_index
 import modules.textual_inversion.textual_inversion as textual_inversion
 import modules.models.sd3.mmdit
 
@@ -145,6 +148,8 @@ def assign_network_names_to_compvis_modules(sd_model):
         module.network_layer_name = network_name
 
     sd_model.network_layer_mapping = network_layer_mapping
+    sd_model.network_batched_names = None
+    merged_weights_cache.clear()
 
 
 class BundledTIHash(str):
@@ -373,6 +378,108 @@ def allowed_layer_without_weight(layer):
     return False
 
 
+class MergedWeightsCache:
+    """
+    Keeps layer weights with a set of networks already merged in, for a few recently used sets of networks, so that
+    switching back to one of them replaces the layer's weight tensors instead of recalculating and applying the deltas.
+
+    Cached tensors are the ones the layer was using, so they stay on the same device; layers using a cached tensor must not
+    modify it in place, see detach_merged_weights.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.sizes = {}
+
+    def limit(self):
+        return int(shared.opts.lora_merged_weights_cache_mb * 1024 * 1024)
+
+    def get(self, layer, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        weights = entry.get(layer)
+        if weights is None or weights[0].device != layer.weight.device or weights[0].shape != layer.weight.shape:
+            return None
+
+        self.entries.move_to_end(key)
+        return weights
+
+    def store(self, layer, key):
+        limit = self.limit()
+        if limit <= 0:
+            return
+
+        weight = layer.weight.data
+        bias = layer.bias.data if getattr(layer, 'bias', None) is not None else None
+
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = weakref.WeakKeyDictionary()
+            self.sizes[key] = 0
+
+        self.entries.move_to_end(key)
+        self.discard_layer(layer, key)
+        entry[layer] = (weight, bias)
+        self.sizes[key] += tensor_size(weight) + tensor_size(bias)
+        layer.network_weights_cached = True
+
+        while self.entries and sum(self.sizes.values()) > limit:
+            oldest = next(iter(self.entries))
+            self.entries.pop(oldest)
+            self.sizes.pop(oldest)
+
+    def discard_layer(self, layer, key=None):
+        for entry_key in [key] if key is not None else list(self.entries):
+            weights = self.entries[entry_key].pop(layer, None)
+            if weights is not None:
+                self.sizes[entry_key] -= tensor_size(weights[0]) + tensor_size(weights[1])
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+
+
+def tensor_size(t):
+    return 0 if t is None else t.numel() * t.element_size()
+
+
+def merged_weights_cache_enabled(layer):
+    if shared.opts.lora_merged_weights_cache_mb <= 0 or getattr(shared.sd_model, 'lowvram', False):
+        return False
+
+    return not isinstance(layer, torch.nn.MultiheadAttention) and hasattr(layer, 'weight')
+
+
+def apply_merged_weights(self, weights):
+    weight, bias = weights
+
+    self.weight.data = weight
+    if bias is None:
+        if getattr(self, 'bias', None) is not None:
+            self.bias = None
+    elif self.bias is None:
+        self.bias = torch.nn.Parameter(bias, requires_grad=False)
+    else:
+        self.bias.data = bias
+
+    self.network_weights_cached = True
+
+
+def detach_merged_weights(self):
+    """Gives the layer its own weight tensors if the ones it uses are in the cache, so that they can be modified in place."""
+
+    if not getattr(self, 'network_weights_cached', False):
+        return
+
+    self.weight.data = torch.empty_like(self.weight)
+    if getattr(self, 'bias', None) is not None:
+        self.bias.data = torch.empty_like(self.bias)
+
+    self.network_weights_cached = False
+
+
 def store_weights_backup(weight):
     if weight is None:
         return None
@@ -395,6 +502,8 @@ def network_restore_weights_from_backup(self: Union[torch.nn.Conv2d, torch.nn.Li
     if weights_backup is None and bias_backup is None:
         return
 
+    detach_merged_weights(self)
+
     if weights_backup is not None:
         if isinstance(self, torch.nn.MultiheadAttention):
             restore_weights_backup(self, 'in_proj_weight', weights_backup[0])
@@ -408,24 +517,11 @@ def network_restore_weights_from_backup(self: Union[torch.nn.Conv2d, torch.nn.Li
         restore_weights_backup(self, 'bias', bias_backup)
 
 
-def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn.GroupNorm, torch.nn.LayerNorm, torch.nn.MultiheadAttention]):
-    """
-    Applies the currently selected set of networks to the weights of torch layer self.
-    If weights already have this particular set of networks applied, does nothing.
-    If not, restores original weights from backup and alters weights according to networks.
-    """
-
-    network_layer_name = getattr(self, 'network_layer_name', None)
-    if network_layer_name is None:
-        return
-
-    current_names = getattr(self, "network_current_names", ())
-    wanted_names = tuple((x.name, x.te_multiplier, x.unet_multiplier, x.dyn_dim) for x in loaded_networks)
-
+def network_backup_weights(self, current_names, wanted_names):
     weights_backup = getattr(self, "network_weights_backup", None)
     if weights_backup is None and wanted_names != ():
         if current_names != () and not allowed_layer_without_weight(self):
-            raise RuntimeError(f"{network_layer_name} - no backup weights found and current weights are not unchanged")
+            raise RuntimeError(f"{self.network_layer_name} - no backup weights found and current weights are not unchanged")
 
         if isinstance(self, torch.nn.MultiheadAttention):
             weights_backup = (store_weights_backup(self.in_proj_weight), store_weights_backup(self.out_proj.weight))
@@ -450,9 +546,143 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
 
         self.network_bias_backup = bias_backup
 
+
+def batched_apply_supported(layer, network_modules):
+    if not isinstance(layer, (torch.nn.Linear, torch.nn.Conv2d)) or isinstance(layer, modules.models.sd3.mmdit.QkvLinear):
+        return False
+
+    if getattr(layer, 'fp16_weight', None) is not None:
+        return False
+
+    return all(isinstance(module, network_lora.NetworkModuleLora) and module.mid_model is None and module.dora_scale is None and module.bias is None for module in network_modules)
+
+
+def lora_matrices(module):
+    up = module.up_model.weight
+    down = module.down_model.weight
+    up = up.reshape(up.size(0), -1)
+    down = down.reshape(down.size(0), -1)
+
+    dyn_dim = module.network.dyn_dim
+    if dyn_dim is not None:
+        up = up[:, :dyn_dim]
+        down = down[:dyn_dim, :]
+
+    return up, down
+
+
+def apply_lora_product(layer, module, product):
+    down = module.down_model.weight
+    output_shape = [product.size(0), down.size(1), *down.shape[2:]]
+
+    updown, _ = module.finalize_updown(product.reshape(output_shape), layer.weight, output_shape)
+
+    if len(layer.weight.shape) == 4 and layer.weight.shape[1] == 9:
+        # inpainting model. zero pad updown to make channel[1]  4 to 9
+        updown = torch.nn.functional.pad(updown, (0, 0, 0, 0, 0, 5))
+
+    layer.weight.copy_((layer.weight.to(dtype=updown.dtype) + updown).to(dtype=layer.weight.dtype))
+
+
+def network_apply_weights_batched(sd_model, wanted_names):
+    """
+    Applies the currently selected set of networks to all layers of the model that they change at once, calculating Lora
+    weights for layers of the same shape together. Layers with other kinds of networks are left to network_apply_weights.
+    """
+
+    sd_model.network_batched_names = wanted_names
+    layer_mapping = getattr(sd_model, 'network_layer_mapping', {})
+
+    layers = {}
+    for net in loaded_networks:
+        for network_layer_name, module in net.modules.items():
+            layer = layer_mapping.get(network_layer_name)
+            if layer is not None:
+                layers.setdefault(layer, []).append(module)
+
+    batched = []
+    for layer, network_modules in layers.items():
+        current_names = getattr(layer, "network_current_names", ())
+        if current_names == wanted_names or not batched_apply_supported(layer, network_modules):
+            continue
+
+        network_backup_weights(layer, current_names, wanted_names)
+
+        # switching to cached weights is faster still
+        if merged_weights_cache_enabled(layer) and merged_weights_cache.get(layer, wanted_names) is not None:
+            continue
+
+        network_restore_weights_from_backup(layer)
+        batched.append(layer)
+
+    modified = set()
+    with torch.no_grad():
+        for net in loaded_networks:
+            by_device = {}
+            for layer in batched:
+                module = net.modules.get(layer.network_layer_name)
+                if module is not None:
+                    by_device.setdefault(layer.weight.device, []).append((layer, module))
+
+            for device, items in by_device.items():
+                pairs = [lora_matrices(module) for _, module in items]
+
+                for i, product in lora_batched.batched_products(pairs, device):
+                    layer, module = items[i]
+                    try:
+                        apply_lora_product(layer, module, product)
+                        modified.add(layer)
+                    except RuntimeError as e:
+                        logging.debug(f"Network {net.name} layer {layer.network_layer_name}: {e}")
+                        extra_network_lora.errors[net.name] = extra_network_lora.errors.get(net.name, 0) + 1
+
+    for layer in batched:
+        layer.network_current_names = wanted_names
+
+        if layer in modified and merged_weights_cache_enabled(layer):
+            merged_weights_cache.store(layer, wanted_names)
+
+
+def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn.GroupNorm, torch.nn.LayerNorm, torch.nn.MultiheadAttention]):
+    """
+    Applies the currently selected set of networks to the weights of torch layer self.
+    If weights already have this particular set of networks applied, does nothing.
+    If not, restores original weights from backup and alters weights according to networks.
+    """
+
+    network_layer_name = getattr(self, 'network_layer_name', None)
+    if network_layer_name is None:
+        return
+
+    current_names = getattr(self, "network_current_names", ())
+    wanted_names = tuple((x.name, x.te_multiplier, x.unet_multiplier, x.dyn_dim, x.mtime) for x in loaded_networks)
+
+    network_backup_weights(self, current_names, wanted_names)
+
     if current_names != wanted_names:
+        if getattr(shared.sd_model, 'network_batched_names', None) != wanted_names:
+            # forget the previous set, so that switching A -> no networks -> A applies A in batches again
+            shared.sd_model.network_batched_names = None
+
+            if wanted_names != () and shared.opts.lora_batched_apply:
+                network_apply_weights_batched(shared.sd_model, wanted_names)
+
+                if getattr(self, "network_current_names", ()) == wanted_names:
+                    return
+
+        use_cache = merged_weights_cache_enabled(self)
+        if use_cache:
+            weights = merged_weights_cache.get(self, wanted_names)
+            if weights is not None:
+                apply_merged_weights(self, weights)
+                self.network_current_names = wanted_names
+                return
+
         network_restore_weights_from_backup(self)
 
+        # only layers that some network changed are worth caching; the rest are the same as the backup
+        modified = False
+
         for net in loaded_networks:
             module = net.modules.get(network_layer_name, None)
             if module is not None and hasattr(self, 'weight') and not isinstance(module, modules.models.sd3.mmdit.QkvLinear):
@@ -478,6 +708,8 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
                                 self.bias = torch.nn.Parameter(ex_bias).to(self.weight.dtype)
                             else:
                                 self.bias.copy_((bias + ex_bias).to(dtype=self.bias.dtype))
+
+                        modified = True
                 except RuntimeError as e:
                     logging.debug(f"Network {net.name} layer {network_layer_name}: {e}")
                     extra_network_lora.errors[net.name] = extra_network_lora.errors.get(net.name, 0) + 1
@@ -509,6 +741,7 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
                         else:
                             self.out_proj.bias += ex_bias
 
+                    modified = True
                 except RuntimeError as e:
                     logging.debug(f"Network {net.name} layer {network_layer_name}: {e}")
                     extra_network_lora.errors[net.name] = extra_network_lora.errors.get(net.name, 0) + 1
@@ -527,6 +760,7 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
                         updown_qkv = torch.vstack([updown_q, updown_k, updown_v])
                         self.weight += updown_qkv
 
+                    modified = True
                 except RuntimeError as e:
                     logging.debug(f"Network {net.name} layer {network_layer_name}: {e}")
                     extra_network_lora.errors[net.name] = extra_network_lora.errors.get(net.name, 0) + 1
@@ -541,21 +775,29 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
 
         self.network_current_names = wanted_names
 
+        if use_cache and modified:
+            merged_weights_cache.store(self, wanted_names)
+
 
 def network_forward(org_module, input, original_forward):
     """
     Old way of applying Lora by executing operations during layer's forward.
     Stacking many loras this way results in big performance degradation.
+
+    Layer weights are not changed, so switching networks between generations costs nothing; see lora_runtime_benchmark.py.
     """
 
+    if getattr(org_module, 'network_current_names', ()) != ():
+        # networks were merged into weights by a generation that didn't use this mode
+        network_restore_weights_from_backup(org_module)
+        network_reset_cached_weight(org_module)
+        shared.sd_model.network_batched_names = None
+
     if len(loaded_networks) == 0:
         return original_forward(org_module, input)
 
     input = devices.cond_cast_unet(input)
 
-    network_restore_weights_from_backup(org_module)
-    network_reset_cached_weight(org_module)
-
     y = original_forward(org_module, input)
 
     network_layer_name = getattr(org_module, 'network_layer_name', None)
@@ -570,6 +812,8 @@ def network_forward(org_module, input, original_forward):
 
 
 def network_reset_cached_weight(self: Union[torch.nn.Conv2d, torch.nn.Linear]):
+    merged_weights_cache.discard_layer(self)
+    self.network_weights_cached = False
     self.network_current_names = ()
     self.network_weights_backup = None
     self.network_bias_backup = None
@@ -648,8 +892,8 @@ def network_MultiheadAttention_load_state_dict(self, *args, **kwargs):
 
 
 def process_network_files(names: list[str] | None = None):
-    candidates = list(shared.walk_files(shared.cmd_opts.lora_dir, allowed_extensions=[".pt", ".ckpt", ".safetensors"]))
-    candidates += list(shared.walk_files(shared.cmd_opts.lyco_dir_backcompat, allowed_extensions=[".pt", ".ckpt", ".safetensors"]))
+    candidates = dir_index.walk_files(shared.cmd_opts.lora_dir, allowed_extensions=[".pt", ".ckpt", ".safetensors"])
+    candidates += dir_index.walk_files(shared.cmd_opts.lyco_dir_backcompat, allowed_extensions=[".pt", ".ckpt", ".safetensors"])
     for filename in candidates:
         if os.path.isdir(filename):
             continue
@@ -665,6 +909,9 @@ def process_network_files(names: list[str] | None = None):
 
         available_networks[name] = entry
 
+        if not entry.hash:
+            hashing_service.submit(entry.filename, "lora/" + entry.name, use_addnet_hash=entry.is_safetensors, callback=entry.set_hash)
+
         if entry.alias in available_network_aliases:
             forbidden_network_aliases[entry.alias.lower()] = 1
 
@@ -731,6 +978,7 @@ available_network_aliases = {}
 loaded_networks = []
 loaded_bundle_embeddings = {}
 networks_in_memory = {}
+merged_weights_cache = MergedWeightsCache()
 available_network_hash_lookup = {}
 forbidden_network_aliases = {}
 
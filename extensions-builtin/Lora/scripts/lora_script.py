@@ -40,13 +40,15 @@ shared.options_templates.update(shared.options_section(('extra_networks', "Extra
     "lora_show_all": shared.OptionInfo(False, "Always show all networks on the Lora page").info("otherwise, those detected as for incompatible version of Stable Diffusion will be hidden"),
     "lora_hide_unknown_for_versions": shared.OptionInfo([], "Hide networks of unknown versions for model versions", gr.CheckboxGroup, {"choices": ["SD1", "SD2", "SDXL"]}),
     "lora_in_memory_limit": shared.OptionInfo(0, "Number of Lora networks to keep cached in memory", gr.Number, {"precision": 0}),
+    "lora_merged_weights_cache_mb": shared.OptionInfo(0, "Memory for model weights with Lora networks already applied, in MB", gr.Number, {"precision": 0}).info("switching back to a recently used combination of networks and weights reuses them instead of applying networks again; uses VRAM; 0 = disable"),
+    "lora_batched_apply": shared.OptionInfo(False, "Apply Lora networks to all layers at once").info("calculates weights for layers of the same shape together; faster when switching networks"),
     "lora_not_found_warning_console": shared.OptionInfo(False, "Lora not found warning in console"),
     "lora_not_found_gradio_warning": shared.OptionInfo(False, "Lora not found warning popup in webui"),
 }))
 
 
 shared.options_templates.update(shared.options_section(('compatibility', "Compatibility"), {
-    "lora_functional": shared.OptionInfo(False, "Lora/Networks: use old method that takes longer when you have multiple Loras active and produces same results as kohya-ss/sd-webui-additional-networks extension"),
+    "lora_functional": shared.OptionInfo(False, "Lora/Networks: use old method that takes longer when you have multiple Loras active and produces same results as kohya-ss/sd-webui-additional-networks extension", infotext="Lora runtime").info("networks are calculated in every step instead of being merged into model weights: switching networks is free, but steps are slower and Lora weights stay in VRAM; can be set per request with override_settings"),
 }))
 
 
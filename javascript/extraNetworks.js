@@ -108,6 +108,12 @@ function setupExtraNetworksForTab(tabname) {
             parent.appendChild(frag);
         };
 
+        if (opts.extra_networks_cards_page_size > 0) {
+            var paginated = setupPaginatedCards(tabname, tabname_full, search, sort_dir);
+            applyFilter = paginated.applyFilter;
+            applySort = paginated.applySort;
+        }
+
         search.addEventListener("input", function() {
             applyFilter();
         });
@@ -128,6 +134,129 @@ function setupExtraNetworksForTab(tabname) {
     registerPrompt(tabname, tabname + "_neg_prompt");
 }
 
+function setupPaginatedCards(tabname, tabname_full, search, sort_dir) {
+    // cards are requested from the server one page at a time; search and sort are done by the server
+    var extra_networks_tabname = tabname_full.substring(tabname.length + 1);
+    var sentinel = null;
+    var requestId = 0;
+    var loading = false;
+    var loadedCount = 0;
+    var totalCount = null;
+    var loadedQuery = null;
+    var searchTimeout = null;
+
+    var cardsParent = function() {
+        return gradioApp().querySelector('#' + tabname_full + "_cards");
+    };
+
+    var currentQuery = function() {
+        var activeSearchElem = gradioApp().querySelector('#' + tabname_full + "_controls .extra-network-control--sort.extra-network-control--enabled");
+        return {
+            page: extra_networks_tabname,
+            tabname: tabname,
+            search: search.value,
+            sort: activeSearchElem ? activeSearchElem.dataset.sortkey : "default",
+            sort_dir: sort_dir.dataset.sortdir,
+        };
+    };
+
+    var loadCards = function(reset) {
+        var query = currentQuery();
+
+        if (reset) {
+            requestId++;
+            loadedCount = 0;
+            totalCount = null;
+        } else if (loading || (totalCount !== null && loadedCount >= totalCount)) {
+            return;
+        }
+
+        var id = requestId;
+        loading = true;
+        query.offset = loadedCount;
+        query.limit = opts.extra_networks_cards_page_size;
+
+        requestGet("./sd_extra_networks/cards", query, function(data) {
+            if (id != requestId) return;
+
+            var parent = cardsParent();
+            if (reset) {
+                parent.innerHTML = '';
+            }
+
+            var frag = document.createDocumentFragment();
+            data.cards.forEach(function(card) {
+                var div = document.createElement('DIV');
+                div.innerHTML = card.html;
+                if (div.firstElementChild) {
+                    frag.appendChild(div.firstElementChild);
+                }
+            });
+            frag.appendChild(sentinel);
+            parent.appendChild(frag);
+
+            loading = false;
+            loadedCount += data.cards.length;
+            totalCount = data.total;
+            loadedQuery = JSON.stringify(currentQuery());
+        }, function() {
+            if (id == requestId) loading = false;
+        });
+    };
+
+    var observer = new IntersectionObserver(function(entries) {
+        if (entries.some(function(entry) {
+            return entry.isIntersecting;
+        })) {
+            loadCards(false);
+        }
+    });
+
+    var useSentinel = function(elem) {
+        if (sentinel) observer.unobserve(sentinel);
+        sentinel = elem;
+        observer.observe(sentinel);
+    };
+
+    // the first page comes with the tab's HTML; continue from it instead of requesting it again
+    var adoptServerPage = function() {
+        var parent = cardsParent();
+        var elem = parent ? parent.querySelector('.extra-network-cards-sentinel') : null;
+        if (!elem || elem === sentinel) return;
+
+        useSentinel(elem);
+        requestId++;
+        loading = false;
+        loadedCount = parseInt(elem.dataset.count);
+        totalCount = parseInt(elem.dataset.total);
+        loadedQuery = JSON.stringify(Object.assign(currentQuery(), {search: "", sort: elem.dataset.sort, sort_dir: elem.dataset.sortDir}));
+    };
+
+    adoptServerPage();
+    if (!sentinel) {
+        var elem = document.createElement('DIV');
+        elem.className = 'extra-network-cards-sentinel';
+        useSentinel(elem);
+    }
+
+    var reloadIfChanged = function() {
+        adoptServerPage();
+
+        var parent = cardsParent();
+        if (parent && parent.contains(sentinel) && JSON.stringify(currentQuery()) == loadedQuery) return;
+
+        loadCards(true);
+    };
+
+    return {
+        applyFilter: function() {
+            clearTimeout(searchTimeout);
+            searchTimeout = setTimeout(reloadIfChanged, 150);
+        },
+        applySort: reloadIfChanged,
+    };
+}
+
 function extraNetworksMovePromptToTab(tabname, id, showPrompt, showNegativePrompt) {
     if (!gradioApp().querySelector('.toprow-compact-tools')) return; // only applicable for compact prompt layout
 
@@ -17,7 +17,7 @@ from fastapi.encoders import jsonable_encoder
 from secrets import compare_digest
 
 import modules.shared as shared
-from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers
+from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers, hashing_service, cond_cache, request_batching
 from modules.api import models
 from modules.shared import opts
 from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images
@@ -233,6 +233,8 @@ class Api:
         self.add_api_route("/sdapi/v1/embeddings", self.get_embeddings, methods=["GET"], response_model=models.EmbeddingsResponse)
         self.add_api_route("/sdapi/v1/refresh-embeddings", self.refresh_embeddings, methods=["POST"])
         self.add_api_route("/sdapi/v1/refresh-checkpoints", self.refresh_checkpoints, methods=["POST"])
+        self.add_api_route("/sdapi/v1/hashing-progress", self.get_hashing_progress, methods=["GET"], response_model=models.HashingProgressResponse)
+        self.add_api_route("/sdapi/v1/cond-cache", self.get_cond_cache_stats, methods=["GET"], response_model=models.CondCacheResponse)
         self.add_api_route("/sdapi/v1/refresh-vae", self.refresh_vae, methods=["POST"])
         self.add_api_route("/sdapi/v1/create/embedding", self.create_embedding, methods=["POST"], response_model=models.CreateResponse)
         self.add_api_route("/sdapi/v1/create/hypernetwork", self.create_hypernetwork, methods=["POST"], response_model=models.CreateResponse)
@@ -464,6 +466,14 @@ class Api:
 
         add_task_to_queue(task_id)
 
+        if request_batching.can_batch(txt2imgreq, args, selectable_scripts):
+            request = request_batching.BatchedRequest(task_id, args, script_args)
+            processed = request_batching.scheduler.submit(request_batching.batch_key(args), request, self.queue_lock, self.process_txt2img_batch)
+
+            b64images = list(map(encode_pil_to_base64, processed.images)) if send_images else []
+
+            return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=processed.js())
+
         with self.queue_lock:
             with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)) as p:
                 p.is_api = True
@@ -489,6 +499,33 @@ class Api:
 
         return models.TextToImageResponse(images=b64images, parameters=vars(txt2imgreq), info=processed.js())
 
+    def process_txt2img_batch(self, requests):
+        """Generates images for several compatible txt2img requests in one batch; called with queue_lock held."""
+
+        leader = requests[0]
+        args, cfg_scales = request_batching.combined_args(requests)
+
+        with closing(StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **{**leader.args, **args})) as p:
+            p.is_api = True
+            p.scripts = scripts.scripts_txt2img
+            p.outpath_grids = opts.outdir_txt2img_grids
+            p.outpath_samples = opts.outdir_txt2img_samples
+            p.cfg_scales = cfg_scales
+            p.script_args = tuple(leader.script_args)
+
+            try:
+                shared.state.begin(job="scripts_txt2img")
+                for request in requests[1:] + [leader]:
+                    start_task(request.task_id)
+                processed = process_images(p)
+                for request in requests:
+                    finish_task(request.task_id)
+            finally:
+                shared.state.end()
+                shared.total_tqdm.clear()
+
+        return request_batching.split_processed(processed, requests)
+
     def img2imgapi(self, img2imgreq: models.StableDiffusionImg2ImgProcessingAPI):
         task_id = img2imgreq.force_task_id or create_task_id("img2img")
 
@@ -776,6 +813,12 @@ class Api:
         with self.queue_lock:
             shared.refresh_checkpoints()
 
+    def get_hashing_progress(self):
+        return models.HashingProgressResponse(**hashing_service.service.progress())
+
+    def get_cond_cache_stats(self):
+        return models.CondCacheResponse(**cond_cache.cache.stats())
+
     def refresh_vae(self):
         with self.queue_lock:
             shared_items.refresh_vae_list()
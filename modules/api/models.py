@@ -294,6 +294,22 @@ class EmbeddingsResponse(BaseModel):
     loaded: dict[str, EmbeddingItem] = Field(title="Loaded", description="Embeddings loaded for the current model")
     skipped: dict[str, EmbeddingItem] = Field(title="Skipped", description="Embeddings skipped for the current model (likely due to architecture incompatibility)")
 
+class HashingProgressResponse(BaseModel):
+    queued: int = Field(title="Queued", description="Number of files waiting to be hashed")
+    running: list[str] = Field(title="Running", description="Titles of files being hashed")
+    finished: int = Field(title="Finished", description="Number of files hashed since startup")
+    failed: int = Field(title="Failed", description="Number of files that could not be hashed")
+    bytes_total: int = Field(title="Total bytes", description="Total size of all files submitted for hashing")
+    bytes_done: int = Field(title="Done bytes", description="Size of files that have been hashed")
+    started_at: Optional[float] = Field(default=None, title="Started at", description="When hashing of the current set of files started")
+
+class CondCacheResponse(BaseModel):
+    entries: int = Field(title="Entries", description="Number of prompts in the shared cond cache")
+    size: int = Field(title="Size", description="Size of cached conds in bytes")
+    hits: int = Field(title="Hits", description="Number of prompts found in the cache since startup")
+    misses: int = Field(title="Misses", description="Number of prompts not found in the cache since startup")
+    hit_rate: float = Field(title="Hit rate", description="Fraction of lookups that were hits")
+
 class MemoryResponse(BaseModel):
     ram: dict = Field(title="RAM", description="System memory stats")
     cuda: dict = Field(title="CUDA", description="nVidia CUDA memory stats")
@@ -3,9 +3,14 @@ from functools import wraps
 import html
 import time
 
-from modules import shared, progress, errors, devices, fifo_lock, profiling
+from modules import shared, progress, errors, devices, fair_queue, profiling, points_metering, job_store
 
-queue_lock = fifo_lock.FIFOLock()
+queue_lock = fair_queue.FairQueueLock()
+user_limiter = fair_queue.UserLimiter(
+    max_tasks=lambda: shared.opts.queue_max_tasks_per_user,
+    rate_per_minute=lambda: shared.opts.queue_rate_limit_per_minute,
+    burst=lambda: shared.opts.queue_rate_limit_burst,
+)
 
 
 def wrap_queued_call(func):
@@ -25,25 +30,56 @@ def wrap_gradio_gpu_call(func, extra_outputs=None):
         # if the first argument is a string that says "task(...)", it is treated as a job id
         if args and type(args[0]) == str and args[0].startswith("task(") and args[0].endswith(")"):
             id_task = args[0]
-            progress.add_task_to_queue(id_task)
         else:
             id_task = None
 
-        with queue_lock:
+        session = points_metering.user_from_args(args) if id_task is not None else None
+
+        return run_gpu_task(func, id_task, session, args, kwargs)
+
+    return wrap_gradio_call(f, extra_outputs=extra_outputs, add_stats=True)
+
+
+def run_gpu_task(func, id_task, session, args, kwargs):
+    user = session['user_id'] if session else None
+
+    # per-user task cap and rate limit; tasks from different users are then served round-robin by queue_lock
+    user_limiter.admit(user)
+
+    points_job = None
+    try:
+        # hold the user's points before the task waits in the queue; settled when it finishes
+        points_job = points_metering.admit(id_task, session)
+
+        if id_task is not None:
+            progress.add_task_to_queue(id_task, user)
+            job_store.add_job(id_task, user, func, args, kwargs)
+
+        with queue_lock.for_user(user):
             shared.state.begin(job=id_task)
             progress.start_task(id_task)
+            job_store.start_job(id_task)
+            points_metering.begin(points_job)
 
+            res = None
+            error = None
             try:
                 res = func(*args, **kwargs)
                 progress.record_results(id_task, res)
+            except Exception as e:
+                error = e
+                raise
             finally:
+                points_metering.finish(points_job)
+                job_store.finish_job(id_task, res, error)
                 progress.finish_task(id_task)
 
             shared.state.end()
+    finally:
+        points_metering.finish(points_job)  # returns the hold if the task failed before it ran
+        user_limiter.release(user)
 
-        return res
-
-    return wrap_gradio_call(f, extra_outputs=extra_outputs, add_stats=True)
+    return res
 
 
 def wrap_gradio_call(func, extra_outputs=None, add_stats=False):
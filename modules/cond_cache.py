@@ -0,0 +1,151 @@
+"""
+Process-wide cache of text encoder results for single prompts, shared between all generations.
+
+A result is stored on CPU under a key made of the prompt's schedule and everything else that changes how the text
+encoder processes it (checkpoint, clip skip, extra networks, image size for SDXL...), so negative prompts and styles
+that many users share are encoded once. Size of the cache is limited by the cond_cache_mb setting.
+"""
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+
+from modules import devices, extra_networks, shared
+
+
+def map_tensors(obj, fn):
+    if isinstance(obj, torch.Tensor):
+        return fn(obj)
+    if isinstance(obj, dict):
+        return {k: map_tensors(v, fn) for k, v in obj.items()}
+    if isinstance(obj, tuple) and hasattr(obj, '_fields'):
+        return type(obj)(*[map_tensors(x, fn) for x in obj])
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(map_tensors(x, fn) for x in obj)
+
+    return obj
+
+
+def tensors_size(obj):
+    size = 0
+
+    def add(t):
+        nonlocal size
+        size += t.numel() * t.element_size()
+        return t
+
+    map_tensors(obj, add)
+    return size
+
+
+def hashable(value):
+    """Converts parameters from StableDiffusionProcessing.cached_params into something that can be used as a dict key."""
+
+    if isinstance(value, dict):
+        return tuple((k, hashable(v)) for k, v in sorted(value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(hashable(x) for x in value)
+    if isinstance(value, extra_networks.ExtraNetworkParams):
+        return hashable(value.items)
+
+    return value
+
+
+class CondCache:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def limit(self):
+        return int(shared.opts.cond_cache_mb * 1024 * 1024)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+        return map_tensors(entry[0], lambda t: t.to(devices.device))
+
+    def put(self, key, value):
+        limit = self.limit()
+        size = tensors_size(value)
+        if size > limit:
+            return
+
+        value = map_tensors(value, lambda t: t.to(devices.cpu))
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+
+            self.entries[key] = (value, size)
+            self.size += size
+
+            while self.size > limit:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+
+            return {
+                "entries": len(self.entries),
+                "size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+cache = CondCache()
+
+
+def restore_generation_params(params):
+    """Adds infotext parameters recorded while encoding a cached prompt to the current generation's."""
+
+    from modules.sd_hijack import model_hijack
+
+    for key, value in params.items():
+        if key == "TI hashes" and model_hijack.extra_generation_params.get(key):
+            value = f"{value}, {model_hijack.extra_generation_params[key]}"
+
+        model_hijack.extra_generation_params[key] = value
+
+
+@contextmanager
+def record_generation_params():
+    """
+    Collects infotext parameters that the text encoder adds to model_hijack.extra_generation_params (TI hashes, Emphasis)
+    into the yielded dict, to be stored with the cached result and restored when it's used.
+    """
+
+    from modules.sd_hijack import model_hijack
+
+    outer = model_hijack.extra_generation_params
+    params = model_hijack.extra_generation_params = {}
+    try:
+        yield params
+    finally:
+        model_hijack.extra_generation_params = outer
+        restore_generation_params(params)
+
+
+def enabled():
+    return shared.opts.cond_cache_mb > 0
@@ -1,9 +1,10 @@
 import os
+import re
 import json
 import time
+import asyncio
 import secrets
 import base64
-import hashlib
 import logging
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -11,14 +12,15 @@ from typing import Dict, Optional, Tuple, List, Any
 from fastapi import Request, Response, HTTPException, Depends, status
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import HTTPConnection
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.templating import Jinja2Templates
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
 # 数据库导入
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from database import db_utils
+from database import db_utils, points_ledger, session_reaper
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -35,6 +37,10 @@ DEFAULT_PASSWORD = "admin"
 # 会话有效期（秒）
 SESSION_EXPIRY = 24 * 60 * 60  # 24小时
 
+# 数据库操作线程池：认证相关的阻塞sqlite调用在这里执行，避免阻塞事件循环
+AUTH_DB_WORKERS = int(os.environ.get('SD_WEBUI_AUTH_DB_WORKERS', 4))
+auth_executor = ThreadPoolExecutor(max_workers=AUTH_DB_WORKERS, thread_name_prefix="auth_db")
+
 # 会话存储和配置
 active_sessions: Dict[str, Dict] = {}  # 存储活跃会话
 SESSION_COOKIE_NAME = "sd_session_id"
@@ -49,19 +55,26 @@ except Exception as e:
     logger.error(f"连接用户数据库失败: {str(e)}")
     user_db = None
 
+async def run_in_auth_pool(func, *args):
+    """在认证线程池中执行阻塞的数据库调用"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(auth_executor, func, *args)
+
+async def validate_session_async(token: str) -> Optional[Dict[str, Any]]:
+    """验证会话；会话缓存命中时直接返回，否则在线程池中查询数据库"""
+    if not token:
+        return None
+
+    cached = db_utils.session_cache.get(token)
+    if cached is not None:
+        return cached
+
+    return await run_in_auth_pool(db_utils.validate_session, token)
+
 # 安全工具函数
 def hash_password(password: str) -> str:
-    """使用SHA-256哈希密码"""
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def verify_credentials(username: str, password: str) -> bool:
-    """验证用户凭据"""
-    if user_db:
-        # 使用数据库验证
-        return user_db.verify_user(username, hash_password(password))
-    else:
-        # 使用默认凭据验证
-        return username == DEFAULT_USERNAME and password == DEFAULT_PASSWORD
+    """哈希密码（算法见database/passwords.py）"""
+    return db_utils.hash_password(password)
 
 def create_session(username: str) -> str:
     """为用户创建新会话"""
@@ -335,12 +348,12 @@ async def login_check_handler(request: Request) -> JSONResponse:
             return JSONResponse({"error": "请提供用户名和密码"}, status_code=400)
         
         # 调用数据库函数验证用户
-        user_data = db_utils.verify_user(username, password)
+        user_data = await run_in_auth_pool(db_utils.verify_user, username, password)
         
         if user_data:
             # 登录成功，创建会话
             user_id = user_data['id']
-            session_token = db_utils.create_session(user_id, SESSION_EXPIRY)
+            session_token = await run_in_auth_pool(db_utils.create_session, user_id, SESSION_EXPIRY)
             print(f"用户 '{username}' (ID: {user_id}) 登录成功，创建会话令牌")
             
             # 创建带有会话令牌的响应
@@ -389,7 +402,7 @@ async def logout_handler(request: Request) -> RedirectResponse:
         print(f"正在删除会话: {session_token[:10]}...")
         try:
             # 从数据库删除会话
-            db_utils.delete_session(session_token)
+            await run_in_auth_pool(db_utils.delete_session, session_token)
             print("会话已从数据库删除")
         except Exception as e:
             print(f"删除会话时出错: {str(e)}")
@@ -412,7 +425,7 @@ async def logout_handler(request: Request) -> RedirectResponse:
 
 async def user_info_handler(request: Request) -> JSONResponse:
     """返回当前登录用户信息"""
-    session = get_session_from_request(request)
+    session = await validate_session_async(get_session_token_from_request(request))
     
     if not session:
         return JSONResponse({"error": "未登录"}, status_code=401)
@@ -428,7 +441,11 @@ async def user_info_handler(request: Request) -> JSONResponse:
     })
 
 async def deduct_points_handler(request: Request) -> JSONResponse:
-    """处理扣除用户积分的请求"""
+    """处理扣除用户积分的请求
+
+    扣除通过points_ledger批量写入：带条件的UPDATE保证余额不会被扣成负数，
+    请求中的task_id（或Idempotency-Key请求头）作为幂等键，同一任务重复请求只扣一次。
+    """
     print("收到扣除积分请求")
     
     # 获取用户会话
@@ -438,7 +455,7 @@ async def deduct_points_handler(request: Request) -> JSONResponse:
         return JSONResponse({"success": False, "error": "未找到会话令牌"}, status_code=401)
     
     try:
-        session = db_utils.validate_session(session_token)
+        session = await validate_session_async(session_token)
         if not session:
             print("扣除积分失败：会话无效")
             return JSONResponse({"success": False, "error": "会话无效"}, status_code=401)
@@ -446,77 +463,23 @@ async def deduct_points_handler(request: Request) -> JSONResponse:
         print(f"验证会话时出错: {str(e)}")
         return JSONResponse({"success": False, "error": f"验证会话失败: {str(e)}"}, status_code=500)
     
-    # 获取要扣除的积分数量
+    # 获取要扣除的积分数量和幂等键
+    idempotency_key = request.headers.get("idempotency-key")
     try:
         data = await request.json()
         points = data.get("points", 1)  # 默认扣除1点
+        idempotency_key = data.get("task_id") or idempotency_key
         print(f"请求扣除积分: {points}点")
     except Exception as e:
         print(f"解析请求数据失败: {str(e)}")
         points = 1  # 如果没有指定，默认扣除1点
-        
-    # 获取用户当前积分
+
+    if not isinstance(points, int) or points <= 0:
+        return JSONResponse({"success": False, "error": "无效的积分数量"}, status_code=400)
+
     user_id = session.get("user_id")
-    current_points = session.get("points", 0)
-    print(f"用户ID: {user_id}, 当前积分: {current_points}")
-    
-    # 如果积分不足，返回错误
-    if current_points < points:
-        print(f"积分不足: 当前{current_points}, 需要{points}")
-        return JSONResponse({
-            "success": False,
-            "error": "积分不足",
-            "points": current_points
-        }, status_code=400)
-    
-    # 更新用户积分
-    new_points = current_points - points
     try:
-        # 更新数据库中的用户积分
-        print(f"尝试更新积分: 从{current_points}减少到{new_points}")
-        
-        # 检查update_user_points函数是否存在
-        if not hasattr(db_utils, 'update_user_points'):
-            print("警告: db_utils模块中没有update_user_points函数，尝试直接使用SQL更新")
-            # 使用SQL直接更新用户积分
-            conn = None
-            try:
-                import sqlite3
-                conn = sqlite3.connect('database/users.db')
-                cursor = conn.cursor()
-                cursor.execute("UPDATE users SET points = ? WHERE id = ?", (new_points, user_id))
-                conn.commit()
-                print(f"直接SQL更新成功，影响行数: {cursor.rowcount}")
-                if cursor.rowcount == 0:
-                    raise Exception("未找到要更新的用户记录")
-            except Exception as sql_error:
-                print(f"SQL更新出错: {str(sql_error)}")
-                raise sql_error
-            finally:
-                if conn:
-                    conn.close()
-        else:
-            # 使用db_utils模块函数更新
-            db_utils.update_user_points(user_id, new_points)
-        
-        # 更新会话中的积分
-        print("更新会话中的积分")
-        session["points"] = new_points
-        
-        # 更新会话数据
-        try:
-            db_utils.update_session(session_token, session)
-            print("会话数据已更新")
-        except Exception as session_error:
-            print(f"更新会话数据时出错: {str(session_error)}")
-            # 继续执行，不中断流程
-        
-        print(f"积分更新成功: 新积分={new_points}")
-        return JSONResponse({
-            "success": True,
-            "message": f"已扣除{points}积分",
-            "points": new_points
-        })
+        result = await points_ledger.ledger_writer.submit_async(user_id, -points, idempotency_key, "deduct_points")
     except Exception as e:
         import traceback
         print(f"扣除积分时出错: {str(e)}")
@@ -524,13 +487,52 @@ async def deduct_points_handler(request: Request) -> JSONResponse:
         return JSONResponse({
             "success": False,
             "error": f"扣除积分失败: {str(e)}",
-            "points": current_points
+            "points": session.get("points", 0)
         }, status_code=500)
 
+    if result.get("conflict"):
+        return JSONResponse({
+            "success": False,
+            "error": "幂等键已用于不同的积分变化",
+            "points": result["points"]
+        }, status_code=409)
+
+    if not result["success"]:
+        print(f"积分不足: 当前{result['points']}, 需要{points}")
+        return JSONResponse({
+            "success": False,
+            "error": "积分不足",
+            "points": result["points"]
+        }, status_code=400)
+
+    print(f"积分更新成功: 新积分={result['points']}")
+    return JSONResponse({
+        "success": True,
+        "message": f"已扣除{points}积分",
+        "points": result["points"],
+        "duplicate": result["duplicate"]
+    })
+
+async def session_cache_stats_handler(request: Request) -> JSONResponse:
+    """返回会话缓存的命中/未命中/淘汰计数，用于调整缓存大小"""
+    # /api/ 前缀不经过认证中间件，需要在这里验证会话
+    if not await validate_session_async(get_session_token_from_request(request)):
+        return JSONResponse({"error": "未登录"}, status_code=401)
+
+    return JSONResponse(db_utils.session_cache.stats())
+
+async def session_reaper_stats_handler(request: Request) -> JSONResponse:
+    """返回会话表大小和过期会话清理的耗时统计"""
+    # /api/ 前缀不经过认证中间件，需要在这里验证会话
+    if not await validate_session_async(get_session_token_from_request(request)):
+        return JSONResponse({"error": "未登录"}, status_code=401)
+
+    return JSONResponse(session_reaper.session_reaper.stats())
+
 async def index_handler(request: Request):
     """处理主页请求，确保正确重定向到Gradio接口"""
     # 检查用户是否已登录
-    session = get_session_from_request(request)
+    session = await validate_session_async(get_session_token_from_request(request))
     if not session:
         # 未登录，重定向到登录页面
         return RedirectResponse(url="/login")
@@ -554,132 +556,128 @@ async def index_handler(request: Request):
     """
     return HTMLResponse(content=html_content)
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    """认证中间件，验证用户是否已登录"""
-    
-    async def dispatch(self, request: Request, call_next):
-        """处理请求并验证认证状态"""
-        # 获取请求路径
-        path = request.url.path
-        
-        # 不需要验证的路径
-        exempt_paths = [
-            "/login", 
-            "/login_check", 
-            "/logout",      # 添加登出路径到豁免列表，确保登出请求可以正常处理
-            "/favicon.ico", 
-            "/docs", 
-            "/redoc", 
-            "/openapi.json",
-            "/auth_test",
-            "/login_debug",
-            "/navbar"  # 添加导航栏路径到豁免列表
-        ]
-        
-        # 不需要验证的路径前缀
-        exempt_prefixes = [
-            "/static/", 
-            "/file=", 
-            "/js/", 
-            "/css/", 
-            "/images/", 
-            "/fonts/",
-            "/assets/",
-            "/theme=",
-            "/api/",          # API请求
-            "/internal/",     # Gradio内部请求
-            "/run/",          # Gradio运行请求
-            "/queue/",        # Gradio队列请求
-            "/upload",        # 上传请求
-            "/file/",         # 文件请求
-            "/stream",        # 流媒体请求
-            "/ws",            # WebSocket请求
-            "/tmp/"           # 临时文件请求
-        ]
-        
-        # 检查是否是忽略的路径
-        is_exempt = path in exempt_paths or any(path.startswith(prefix) for prefix in exempt_prefixes)
-        
-        # 如果路径是 /logout，允许直接通过，确保登出功能正常工作
-        if path == "/logout":
-            return await call_next(request)
-            
-        # 特殊处理 - 检查URL查询参数，处理Gradio特定请求
-        query_string = request.url.query.decode() if hasattr(request.url.query, 'decode') else request.url.query
-        
+# 不需要验证的路径
+AUTH_EXEMPT_PATHS = [
+    "/login", 
+    "/login_check", 
+    "/logout",      # 添加登出路径到豁免列表，确保登出请求可以正常处理
+    "/favicon.ico", 
+    "/docs", 
+    "/redoc", 
+    "/openapi.json",
+    "/auth_test",
+    "/login_debug",
+    "/navbar"  # 添加导航栏路径到豁免列表
+]
+
+# 不需要验证的路径前缀
+AUTH_EXEMPT_PREFIXES = [
+    "/static/", 
+    "/file=", 
+    "/js/", 
+    "/css/", 
+    "/images/", 
+    "/fonts/",
+    "/assets/",
+    "/theme=",
+    "/api/",          # API请求
+    "/internal/",     # Gradio内部请求
+    "/run/",          # Gradio运行请求
+    "/queue/",        # Gradio队列请求
+    "/upload",        # 上传请求
+    "/file/",         # 文件请求
+    "/stream",        # 流媒体请求
+    "/ws",            # WebSocket请求
+    "/tmp/"           # 临时文件请求
+]
+
+# 额外的豁免路径/前缀，逗号分隔
+AUTH_EXEMPT_PATHS += [x for x in os.environ.get('SD_WEBUI_AUTH_EXEMPT_PATHS', '').split(',') if x]
+AUTH_EXEMPT_PREFIXES += [x for x in os.environ.get('SD_WEBUI_AUTH_EXEMPT_PREFIXES', '').split(',') if x]
+
+# 表示Gradio请求的查询参数
+GRADIO_QUERY_PARAMS = ['__theme=', 'view=', 'component=']
+
+def compile_exempt_matcher(paths: List[str], prefixes: List[str]):
+    """把豁免路径和前缀编译成一个正则表达式，返回其match方法"""
+    alternatives = [f"{re.escape(path)}$" for path in paths] + [re.escape(prefix) for prefix in prefixes]
+    return re.compile("|".join(alternatives) or "(?!)").match
+
+class AuthMiddleware:
+    """认证中间件，验证用户是否已登录
+
+    纯ASGI实现：不经过BaseHTTPMiddleware，因此不会为每个请求包装/缓冲响应体；
+    会话验证在auth_executor线程池中执行，不阻塞事件循环。
+    豁免规则在创建中间件时编译一次。
+    """
+
+    def __init__(self, app, exempt_paths: Optional[List[str]] = None, exempt_prefixes: Optional[List[str]] = None):
+        self.app = app
+        self.is_exempt = compile_exempt_matcher(
+            AUTH_EXEMPT_PATHS if exempt_paths is None else exempt_paths,
+            AUTH_EXEMPT_PREFIXES if exempt_prefixes is None else exempt_prefixes,
+        )
+        self.has_gradio_param = re.compile("|".join(re.escape(x) for x in GRADIO_QUERY_PARAMS)).search
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response = await self.check_request(scope)
+        if response is None:
+            await self.app(scope, receive, send)
+        else:
+            await response(scope, receive, send)
+
+    @staticmethod
+    async def validate(token: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not token:
+            return None
+
+        try:
+            return await validate_session_async(token)
+        except Exception:
+            logger.exception("验证会话时发生错误")
+            return None
+
+    async def check_request(self, scope) -> Optional[Response]:
+        """验证认证状态；允许继续处理时返回None，否则返回要发送的响应"""
+        path = scope["path"]
+        query_string = scope["query_string"].decode("latin-1")
+
         # 检查主题参数，如果存在light主题，修改为dark主题
         if '__theme=light' in query_string:
-            # 创建新的URL，并将light替换为dark
-            new_url = str(request.url).replace('__theme=light', '__theme=dark')
+            new_url = str(HTTPConnection(scope).url).replace('__theme=light', '__theme=dark')
             return RedirectResponse(url=new_url)
-            
-        has_gradio_param = any(param in query_string for param in ['__theme=', 'view=', 'component='])
-        
-        # 对于根路径，即使有Gradio参数，也要检查认证状态
-        if path == "/" and has_gradio_param:
-            # 检查是否已认证
-            session = None
-            session_token = request.cookies.get("session_token")
-            if session_token:
-                try:
-                    session = db_utils.validate_session(session_token)
-                except Exception as e:
-                    print(f"验证session_token时发生错误: {str(e)}")
-                    
-            # 如果未认证，重定向到登录页面
-            if not session:
-                print(f"未授权访问根路径: {request.url}, 重定向到登录页面")
-                return RedirectResponse(url="/login")
-                
-            # 已认证，继续处理
-            return await call_next(request)
-            
-        if is_exempt or (has_gradio_param and path != "/"):
-            # 对于免验证路径，直接处理请求
-            return await call_next(request)
-        
-        # 尝试从不同的cookie名称获取会话ID
-        session = None
-        
-        # 首先尝试session_token
-        session_token = request.cookies.get("session_token")
-        if session_token:
-            try:
-                # 尝试使用数据库验证
-                session = db_utils.validate_session(session_token)
-            except Exception as e:
-                print(f"验证session_token时发生错误: {str(e)}")
-        
-        # 如果上述方法失败，尝试session_id
+
+        has_gradio_param = self.has_gradio_param(query_string) is not None
+
+        # 对于免验证路径，以及根路径以外带有Gradio参数的请求，直接处理
+        # 根路径即使有Gradio参数，也要检查认证状态
+        if path != "/" and (has_gradio_param or self.is_exempt(path)):
+            return None
+
+        cookies = HTTPConnection(scope).cookies
+
+        # 首先尝试session_token，失败时尝试session_id（与session_token相同时无需再次查询）
+        session_token = cookies.get("session_token")
+        session_id = cookies.get("session_id")
+
+        session = await self.validate(session_token)
+        if not session and session_id != session_token:
+            session = await self.validate(session_id)
+
         if not session:
-            session_id = request.cookies.get("session_id")
-            if session_id:
-                account = verify_session(session_id)
-                if account:
-                    # 构造最小会话数据
-                    session = {"account": account, "username": account}
-        
-        if session:
-            # 用户已登录，继续处理请求
-            try:
-                # 输出调试信息
-                if path == "/":
-                    username = session.get('username', session.get('account', '未知用户'))
-                    print(f"用户 {username} 访问主页")
-                
-                # 调用下一个处理程序
-                return await call_next(request)
-            except Exception as e:
-                import traceback
-                print(f"处理已认证请求时出错: {str(e)}")
-                print(traceback.format_exc())
-                # 出错时仍继续处理
-                return await call_next(request)
-        else:
             # 用户未登录，重定向到登录页面
-            print(f"未授权访问: {path}, 重定向到登录页面")
+            logger.debug("未授权访问 %s，重定向到登录页面", path)
             return RedirectResponse(url="/login")
 
+        if path == "/":
+            logger.debug("用户 %s 访问主页", session.get('username', session.get('account')))
+
+        return None
+
 def setup_auth_routes(app):
     """设置认证相关的路由"""
     # 登录页面
@@ -703,16 +701,25 @@ def setup_auth_routes(app):
     # 扣除积分API
     app.add_route("/api/deduct_points", deduct_points_handler, methods=["POST"])
     
+    # 会话缓存统计
+    app.add_route("/api/auth/session_cache", session_cache_stats_handler, methods=["GET"])
+    
+    # 过期会话清理统计
+    app.add_route("/api/auth/sessions", session_reaper_stats_handler, methods=["GET"])
+    
     # 注销 - 同时支持GET和POST请求
     app.add_route("/logout", logout_handler, methods=["GET", "POST"])
     
     # 添加认证中间件
     app.add_middleware(AuthMiddleware)
 
-    # 清理过期会话
-    db_utils.clean_expired_sessions()
+    # 补齐新增的表和索引（积分流水等）
+    db_utils.ensure_schema()
+
+    # 启动后台线程，定期分批清理过期会话
+    session_reaper.session_reaper.start()
     
-    print("已设置数据库认证系统，用户数据已迁移至database/user.db")
+    print(f"已设置数据库认证系统，用户数据库: {db_utils.DB_PATH}")
 
 # 确保verify_session函数可用于用户API
 def verify_session(session_id):
@@ -728,43 +735,18 @@ def verify_session(session_id):
     if not session_id:
         return None
     
-    # 首先尝试使用数据库工具验证会话
+    # 使用数据库工具验证会话
     try:
-        import sys
-        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-        from database import db_utils
-        
         session_data = db_utils.validate_session(session_id)
         if session_data:
             return session_data.get("account")
     except Exception as e:
         print(f"使用db_utils验证会话时出错: {str(e)}")
-        
-    # 如果上面的方法失败，尝试使用sqlite直接查询
-    try:
-        conn = get_db_connection()
-        try:
-            # 获取会话信息
-            session = conn.execute(
-                "SELECT account, expiry FROM sessions WHERE id = ?", 
-                (session_id,)
-            ).fetchone()
-            
-            # 检查会话是否存在且未过期
-            if session and session['expiry'] > time.time():
-                return session['account']
-        finally:
-            conn.close()
-    except Exception as e:
-        print(f"直接查询数据库验证会话时出错: {str(e)}")
-    
+
     # 如果会话不存在或已过期，则返回None
     return None
 
 # 获取数据库连接
 def get_db_connection():
-    """获取数据库连接"""
-    import sqlite3
-    conn = sqlite3.connect('database/users.db')
-    conn.row_factory = sqlite3.Row
-    return conn 
\ No newline at end of file
+    """获取数据库连接（来自database/db_utils的连接池，不要关闭）"""
+    return db_utils.get_db_connection()
@@ -0,0 +1,206 @@
+"""
+Incremental index of files in model directories.
+
+Listing a directory tree again only re-reads directories whose modification time has changed since the last listing
+(a directory's mtime changes when entries are added, removed or renamed in it), so a refresh costs one stat() per
+directory instead of reading every directory and stat()ing every file. If the watchdog package is installed and
+watching is enabled, filesystem events mark directories as changed and unchanged directories are not even stat()ed.
+Changes on network filesystems made from other machines are not reported by inotify; disable watching for those.
+
+Only names are kept in the index. Rewriting a file in place doesn't change its directory's mtime, so sizes and mtimes
+returned by list_files are read when it is called.
+"""
+
+import os
+import threading
+import time
+
+from modules import errors, shared, util
+
+# directories modified this recently may still change within the same mtime tick, so their listing is not trusted
+mtime_granularity = 2.0
+
+
+class DirNode:
+    __slots__ = ('mtime', 'files', 'subdirs')
+
+    def __init__(self, mtime, files, subdirs):
+        self.mtime = mtime
+        self.files = files
+        self.subdirs = subdirs
+
+
+class DirectoryIndex:
+    def __init__(self):
+        self.nodes = {}
+        self.lock = threading.RLock()
+        self.dirty = set()
+        self.watched = set()
+        self.observer = None
+        self.scanned = 0
+        self.reused = 0
+
+    def scan_dir(self, path, mtime):
+        files = []
+        subdirs = []
+
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                    else:
+                        files.append(entry.name)
+                except OSError:
+                    continue
+
+        self.scanned += 1
+
+        if time.time() - mtime < mtime_granularity:
+            mtime = None
+
+        return DirNode(mtime, files, subdirs)
+
+    def refresh(self, path):
+        """Updates the index for the directory tree at path and returns {directory: DirNode} for all directories in it."""
+
+        with self.lock:
+            watched = self.watch(path)
+            res = {}
+            stack = [path]
+
+            while stack:
+                dirpath = stack.pop()
+                if dirpath in res:
+                    continue
+
+                node = self.nodes.get(dirpath)
+                if node is None or not watched or dirpath in self.dirty:
+                    try:
+                        mtime = os.stat(dirpath).st_mtime
+                        if node is None or node.mtime is None or node.mtime != mtime or dirpath in self.dirty:
+                            node = self.nodes[dirpath] = self.scan_dir(dirpath, mtime)
+                        else:
+                            self.reused += 1
+                    except OSError:
+                        self.nodes.pop(dirpath, None)
+                        continue
+                else:
+                    self.reused += 1
+
+                self.dirty.discard(dirpath)
+                res[dirpath] = node
+                stack.extend(os.path.join(dirpath, name) for name in node.subdirs)
+
+            prefix = os.path.join(path, '')
+            for dirpath in [x for x in self.nodes if x.startswith(prefix) and x not in res]:
+                del self.nodes[dirpath]
+
+            return res
+
+    def walk_files(self, path, allowed_extensions=None, include_hidden=None):
+        """Returns paths of files in the tree in the same order as util.walk_files."""
+
+        if not os.path.exists(path):
+            return []
+
+        if allowed_extensions is not None:
+            allowed_extensions = set(allowed_extensions)
+
+        if include_hidden is None:
+            include_hidden = shared.opts.list_hidden_files
+
+        res = []
+        for root, node in sorted(self.refresh(path).items(), key=lambda x: util.natural_sort_key(x[0])):
+            if not include_hidden and ("/." in root or "\\." in root):
+                continue
+
+            for filename in sorted(node.files, key=util.natural_sort_key):
+                if allowed_extensions is not None:
+                    _, ext = os.path.splitext(filename)
+                    if ext.lower() not in allowed_extensions:
+                        continue
+
+                res.append(os.path.join(root, filename))
+
+        return res
+
+    def watch(self, path):
+        """Starts watching the tree at path if possible; returns True if it is watched and events since its last listing were recorded."""
+
+        if path in self.watched:
+            return self.observer is not None and self.observer.is_alive()
+
+        if not shared.opts.dir_index_watch:
+            return False
+
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return False
+
+        index = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                with index.lock:
+                    for changed in [getattr(event, 'src_path', None), getattr(event, 'dest_path', None)]:
+                        if not changed:
+                            continue
+
+                        index.dirty.add(os.path.dirname(changed))
+                        if event.is_directory:
+                            index.dirty.add(changed)
+
+        try:
+            if self.observer is None:
+                self.observer = Observer()
+                self.observer.daemon = True
+                self.observer.start()
+
+            self.observer.schedule(Handler(), path, recursive=True)
+        except Exception as e:
+            errors.display(e, f"watching directory {path}")
+            self.watched.add(path)
+            return False
+
+        self.watched.add(path)
+
+        # the first listing after starting to watch still has to check the directories
+        return False
+
+    def stats(self):
+        with self.lock:
+            return {"directories": len(self.nodes), "scanned": self.scanned, "reused": self.reused, "watched": sorted(self.watched)}
+
+
+index = DirectoryIndex()
+
+
+def enabled():
+    return shared.opts.dir_index_enable
+
+
+def list_files(path, allowed_extensions=None, include_hidden=None):
+    """Returns (path, size, mtime) for all files in the directory tree at path from the index, sorted like util.walk_files."""
+
+    res = []
+    for filename in index.walk_files(path, allowed_extensions, include_hidden):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            continue
+
+        res.append((filename, st.st_size, st.st_mtime))
+
+    return res
+
+
+def walk_files(path, allowed_extensions=None):
+    """Same as util.walk_files, but served from the index when it is enabled."""
+
+    if enabled():
+        return index.walk_files(path, allowed_extensions)
+
+    return list(util.walk_files(path, allowed_extensions))
@@ -0,0 +1,161 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class QueueLimitExceeded(Exception):
+    pass
+
+
+class FairQueueLock:
+    """A drop-in replacement for FIFOLock that serves waiting users in weighted round-robin order.
+
+    Each user has their own FIFO of waiters; when the lock is released it is handed directly to the
+    next waiter of the next user in turn, so one user's batch of submissions can't starve everyone
+    else. A user with weight N gets up to N consecutive turns. Plain `with lock:` and acquire()
+    without a user queue under the anonymous user None, which is how API calls wait.
+    """
+
+    def __init__(self, weights=None):
+        self.weights = weights or {}
+        self._inner_lock = threading.Lock()
+        self._locked = False
+        self._queues = OrderedDict()
+        self._turns = {}
+        self.owner = None
+
+    def acquire(self, blocking=True, user=None):
+        with self._inner_lock:
+            if not self._locked:
+                self._locked = True
+                self.owner = user
+                return True
+            elif not blocking:
+                return False
+
+            release_event = threading.Event()
+            self._queues.setdefault(user, deque()).append(release_event)
+
+        # release() hands the lock over to us before setting the event
+        release_event.wait()
+        return True
+
+    def release(self):
+        with self._inner_lock:
+            if not self._queues:
+                self._locked = False
+                self.owner = None
+                return
+
+            user, waiters = next(iter(self._queues.items()))
+            release_event = waiters.popleft()
+
+            turns = self._turns.get(user, 0) + 1
+            if not waiters:
+                del self._queues[user]
+                self._turns.pop(user, None)
+            elif turns >= self.weights.get(user, 1):
+                self._queues.move_to_end(user)
+                self._turns.pop(user, None)
+            else:
+                self._turns[user] = turns
+
+            self.owner = user
+            release_event.set()
+
+    def locked(self):
+        return self._locked
+
+    def for_user(self, user):
+        return _UserLockContext(self, user)
+
+    def queue_depths(self):
+        """Number of waiters per user, not counting the current owner."""
+
+        with self._inner_lock:
+            return {user: len(waiters) for user, waiters in self._queues.items()}
+
+    __enter__ = acquire
+
+    def __exit__(self, t, v, tb):
+        self.release()
+
+
+class _UserLockContext:
+    def __init__(self, lock, user):
+        self.lock = lock
+        self.user = user
+
+    def __enter__(self):
+        self.lock.acquire(user=self.user)
+
+    def __exit__(self, t, v, tb):
+        self.lock.release()
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+class UserLimiter:
+    """Admission control for queued tasks: a cap on each user's queued+running tasks and a token bucket
+    rate limit on submissions. Limits are read on every call so changes in settings apply immediately;
+    0 disables a limit. The anonymous user None is never limited."""
+
+    def __init__(self, max_tasks=lambda: 0, rate_per_minute=lambda: 0, burst=lambda: 1):
+        self.max_tasks = max_tasks
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.active = {}
+        self.buckets = {}
+
+    def admit(self, user):
+        if user is None:
+            return
+
+        with self.lock:
+            max_tasks = self.max_tasks()
+            if max_tasks and self.active.get(user, 0) >= max_tasks:
+                raise QueueLimitExceeded(f"排队中的任务过多: 每个用户最多{max_tasks}个")
+
+            rate = self.rate_per_minute()
+            if rate:
+                bucket = self.buckets.get(user)
+                if bucket is None or bucket.rate != rate / 60 or bucket.capacity != max(self.burst(), 1):
+                    bucket = self.buckets[user] = TokenBucket(rate, self.burst())
+
+                if not bucket.take():
+                    raise QueueLimitExceeded(f"请求过于频繁: 每分钟最多{rate:g}个任务")
+
+            self.active[user] = self.active.get(user, 0) + 1
+
+    def release(self, user):
+        if user is None:
+            return
+
+        with self.lock:
+            count = self.active.get(user, 0) - 1
+            if count > 0:
+                self.active[user] = count
+            else:
+                self.active.pop(user, None)
+
+    def active_tasks(self):
+        with self.lock:
+            return dict(self.active)
@@ -7,10 +7,12 @@ import modules.cache
 dump_cache = modules.cache.dump_cache
 cache = modules.cache.cache
 
+# (title, use_addnet_hash) -> Future of files being hashed by hashing_service
+in_progress = {}
 
-def calculate_sha256(filename):
+
+def calculate_sha256(filename, blksize=1024 * 1024):
     hash_sha256 = hashlib.sha256()
-    blksize = 1024 * 1024
 
     with open(filename, "rb") as f:
         for chunk in iter(lambda: f.read(blksize), b""):
@@ -39,8 +41,6 @@ def sha256_from_cache(filename, title, use_addnet_hash=False):
 
 
 def sha256(filename, title, use_addnet_hash=False):
-    hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
-
     sha256_value = sha256_from_cache(filename, title, use_addnet_hash)
     if sha256_value is not None:
         return sha256_value
@@ -48,13 +48,34 @@ def sha256(filename, title, use_addnet_hash=False):
     if shared.cmd_opts.no_hashing:
         return None
 
+    # the file is already being hashed in background; wait for it rather than reading it twice
+    future = in_progress.get((title, use_addnet_hash))
+    if future is not None and future.running() and future.exception() is None:
+        return future.result()
+
     print(f"Calculating sha256 for {filename}: ", end='')
+    sha256_value = calculate_file_hash(filename, use_addnet_hash)
+    print(f"{sha256_value}")
+
+    store_sha256(filename, title, sha256_value, use_addnet_hash)
+
+    # it was queued behind other files, which this didn't wait for; its callbacks get the hash from cache
+    if future is not None:
+        future.cancel()
+
+    return sha256_value
+
+
+def calculate_file_hash(filename, use_addnet_hash=False, blksize=1024 * 1024):
     if use_addnet_hash:
         with open(filename, "rb") as file:
-            sha256_value = addnet_hash_safetensors(file)
-    else:
-        sha256_value = calculate_sha256(filename)
-    print(f"{sha256_value}")
+            return addnet_hash_safetensors(file, blksize)
+
+    return calculate_sha256(filename, blksize)
+
+
+def store_sha256(filename, title, sha256_value, use_addnet_hash=False):
+    hashes = cache("hashes-addnet") if use_addnet_hash else cache("hashes")
 
     hashes[title] = {
         "mtime": os.path.getmtime(filename),
@@ -63,13 +84,10 @@ def sha256(filename, title, use_addnet_hash=False):
 
     dump_cache()
 
-    return sha256_value
-
 
-def addnet_hash_safetensors(b):
+def addnet_hash_safetensors(b, blksize=1024 * 1024):
     """kohya-ss hash for safetensors from https://github.com/kohya-ss/sd-scripts/blob/main/library/train_util.py"""
     hash_sha256 = hashlib.sha256()
-    blksize = 1024 * 1024
 
     b.seek(0)
     header = b.read(8)
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from modules import errors, hashes, shared
+
+# files are read sequentially in large blocks; hashlib and file reads release the GIL, so worker threads hash in parallel
+read_block_size = 16 * 1024 * 1024
+
+
+class HashingService:
+    """Computes sha256 hashes of model files in background worker threads and stores them in the hashes cache."""
+
+    def __init__(self):
+        self.executor = None
+        self.lock = threading.Lock()
+        self.queued = {}
+        self.running = {}
+        self.finished = 0
+        self.failed = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.started_at = None
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=max(1, int(shared.opts.hash_background_workers)), thread_name_prefix="hashing")
+
+        return self.executor
+
+    def submit(self, filename, title, use_addnet_hash=False, callback=None):
+        """Queues the file for hashing unless it's already queued; callback is called with the hash when it's done."""
+
+        key = (title, use_addnet_hash)
+
+        with self.lock:
+            future = hashes.in_progress.get(key)
+            if future is None:
+                try:
+                    size = os.path.getsize(filename)
+                except OSError:
+                    return None
+
+                if not self.queued and not self.running:
+                    self.started_at = time.time()
+
+                self.queued[key] = size
+                self.bytes_total += size
+                future = hashes.in_progress[key] = self.get_executor().submit(self.hash_file, filename, title, use_addnet_hash, size)
+                future.add_done_callback(lambda f: self.forget_cancelled(key, size, f))
+
+        if callback is not None:
+            future.add_done_callback(lambda f: self.run_callback(callback, f, filename, title, use_addnet_hash))
+
+        return future
+
+    def hash_file(self, filename, title, use_addnet_hash, size):
+        key = (title, use_addnet_hash)
+
+        with self.lock:
+            self.queued.pop(key, None)
+            self.running[key] = size
+
+        try:
+            sha256_value = hashes.calculate_file_hash(filename, use_addnet_hash, blksize=read_block_size)
+            hashes.store_sha256(filename, title, sha256_value, use_addnet_hash)
+        except Exception:
+            with self.lock:
+                self.failed += 1
+
+            raise
+        else:
+            with self.lock:
+                self.finished += 1
+        finally:
+            with self.lock:
+                self.running.pop(key, None)
+                self.bytes_done += size
+                hashes.in_progress.pop(key, None)
+
+        return sha256_value
+
+    def forget_cancelled(self, key, size, future):
+        """Removes a file that was hashed by hashes.sha256 while it was waiting in the queue."""
+
+        if not future.cancelled():
+            return
+
+        with self.lock:
+            self.queued.pop(key, None)
+            self.bytes_total -= size
+            if hashes.in_progress.get(key) is future:
+                hashes.in_progress.pop(key)
+
+    @staticmethod
+    def run_callback(callback, future, filename, title, use_addnet_hash):
+        if future.cancelled():
+            sha256_value = hashes.sha256_from_cache(filename, title, use_addnet_hash)
+            if sha256_value is None:
+                return
+        elif future.exception() is not None:
+            errors.display(future.exception(), f"calculating hash for {filename}")
+            return
+        else:
+            sha256_value = future.result()
+
+        try:
+            callback(sha256_value)
+        except Exception as e:
+            errors.display(e, f"applying hash for {filename}")
+
+    def progress(self):
+        with self.lock:
+            return {
+                "queued": len(self.queued),
+                "running": [title for title, _ in self.running],
+                "finished": self.finished,
+                "failed": self.failed,
+                "bytes_total": self.bytes_total,
+                "bytes_done": self.bytes_done,
+                "started_at": self.started_at,
+            }
+
+
+service = HashingService()
+
+
+def enabled():
+    return shared.opts.hash_in_background and not shared.cmd_opts.no_hashing
+
+
+def sha256(filename, title, use_addnet_hash=False, callback=None):
+    """
+    Same as hashes.sha256, except that if background hashing is enabled, a file that's not in the cache is queued for
+    hashing and None is returned right away; callback is called with the hash once it's calculated.
+    """
+
+    if not enabled():
+        return hashes.sha256(filename, title, use_addnet_hash)
+
+    sha256_value = hashes.sha256_from_cache(filename, title, use_addnet_hash)
+    if sha256_value is None:
+        service.submit(filename, title, use_addnet_hash, callback)
+
+    return sha256_value
+
+
+def submit(filename, title, use_addnet_hash=False, callback=None):
+    """Queues a newly discovered file for hashing if background hashing is enabled and its hash is not cached."""
+
+    if enabled() and hashes.sha256_from_cache(filename, title, use_addnet_hash) is None:
+        service.submit(filename, title, use_addnet_hash, callback)
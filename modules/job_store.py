@@ -0,0 +1,236 @@
+import importlib
+import json
+import os
+import threading
+import time
+
+import gradio as gr
+from PIL import Image
+
+from modules import errors, shared
+from database import db_utils
+
+JOB_DB_PATH = os.environ.get('SD_WEBUI_JOB_DB', os.path.join(os.path.dirname(db_utils.DB_PATH), 'jobs.db'))
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id_task TEXT PRIMARY KEY,
+        user_id INTEGER,
+        kind TEXT NOT NULL,
+        params TEXT,
+        status TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        result TEXT,
+        error TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)',
+]
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_FINISHED = 'finished'
+STATUS_FAILED = 'failed'
+STATUS_INTERRUPTED = 'interrupted'
+
+completed_statuses = (STATUS_FINISHED, STATUS_FAILED, STATUS_INTERRUPTED)
+
+_conn = None
+_lock = threading.Lock()
+_resumed = False
+
+
+def enabled():
+    return shared.opts.job_store_enable
+
+
+def execute(sql, params=()):
+    global _conn
+
+    with _lock:
+        if _conn is None:
+            _conn = db_utils.connect(JOB_DB_PATH)
+            with _conn:
+                for statement in SCHEMA:
+                    _conn.execute(statement)
+
+        with _conn:
+            return _conn.execute(sql, params).fetchall()
+
+
+def job_kind(func):
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+def resolve_kind(kind):
+    module_name, _, name = kind.rpartition('.')
+    try:
+        return getattr(importlib.import_module(module_name), name)
+    except (ImportError, AttributeError):
+        return None
+
+
+def serialize_params(args, kwargs):
+    """Returns the call arguments as JSON, or None if they can't be stored (images, files...); such jobs are not resumed."""
+
+    def default(obj):
+        if isinstance(obj, gr.Request):
+            return {"__gr_request__": True}
+
+        raise TypeError(type(obj).__name__)
+
+    try:
+        return json.dumps({"args": list(args), "kwargs": kwargs}, default=default)
+    except (TypeError, ValueError):
+        return None
+
+
+def deserialize_params(params):
+    def object_hook(obj):
+        return gr.Request() if obj.get("__gr_request__") else obj
+
+    data = json.loads(params, object_hook=object_hook)
+    return data["args"], data["kwargs"]
+
+
+def serialize_result(res):
+    """Keeps what is needed to restore the task's outputs later: paths of saved images and text outputs."""
+
+    outputs = []
+    for x in res or []:
+        if isinstance(x, list) and all(isinstance(image, Image.Image) for image in x):
+            outputs.append({"images": [image.already_saved_as for image in x if getattr(image, 'already_saved_as', None)]})
+        elif isinstance(x, str):
+            outputs.append(x)
+        else:
+            outputs.append(None)
+
+    return json.dumps(outputs)
+
+
+def restore_result(id_task):
+    """Rebuilds the task's outputs from the store, loading saved images from disk; None if not available."""
+
+    if not enabled():
+        return None
+
+    rows = execute('SELECT status, result FROM jobs WHERE id_task = ?', (id_task,))
+    if not rows or rows[0]['result'] is None:
+        return None
+
+    res = []
+    for x in json.loads(rows[0]['result']):
+        if isinstance(x, dict):
+            images = []
+            for path in x["images"]:
+                if os.path.isfile(path):
+                    image = Image.open(path)
+                    image.already_saved_as = path
+                    images.append(image)
+            res.append(images)
+        else:
+            res.append(gr.update() if x is None else x)
+
+    return tuple(res)
+
+
+def add_job(id_task, user_id, func, args, kwargs):
+    if not enabled() or id_task is None:
+        return
+
+    execute(
+        'INSERT OR REPLACE INTO jobs (id_task, user_id, kind, params, status, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+        (id_task, user_id, job_kind(func), serialize_params(args, kwargs), STATUS_PENDING, time.time()),
+    )
+
+
+def start_job(id_task):
+    if not enabled() or id_task is None:
+        return
+
+    execute('UPDATE jobs SET status = ?, started_at = ? WHERE id_task = ?', (STATUS_RUNNING, time.time(), id_task))
+
+
+def finish_job(id_task, res=None, error=None):
+    if not enabled() or id_task is None:
+        return
+
+    if error is not None:
+        status = STATUS_FAILED
+    elif shared.state.interrupted:
+        status = STATUS_INTERRUPTED
+    else:
+        status = STATUS_FINISHED
+
+    try:
+        result = serialize_result(res) if res is not None else None
+    except Exception:
+        result = None
+
+    execute(
+        'UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE id_task = ?',
+        (status, time.time(), result, None if error is None else str(error), id_task),
+    )
+
+
+def get_job(id_task):
+    if not enabled() or not id_task:
+        return None
+
+    rows = execute('SELECT id_task, user_id, kind, status, created_at, started_at, finished_at, error FROM jobs WHERE id_task = ?', (id_task,))
+    return dict(rows[0]) if rows else None
+
+
+def prune(max_age_days):
+    execute('DELETE FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?', (*completed_statuses, time.time() - max_age_days * 86400))
+
+
+def resume_pending_jobs():
+    """Re-queues jobs that were waiting in the queue when the server stopped. Runs once per process.
+
+    All unfinished jobs are marked interrupted first; a re-queued job goes back to pending once it is admitted
+    to the queue again, so one that fails admission stays interrupted instead of being retried on every start.
+    Jobs that were running are not resumed, since they may be what brought the server down."""
+
+    global _resumed
+
+    if not enabled() or _resumed:
+        return
+
+    _resumed = True
+    prune(shared.opts.job_store_keep_days)
+
+    rows = execute('SELECT id_task, user_id, kind, params, status FROM jobs WHERE status IN (?, ?) ORDER BY created_at', (STATUS_PENDING, STATUS_RUNNING))
+
+    jobs = []
+    for row in rows:
+        error = "server stopped while the job was running" if row['status'] == STATUS_RUNNING else "server restarted"
+        execute('UPDATE jobs SET status = ?, error = ? WHERE id_task = ?', (STATUS_INTERRUPTED, error, row['id_task']))
+
+        func = resolve_kind(row['kind'])
+        if not shared.opts.job_store_resume or row['status'] == STATUS_RUNNING or func is None or row['params'] is None:
+            continue
+
+        args, kwargs = deserialize_params(row['params'])
+        jobs.append((row['id_task'], row['user_id'], func, args, kwargs))
+
+    if not jobs:
+        return
+
+    print(f"Resuming {len(jobs)} queued job(s) from {JOB_DB_PATH}")
+    threading.Thread(target=run_resumed_jobs, args=(jobs,), name="job_store_resume", daemon=True).start()
+
+
+def run_resumed_jobs(jobs):
+    from modules import call_queue
+
+    for id_task, user_id, func, args, kwargs in jobs:
+        session = {'user_id': user_id} if user_id is not None else None
+
+        try:
+            call_queue.wrap_gradio_call(call_queue.run_gpu_task)(func, id_task, session, args, kwargs)
+        except Exception:
+            errors.report(f"Error resuming job {id_task}", exc_info=True)
@@ -8,7 +8,7 @@ from urllib.parse import urlparse
 
 import torch
 
-from modules import shared
+from modules import shared, dir_index
 from modules.upscaler import Upscaler, UpscalerLanczos, UpscalerNearest, UpscalerNone
 
 if TYPE_CHECKING:
@@ -69,7 +69,7 @@ def load_models(model_path: str, model_url: str = None, command_path: str = None
         places.append(model_path)
 
         for place in places:
-            for full_path in shared.walk_files(place, allowed_extensions=ext_filter):
+            for full_path in dir_index.walk_files(place, allowed_extensions=ext_filter):
                 if os.path.islink(full_path) and not os.path.exists(full_path):
                     print(f"Skipping broken symlink: {full_path}")
                     continue
@@ -0,0 +1,145 @@
+import math
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+import gradio as gr
+
+from modules import errors, shared
+from database import db_utils, points_ledger
+
+
+class InsufficientPoints(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    """Points accounting for one queued generation task.
+
+    `reserved` points are debited from the user's balance as ledger rows when the task is admitted
+    and topped up once the processing parameters are known; `cost` accumulates as batches actually
+    finish. finish() settles the difference in one more ledger row, refunding the unused part of the
+    hold. Ledger keys are made from `key`, which is generated on the server, so a client can't make
+    its generations look like duplicates of earlier ones by reusing a task id.
+    """
+
+    id_task: str
+    user_id: int
+    key: str
+    reserved: int = 0
+    holds: int = 0
+    cost: float = 0
+    images: int = 0
+    finished: bool = False
+
+current_job: Optional[Job] = None
+"""The job currently holding the GPU queue lock; process_images charges batches to it."""
+
+
+def enabled():
+    return shared.opts.points_metering_enable
+
+
+def processing_cost(p, images):
+    """Points for `images` images generated with processing parameters `p`."""
+
+    megapixel_steps = p.width * p.height * p.steps / 1e6
+    if getattr(p, 'enable_hr', False):
+        # hr_upscale_to_x/y are only filled in by p.init(), so estimate from hr_scale before that
+        hr_width = p.hr_upscale_to_x or p.width * p.hr_scale
+        hr_height = p.hr_upscale_to_y or p.height * p.hr_scale
+        megapixel_steps += hr_width * hr_height * (p.hr_second_pass_steps or p.steps) / 1e6
+
+    return images * (shared.opts.points_cost_per_image + shared.opts.points_cost_per_megapixel_step * megapixel_steps)
+
+
+def user_from_args(args):
+    """Finds the gr.Request among gradio call arguments and returns the logged in user's session, if any."""
+
+    request = next((x for x in args if isinstance(x, gr.Request)), None)
+    cookies = getattr(request, 'cookies', None) if request is not None else None
+    if not cookies:
+        return None
+
+    return db_utils.validate_session(cookies.get("session_token") or cookies.get("session_id"))
+
+
+def reserve(job, points):
+    """Raises the job's hold to `points` by debiting the difference from the user's balance."""
+
+    amount = math.ceil(points) - job.reserved
+    if amount <= 0:
+        return
+
+    job.holds += 1
+    result = points_ledger.ledger_writer.submit(job.user_id, -amount, f"{job.key}:hold{job.holds}", "generation hold").result()
+    if not result['success']:
+        raise InsufficientPoints(f"积分不足: 当前可用{max(result['points'] or 0, 0)}, 需要{amount}")
+
+    job.reserved += amount
+
+
+def admit(id_task, session):
+    """Called when a task enters the queue with the session from user_from_args(); returns a Job, or None if the task is not metered."""
+
+    if id_task is None or not enabled():
+        return None
+
+    if session is None:
+        raise InsufficientPoints("请先登录")
+
+    user_id = session['user_id']
+    job = Job(id_task=id_task, user_id=user_id, key=f"gen:{user_id}:{uuid.uuid4().hex}")
+    reserve(job, shared.opts.points_cost_per_image)
+    return job
+
+
+def begin(job):
+    global current_job
+    current_job = job
+
+
+def reserve_for_processing(p):
+    """Called by process_images before generating; tops up the hold to cover everything p will produce."""
+
+    if current_job is None:
+        return
+
+    reserve(current_job, current_job.cost + processing_cost(p, p.n_iter * p.batch_size))
+
+
+def record_batch(p, images):
+    """Called by process_images after each finished batch; interrupted batches are not charged."""
+
+    if current_job is None or shared.state.interrupted:
+        return
+
+    current_job.cost += processing_cost(p, images)
+    current_job.images += images
+
+
+def finish(job):
+    """Settles the job's hold against what it actually cost in one transaction; safe to call more than once."""
+
+    global current_job
+
+    if job is None or job.finished:
+        return
+
+    job.finished = True
+
+    if current_job is job:
+        current_job = None
+
+    # the hold covers the estimated cost, so this is normally a refund of the unused part
+    delta = job.reserved - math.ceil(job.cost)
+    if delta == 0:
+        return
+
+    try:
+        result = points_ledger.ledger_writer.submit(job.user_id, delta, f"{job.key}:settle", "generation").result()
+        if not result['success']:
+            errors.report(f"Could not charge {-delta} points over the hold for {job.id_task}: user {job.user_id} has {result['points']}")
+    except Exception:
+        errors.report(f"Error settling points for {job.id_task}; {job.reserved} points stay held", exc_info=True)
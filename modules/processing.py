@@ -16,7 +16,7 @@ from skimage import exposure
 from typing import Any
 
 import modules.sd_hijack
-from modules import devices, prompt_parser, masking, sd_samplers, lowvram, infotext_utils, extra_networks, sd_vae_approx, scripts, sd_samplers_common, sd_unet, errors, rng, profiling
+from modules import devices, prompt_parser, masking, sd_samplers, lowvram, infotext_utils, extra_networks, sd_vae_approx, scripts, sd_samplers_common, sd_unet, errors, rng, profiling, points_metering, cond_cache
 from modules.rng import slerp # noqa: F401
 from modules.sd_hijack import model_hijack
 from modules.sd_samplers_common import images_tensor_to_samples, decode_first_stage, approximation_indexes
@@ -207,6 +207,7 @@ class StableDiffusionProcessing:
     all_seeds: list = field(default=None, init=False)
     all_subseeds: list = field(default=None, init=False)
     iteration: int = field(default=0, init=False)
+    sampling_step_times: list = field(default=None, init=False)
     main_prompt: str = field(default=None, init=False)
     main_negative_prompt: str = field(default=None, init=False)
 
@@ -484,6 +485,10 @@ class StableDiffusionProcessing:
 
         cache = caches[0]
 
+        if isinstance(required_prompts, prompt_parser.SdConditioning):
+            required_prompts.cond_cache = cond_cache.cache if cond_cache.enabled() else None
+            required_prompts.cond_cache_key = cond_cache.hashable(cached_params[1:]) + (opts.comma_padding_backtrack, opts.use_old_emphasis_implementation)
+
         with devices.autocast():
             cache[1] = function(shared.sd_model, required_prompts, steps, hires_steps, shared.opts.use_old_scheduling)
 
@@ -560,6 +565,7 @@ class Processed:
         self.seed = int(self.seed if not isinstance(self.seed, list) else self.seed[0]) if self.seed is not None else -1
         self.subseed = int(self.subseed if not isinstance(self.subseed, list) else self.subseed[0]) if self.subseed is not None else -1
         self.is_using_inpainting_conditioning = p.is_using_inpainting_conditioning
+        self.sampling_step_times = p.sampling_step_times
 
         self.all_prompts = all_prompts or p.all_prompts or [self.prompt]
         self.all_negative_prompts = all_negative_prompts or p.all_negative_prompts or [self.negative_prompt]
@@ -602,6 +608,7 @@ class Processed:
             "clip_skip": self.clip_skip,
             "is_using_inpainting_conditioning": self.is_using_inpainting_conditioning,
             "version": self.version,
+            "sampling_step_times": self.sampling_step_times,
         }
 
         return json.dumps(obj, default=lambda o: None)
@@ -771,7 +778,7 @@ def create_infotext(p, all_prompts, all_seeds, all_subseeds, comments=None, iter
         "Steps": p.steps,
         "Sampler": p.sampler_name,
         "Schedule type": p.scheduler,
-        "CFG scale": p.cfg_scale,
+        "CFG scale": p.cfg_scales[index] if getattr(p, 'cfg_scales', None) else p.cfg_scale,
         "Image CFG scale": getattr(p, 'image_cfg_scale', None),
         "Seed": p.all_seeds[0] if use_main_prompt else all_seeds[index],
         "Face restoration": opts.face_restoration_model if p.restore_faces else None,
@@ -843,6 +850,8 @@ def process_images(p: StableDiffusionProcessing) -> Processed:
         # backwards compatibility, fix sampler and scheduler if invalid
         sd_samplers.fix_p_invalid_sampler_and_scheduler(p)
 
+        points_metering.reserve_for_processing(p)
+
         with profiling.Profiler():
             res = process_images_inner(p)
 
@@ -1105,6 +1114,8 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
                         if opts.return_mask_composite:
                             output_images.append(image_mask_composite)
 
+            points_metering.record_batch(p, len(x_samples_ddim))
+
             del x_samples_ddim
 
             devices.torch_gc()
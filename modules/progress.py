@@ -8,13 +8,15 @@ from pydantic import BaseModel, Field
 from modules.shared import opts
 
 import modules.shared as shared
+from modules import job_store
 from collections import OrderedDict
 import string
 import random
-from typing import List
+from typing import Dict, List
 
 current_task = None
 pending_tasks = OrderedDict()
+pending_task_users = {}
 finished_tasks = []
 recorded_results = []
 recorded_results_limit = 2
@@ -25,6 +27,7 @@ def start_task(id_task):
 
     current_task = id_task
     pending_tasks.pop(id_task, None)
+    pending_task_users.pop(id_task, None)
 
 
 def finish_task(id_task):
@@ -49,12 +52,24 @@ def record_results(id_task, res):
         recorded_results.pop(0)
 
 
-def add_task_to_queue(id_job):
+def add_task_to_queue(id_job, user=None):
     pending_tasks[id_job] = time.time()
+    if user is not None:
+        pending_task_users[id_job] = user
+
+
+def user_queue_depths():
+    depths = {}
+    for user in list(pending_task_users.values()):
+        depths[user] = depths.get(user, 0) + 1
+
+    return depths
+
 
 class PendingTasksResponse(BaseModel):
     size: int = Field(title="Pending task size")
     tasks: List[str] = Field(title="Pending task ids")
+    users: Dict[str, int] = Field(default={}, title="Pending task count per user id")
 
 class ProgressRequest(BaseModel):
     id_task: str = Field(default=None, title="Task ID", description="id of the task to get progress for")
@@ -71,6 +86,7 @@ class ProgressResponse(BaseModel):
     live_preview: str = Field(default=None, title="Live preview image", description="Current live preview; a data: uri")
     id_live_preview: int = Field(default=None, title="Live preview image ID", description="Send this together with next request to prevent receiving same image")
     textinfo: str = Field(default=None, title="Info text", description="Info text used by WebUI.")
+    user_queue_depth: int = Field(default=None, title="User queue depth", description="Number of queued tasks belonging to the same user as this task")
 
 
 def setup_progress_api(app):
@@ -81,7 +97,8 @@ def setup_progress_api(app):
 def get_pending_tasks():
     pending_tasks_ids = list(pending_tasks)
     pending_len = len(pending_tasks_ids)
-    return PendingTasksResponse(size=pending_len, tasks=pending_tasks_ids)
+    users = {str(user): depth for user, depth in user_queue_depths().items()}
+    return PendingTasksResponse(size=pending_len, tasks=pending_tasks_ids, users=users)
 
 
 def progressapi(req: ProgressRequest):
@@ -91,11 +108,26 @@ def progressapi(req: ProgressRequest):
 
     if not active:
         textinfo = "Waiting..."
-        if queued:
+        user_queue_depth = None
+
+        # tasks from before a restart are only known to the job store
+        if not queued and not completed:
+            job = job_store.get_job(req.id_task)
+            if job is not None:
+                completed = job['status'] in job_store.completed_statuses
+                queued = not completed
+                textinfo = "Waiting to resume..." if queued else f"Job {job['status']}"
+
+        if req.id_task in pending_tasks:
             sorted_queued = sorted(pending_tasks.keys(), key=lambda x: pending_tasks[x])
             queue_index = sorted_queued.index(req.id_task)
             textinfo = "In queue: {}/{}".format(queue_index + 1, len(sorted_queued))
-        return ProgressResponse(active=active, queued=queued, completed=completed, id_live_preview=-1, textinfo=textinfo)
+
+            user = pending_task_users.get(req.id_task)
+            if user is not None:
+                user_queue_depth = user_queue_depths().get(user, 0)
+                textinfo += f", yours: {user_queue_depth}"
+        return ProgressResponse(active=active, queued=queued, completed=completed, id_live_preview=-1, textinfo=textinfo, user_queue_depth=user_queue_depth)
 
     progress = 0
 
@@ -149,4 +181,8 @@ def restore_progress(id_task):
     if res is not None:
         return res
 
+    res = job_store.restore_result(id_task)
+    if res is not None:
+        return res
+
     return gr.update(), gr.update(), gr.update(), f"Couldn't restore progress for {id_task}: results either have been discarded or never were obtained"
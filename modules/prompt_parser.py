@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import re
 from collections import namedtuple
+from functools import lru_cache
 import lark
 
 # a prompt like this: "fantasy landscape with a [mountain:lake:0.25] and [an oak:a christmas tree:0.75][ in foreground::0.6][: in background:0.25] [shoddy:masterful:0.5]"
@@ -72,6 +73,14 @@ def get_learned_conditioning_prompt_schedules(prompts, base_steps, hires_steps=N
         flt_offset = 1.0
         steps = hires_steps
 
+    promptdict = {prompt: [list(x) for x in get_prompt_schedule(prompt, steps, int_offset, flt_offset, use_old_scheduling)] for prompt in set(prompts)}
+    return [promptdict[prompt] for prompt in prompts]
+
+
+@lru_cache(maxsize=1024)
+def get_prompt_schedule(prompt, steps, int_offset, flt_offset, use_old_scheduling):
+    """Returns the schedule for a single prompt as a tuple of (end at step, text) pairs; memoized because parsing with lark is slow."""
+
     def collect_steps(steps, tree):
         res = [steps]
 
@@ -119,18 +128,14 @@ def get_learned_conditioning_prompt_schedules(prompts, base_steps, hires_steps=N
                     yield child
         return AtStep().transform(tree)
 
-    def get_schedule(prompt):
-        try:
-            tree = schedule_parser.parse(prompt)
-        except lark.exceptions.LarkError:
-            if 0:
-                import traceback
-                traceback.print_exc()
-            return [[steps, prompt]]
-        return [[t, at_step(t, tree)] for t in collect_steps(steps, tree)]
-
-    promptdict = {prompt: get_schedule(prompt) for prompt in set(prompts)}
-    return [promptdict[prompt] for prompt in prompts]
+    try:
+        tree = schedule_parser.parse(prompt)
+    except lark.exceptions.LarkError:
+        if 0:
+            import traceback
+            traceback.print_exc()
+        return ((steps, prompt), )
+    return tuple((t, at_step(t, tree)) for t in collect_steps(steps, tree))
 
 
 ScheduledPromptConditioning = namedtuple("ScheduledPromptConditioning", ["end_at_step", "cond"])
@@ -152,6 +157,10 @@ class SdConditioning(list):
         self.width = width or getattr(copy_from, 'width', None)
         self.height = height or getattr(copy_from, 'height', None)
 
+        # cache shared between calls (see modules/cond_cache.py) and parameters that are a part of its keys besides prompt
+        self.cond_cache = getattr(copy_from, 'cond_cache', None)
+        self.cond_cache_key = getattr(copy_from, 'cond_cache_key', None)
+
 
 
 def get_learned_conditioning(model, prompts: SdConditioning | list[str], steps, hires_steps=None, use_old_scheduling=False):
@@ -184,8 +193,25 @@ def get_learned_conditioning(model, prompts: SdConditioning | list[str], steps,
             res.append(cached)
             continue
 
+        shared_cache = getattr(prompts, 'cond_cache', None)
+        if shared_cache is not None:
+            shared_cache_key = (prompts.cond_cache_key, prompts.is_negative_prompt, prompts.width, prompts.height, tuple(tuple(x) for x in prompt_schedule))
+            from modules import cond_cache
+
+            cached = shared_cache.get(shared_cache_key)
+            if cached is not None:
+                cached, generation_params = cached
+                cond_cache.restore_generation_params(generation_params)
+                cache[prompt] = cached
+                res.append(cached)
+                continue
+
         texts = SdConditioning([x[1] for x in prompt_schedule], copy_from=prompts)
-        conds = model.get_learned_conditioning(texts)
+        if shared_cache is not None:
+            with cond_cache.record_generation_params() as generation_params:
+                conds = model.get_learned_conditioning(texts)
+        else:
+            conds = model.get_learned_conditioning(texts)
 
         cond_schedule = []
         for i, (end_at_step, _) in enumerate(prompt_schedule):
@@ -196,6 +222,9 @@ def get_learned_conditioning(model, prompts: SdConditioning | list[str], steps,
 
             cond_schedule.append(ScheduledPromptConditioning(end_at_step, cond))
 
+        if shared_cache is not None:
+            shared_cache.put(shared_cache_key, (cond_schedule, generation_params))
+
         cache[prompt] = cond_schedule
         res.append(cond_schedule)
 
@@ -403,6 +432,13 @@ def parse_prompt_attention(text):
      ['.', 1.1]]
     """
 
+    return [list(x) for x in parse_prompt_attention_cached(text)]
+
+
+@lru_cache(maxsize=4096)
+def parse_prompt_attention_cached(text):
+    """Same as parse_prompt_attention, but the result is memoized and made of tuples, which must not be changed."""
+
     res = []
     round_brackets = []
     square_brackets = []
@@ -455,7 +491,7 @@ def parse_prompt_attention(text):
         else:
             i += 1
 
-    return res
+    return tuple(tuple(x) for x in res)
 
 if __name__ == "__main__":
     import doctest
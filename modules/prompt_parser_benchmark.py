@@ -0,0 +1,69 @@
+"""
+Micro-benchmark for prompt parsing: time to turn a prompt into scheduled texts with attention weights, with and without
+the memoization in prompt_parser.
+
+Run `python -m modules.prompt_parser_benchmark` from the webui directory.
+"""
+
+import functools
+import timeit
+
+from modules import prompt_parser
+
+prompts = {
+    "plain": "a photo of a cat sitting on a wooden table, soft light, 35mm, highly detailed",
+    "nested emphasis": "a (((house:1.3)) [on] a (hill:0.5), sun, (((sky))), ((red (roof:1.2)) [[old]] (window:0.8)), \\(literal\\)",
+    "scheduling": "fantasy landscape with a [mountain:lake:0.25] and [an oak:a christmas tree:0.75][ in foreground::0.6][: in background:0.25] [shoddy:masterful:0.5]",
+    "alternation": "a [cat|dog|fox] in a [forest|field], [(red:1.2)|blue] [hat|scarf|]",
+    "AND composition": "a castle on a hill :1.2 AND (stormy sky:1.3) [at night:at dawn:0.5] AND [cat|dog] in the foreground :0.8",
+    "long": ", ".join(f"(detail {i}:1.{i % 10})" if i % 3 == 0 else f"[thing {i}:other {i}:{i % 20 + 1}]" if i % 3 == 1 else f"item {i}" for i in range(60)),
+}
+
+
+def parse(prompt, steps, get_schedule, parse_attention):
+    """Does the parsing that happens for a prompt before it's tokenized: AND, scheduling, then attention for every scheduled text."""
+
+    _, flat_prompts, _ = prompt_parser.get_multicond_prompt_list([prompt])
+
+    res = []
+    for text in flat_prompts:
+        for end_at_step, scheduled_text in get_schedule(text, steps, 0, 0, False):
+            res.append((end_at_step, parse_attention(scheduled_text)))
+
+    return res
+
+
+def benchmark(steps=20, number=20):
+    """Returns microseconds per prompt for each prompt kind, parsed from scratch and with caches."""
+
+    modes = {
+        "uncached": (prompt_parser.get_prompt_schedule.__wrapped__, prompt_parser.parse_prompt_attention_cached.__wrapped__),
+        "cached": (prompt_parser.get_prompt_schedule, prompt_parser.parse_prompt_attention_cached),
+    }
+
+    res = {}
+    for name, prompt in prompts.items():
+        for mode, (get_schedule, parse_attention) in modes.items():
+            func = functools.partial(parse, prompt, steps, get_schedule, parse_attention)
+            func()
+            seconds = timeit.timeit(func, number=number)
+            res[(name, mode)] = seconds / number * 1e6
+
+    return res
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark prompt parsing with and without caches")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--number", type=int, default=20, help="times to parse each prompt")
+    args = parser.parse_args()
+
+    res = benchmark(args.steps, args.number)
+
+    print(f"{'prompt':>16} {'uncached':>12} {'cached':>12}")
+    for name in prompts:
+        uncached = res[(name, "uncached")]
+        cached = res[(name, "cached")]
+        print(f"{name:>16} {uncached:>9.1f} us {cached:>9.1f} us  {uncached / cached:.0f}x")
@@ -0,0 +1,205 @@
+"""
+Combining txt2img API requests that arrive at about the same time into one sampler batch.
+
+Requests that differ only in prompt, negative prompt, seed, CFG scale and batch size are compatible: the first one to
+arrive waits txt2img_batching_window_ms for others, then all of them are generated together as one batch with
+per-image prompts, seeds and CFG scales, and each request gets its own images and infotexts back. A GPU processes a
+batch of N images faster than N batches of one, so this raises throughput when many users send small requests.
+
+Run `python modules/request_batching_benchmark.py` against a running server to compare images/second for sequential
+and concurrent requests.
+"""
+
+import copy
+import json
+import threading
+
+from modules import extra_networks, shared
+from modules.processing import get_fixed_seed
+
+# fields that can be different for every request in a batch; everything else has to be equal
+per_request_fields = {"prompt", "negative_prompt", "seed", "subseed", "cfg_scale", "batch_size", "force_task_id"}
+
+
+class BatchedRequest:
+    def __init__(self, task_id, args, script_args):
+        self.task_id = task_id
+        self.args = args
+        self.script_args = script_args
+        self.images = args.get('batch_size') or 1
+
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Batch:
+    def __init__(self):
+        self.requests = []
+        self.images = 0
+        self.full = threading.Event()
+
+
+class BatchScheduler:
+    def __init__(self):
+        self.open_batches = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, request, queue_lock, process):
+        """
+        Adds the request to the open batch with the same key, or opens a new one; returns the request's result.
+
+        The request that opens a batch waits for others, then takes queue_lock and calls process(requests),
+        which must return a result for every request in the same order.
+        """
+
+        max_images = shared.opts.txt2img_batching_max_images
+
+        with self.lock:
+            batch = self.open_batches.get(key)
+            is_leader = batch is None or batch.images + request.images > max_images
+            if is_leader:
+                if batch is not None:
+                    self.close(key, batch)
+
+                batch = Batch()
+                self.open_batches[key] = batch
+
+            batch.requests.append(request)
+            batch.images += request.images
+
+            if batch.images >= max_images:
+                self.close(key, batch)
+
+        if is_leader:
+            batch.full.wait(shared.opts.txt2img_batching_window_ms / 1000)
+
+            # requests that arrive while the previous batch is being generated still join this one
+            with queue_lock:
+                with self.lock:
+                    self.close(key, batch)
+
+                self.run(batch, process)
+
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+
+        return request.result
+
+    def close(self, key, batch):
+        if self.open_batches.get(key) is batch:
+            del self.open_batches[key]
+
+        batch.full.set()
+
+    def run(self, batch, process):
+        try:
+            for request, result in zip(batch.requests, process(batch.requests)):
+                request.result = result
+        except Exception as e:
+            for request in batch.requests:
+                request.error = e
+        finally:
+            for request in batch.requests:
+                if request.result is None and request.error is None:
+                    request.error = RuntimeError("batched request did not produce a result")
+
+                request.done.set()
+
+
+scheduler = BatchScheduler()
+
+
+def enabled():
+    return shared.opts.txt2img_batching_max_images > 1
+
+
+def can_batch(req, args, selectable_scripts):
+    """Whether a txt2img API request can be generated together with others."""
+
+    if not enabled() or selectable_scripts is not None or req.alwayson_scripts or req.infotext:
+        return False
+
+    # a grid is saved for every request with more than one image, which batching would lose
+    if req.save_images and (args.get('batch_size') or 1) > 1:
+        return False
+
+    return (args.get('n_iter') or 1) == 1 and (args.get('batch_size') or 1) <= shared.opts.txt2img_batching_max_images
+
+
+def batch_key(args):
+    """
+    Requests with equal keys can be generated in one batch.
+
+    Extra networks are part of the key because a batch activates networks from its first prompt for all images.
+    """
+
+    common = {k: v for k, v in args.items() if k not in per_request_fields}
+    common["extra_networks"] = extra_networks.parse_prompt(args.get('prompt') or '')[1]
+
+    return json.dumps(common, sort_keys=True, default=lambda x: x.items if isinstance(x, extra_networks.ExtraNetworkParams) else repr(x))
+
+
+def combined_args(requests):
+    """Arguments for StableDiffusionProcessingTxt2Img that generate images for all requests in one batch."""
+
+    prompts = []
+    negative_prompts = []
+    seeds = []
+    subseeds = []
+    cfg_scales = []
+
+    for request in requests:
+        args = request.args
+        seed = get_fixed_seed(args.get('seed', -1))
+        subseed = get_fixed_seed(args.get('subseed', -1))
+        subseed_strength = args.get('subseed_strength') or 0
+
+        for i in range(request.images):
+            prompts.append(args.get('prompt') or '')
+            negative_prompts.append(args.get('negative_prompt') or '')
+            seeds.append(int(seed) + (i if subseed_strength == 0 else 0))
+            subseeds.append(int(subseed) + i)
+            cfg_scales.append(args.get('cfg_scale', 7.0))
+
+    return {
+        "prompt": prompts,
+        "negative_prompt": negative_prompts,
+        "seed": seeds,
+        "subseed": subseeds,
+        "batch_size": len(prompts),
+        "n_iter": 1,
+        "do_not_save_grid": True,
+    }, cfg_scales
+
+
+def split_processed(processed, requests):
+    """Splits Processed for a combined batch into one Processed for each request."""
+
+    res = []
+    start = 0
+
+    for request in requests:
+        end = start + request.images
+
+        part = copy.copy(processed)
+        part.images = processed.images[start:end]
+        part.all_prompts = processed.all_prompts[start:end]
+        part.all_negative_prompts = processed.all_negative_prompts[start:end]
+        part.all_seeds = processed.all_seeds[start:end]
+        part.all_subseeds = processed.all_subseeds[start:end]
+        part.infotexts = processed.infotexts[start:end]
+        part.info = part.infotexts[0] if part.infotexts else processed.info
+        part.prompt = part.all_prompts[0] if part.all_prompts else processed.prompt
+        part.negative_prompt = part.all_negative_prompts[0] if part.all_negative_prompts else processed.negative_prompt
+        part.seed = part.all_seeds[0] if part.all_seeds else processed.seed
+        part.subseed = part.all_subseeds[0] if part.all_subseeds else processed.subseed
+        part.cfg_scale = request.args.get('cfg_scale', processed.cfg_scale)
+        part.batch_size = request.images
+        part.index_of_first_image = 0
+
+        res.append(part)
+        start = end
+
+    return res
@@ -0,0 +1,77 @@
+"""
+Measures txt2img API throughput in images/second for requests sent one after another and at the same time.
+
+Start the server with --api, set "Maximum images in a batch combined from concurrent txt2img API requests" in
+settings, then run `python modules/request_batching_benchmark.py --url http://127.0.0.1:7860`. Setting it to 0 and
+running again gives the numbers for concurrent requests without batching.
+
+Only the standard library is used, so this can run from any python without the webui's dependencies.
+"""
+
+import argparse
+import base64
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def txt2img(url, payload, auth=None):
+    req = urllib.request.Request(f"{url.rstrip('/')}/sdapi/v1/txt2img", data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"})
+    if auth:
+        req.add_header("Authorization", "Basic " + base64.b64encode(auth.encode()).decode())
+
+    with urllib.request.urlopen(req) as response:
+        return len(json.loads(response.read())["images"])
+
+
+def payloads(count, steps, width, height):
+    return [{
+        "prompt": f"a photo of a cat, number {i}",
+        "negative_prompt": "blurry",
+        "seed": 1000 + i,
+        "cfg_scale": 5 + i % 4,
+        "steps": steps,
+        "width": width,
+        "height": height,
+        "send_images": True,
+        "save_images": False,
+    } for i in range(count)]
+
+
+def benchmark(url, count=8, steps=20, width=512, height=512, auth=None):
+    """Returns images/second for sequential and concurrent requests."""
+
+    requests = payloads(count, steps, width, height)
+    txt2img(url, requests[0], auth)  # warmup
+
+    res = {}
+
+    start = time.perf_counter()
+    images = sum(txt2img(url, payload, auth) for payload in requests)
+    res["sequential"] = images / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        images = sum(executor.map(lambda payload: txt2img(url, payload, auth), requests))
+    res["concurrent"] = images / (time.perf_counter() - start)
+
+    return res
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark txt2img API throughput for sequential and concurrent requests")
+    parser.add_argument("--url", default="http://127.0.0.1:7860")
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--auth", default=None, help="user:password for --api-auth")
+    args = parser.parse_args()
+
+    res = benchmark(args.url, args.requests, args.steps, args.width, args.height, args.auth)
+
+    for mode, images_per_second in res.items():
+        print(f"{mode:>10}: {images_per_second:.2f} images/s")
+
+    print(f"   speedup: {res['concurrent'] / res['sequential']:.2f}x")
@@ -1,5 +1,5 @@
 import math
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
 import torch
 
@@ -43,6 +43,10 @@ class TextConditionalModel(torch.nn.Module):
         self.id_end = None
         self.id_pad = None
 
+        self.chunk_cache = OrderedDict()
+        self.token_cache = OrderedDict()
+        self.token_cache_size = 4096
+
     def empty_chunk(self):
         """creates an empty PromptChunk and returns it"""
 
@@ -61,6 +65,24 @@ class TextConditionalModel(torch.nn.Module):
 
         raise NotImplementedError
 
+    def tokenize_cached(self, texts):
+        """Same as tokenize, but remembers token ids for the last token_cache_size texts; results must not be changed"""
+
+        missing = list(dict.fromkeys(text for text in texts if text not in self.token_cache))
+        if missing:
+            for text, tokens in zip(missing, self.tokenize(missing)):
+                self.token_cache[text] = tokens
+
+        res = []
+        for text in texts:
+            self.token_cache.move_to_end(text)
+            res.append(self.token_cache[text])
+
+        while len(self.token_cache) > self.token_cache_size:
+            self.token_cache.popitem(last=False)
+
+        return res
+
     def encode_with_transformers(self, tokens):
         """
         converts a batch of token ids (in python lists) into a single tensor with numeric representation of those tokens;
@@ -90,7 +112,7 @@ class TextConditionalModel(torch.nn.Module):
         else:
             parsed = [[line, 1.0]]
 
-        tokenized = self.tokenize([text for text, _ in parsed])
+        tokenized = self.tokenize_cached([text for text, _ in parsed])
 
         chunks = []
         chunk = PromptChunk()
@@ -212,20 +234,16 @@ class TextConditionalModel(torch.nn.Module):
         used_embeddings = {}
         chunk_count = max([len(x) for x in batch_chunks])
 
-        zs = []
+        columns = []
         for i in range(chunk_count):
             batch_chunk = [chunks[i] if i < len(chunks) else self.empty_chunk() for chunks in batch_chunks]
+            columns.append(batch_chunk)
 
-            tokens = [x.tokens for x in batch_chunk]
-            multipliers = [x.multipliers for x in batch_chunk]
-            self.hijack.fixes = [x.fixes for x in batch_chunk]
-
-            for fixes in self.hijack.fixes:
-                for _position, embedding in fixes:
+            for chunk in batch_chunk:
+                for _position, embedding in chunk.fixes:
                     used_embeddings[embedding.name] = embedding
-            devices.torch_npu_set_device()
-            z = self.process_tokens(tokens, multipliers)
-            zs.append(z)
+
+        zs = self.encode_chunks(columns, getattr(texts, 'cond_cache_key', None))
 
         if opts.textual_inversion_add_hashes_to_infotext and used_embeddings:
             hashes = []
@@ -250,6 +268,57 @@ class TextConditionalModel(torch.nn.Module):
         else:
             return torch.hstack(zs)
 
+    def encode_chunks(self, columns, context=None):
+        """
+        Encodes prompt chunks. columns is a list where every element is a batch of PromptChunks - the i-th chunks of all texts.
+        Returns a list with a tensor for every element of columns, same as process_tokens would return for it.
+
+        All columns that need encoding are sent through transformers network in a single call. If context - a hashable object
+        with everything outside of the chunks that affects the result, like checkpoint and extra networks - is given, results
+        are remembered, so that a long prompt that only changed in its last chunk only has that chunk encoded again.
+        """
+
+        keys = [tuple((tuple(x.tokens), tuple(x.multipliers), tuple(x.fixes)) for x in column) for column in columns]
+
+        use_cache = context is not None and opts.clip_chunk_cache_size > 0
+        if use_cache:
+            context = (context, opts.CLIP_stop_at_last_layers, opts.emphasis, opts.sdxl_clip_l_skip)
+
+        res = {}
+        if use_cache:
+            for key in keys:
+                z = self.chunk_cache.get((context, key))
+                if z is not None:
+                    self.chunk_cache.move_to_end((context, key))
+                    res[key] = z
+
+        missing = {key: column for key, column in zip(keys, columns) if key not in res}
+        if missing:
+            batch = [chunk for column in missing.values() for chunk in column]
+            self.hijack.fixes = [x.fixes for x in batch]
+
+            devices.torch_npu_set_device()
+            z_all = self.encode_tokens([x.tokens for x in batch])
+            pooled_all = getattr(z_all, 'pooled', None)
+
+            for i, (key, column) in enumerate(missing.items()):
+                start, end = i * len(column), (i + 1) * len(column)
+
+                z = z_all[start:end]
+                if pooled_all is not None:
+                    z.pooled = pooled_all[start:end]
+
+                z = self.apply_emphasis(z, [x.tokens for x in column], [x.multipliers for x in column])
+                res[key] = z
+
+                if use_cache:
+                    self.chunk_cache[(context, key)] = z
+
+            while len(self.chunk_cache) > max(opts.clip_chunk_cache_size, 0):
+                self.chunk_cache.popitem(last=False)
+
+        return [res[key] for key in keys]
+
     def process_tokens(self, remade_batch_tokens, batch_multipliers):
         """
         sends one single prompt chunk to be encoded by transformers neural network.
@@ -258,6 +327,14 @@ class TextConditionalModel(torch.nn.Module):
         Multipliers are used to give more or less weight to the outputs of transformers network. Each multiplier
         corresponds to one token.
         """
+
+        z = self.encode_tokens(remade_batch_tokens)
+
+        return self.apply_emphasis(z, remade_batch_tokens, batch_multipliers)
+
+    def encode_tokens(self, remade_batch_tokens):
+        """passes a batch of token lists through transformers network without applying emphasis"""
+
         tokens = torch.asarray(remade_batch_tokens).to(devices.device)
 
         # this is for SD2: SD1 uses the same token for padding and end of text, while SD2 uses different ones.
@@ -266,8 +343,9 @@ class TextConditionalModel(torch.nn.Module):
                 index = remade_batch_tokens[batch_pos].index(self.id_end)
                 tokens[batch_pos, index+1:tokens.shape[1]] = self.id_pad
 
-        z = self.encode_with_transformers(tokens)
+        return self.encode_with_transformers(tokens)
 
+    def apply_emphasis(self, z, remade_batch_tokens, batch_multipliers):
         pooled = getattr(z, 'pooled', None)
 
         emphasis = sd_emphasis.get_current_option(opts.emphasis)()
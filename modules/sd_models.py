@@ -1,5 +1,7 @@
 import collections
+import contextlib
 import importlib
+import itertools
 import os
 import sys
 import threading
@@ -12,7 +14,7 @@ from omegaconf import OmegaConf, ListConfig
 from urllib import request
 import ldm.modules.midas as midas
 
-from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, cache, extra_networks, processing, lowvram, sd_hijack, patches
+from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, sd_models_streaming, model_offload, hashing_service, cache, extra_networks, processing, lowvram, sd_hijack, patches
 from modules.timer import Timer
 from modules.shared import opts
 import tomesd
@@ -104,8 +106,15 @@ class CheckpointInfo:
         for id in self.ids:
             checkpoint_aliases[id] = self
 
-    def calculate_shorthash(self):
-        self.sha256 = hashes.sha256(self.filename, f"checkpoint/{self.name}")
+    def calculate_shorthash(self, blocking=True):
+        """Calculates the hash if it is not cached. With blocking=False and background hashing enabled, the file is hashed in
+        background instead, and the hash is applied to this checkpoint (and to the model, if it's loaded) once it's ready."""
+
+        if blocking:
+            self.sha256 = hashes.sha256(self.filename, f"checkpoint/{self.name}")
+        else:
+            self.sha256 = hashing_service.sha256(self.filename, f"checkpoint/{self.name}", callback=lambda _: self.apply_background_hash())
+
         if self.sha256 is None:
             return
 
@@ -127,6 +136,18 @@ class CheckpointInfo:
 
         return self.shorthash
 
+    def apply_background_hash(self):
+        # runs in a hashing thread; the lock keeps this from changing aliases and loaded models while a model is loading
+        with model_data.lock:
+            self.calculate_shorthash()
+
+            for model in model_data.loaded_sd_models:
+                if model.sd_checkpoint_info is self:
+                    model.sd_model_hash = self.shorthash
+
+            if model_data.sd_model is not None and model_data.sd_model.sd_checkpoint_info is self:
+                shared.opts.data["sd_checkpoint_hash"] = self.sha256
+
 
 try:
     # this silences the annoying "Some weights of the model checkpoint were not used when initializing..." message at start.
@@ -176,6 +197,9 @@ def list_models():
         checkpoint_info = CheckpointInfo(filename)
         checkpoint_info.register()
 
+    for checkpoint_info in list(checkpoints_list.values()):
+        hashing_service.submit(checkpoint_info.filename, f"checkpoint/{checkpoint_info.name}", callback=lambda _, c=checkpoint_info: c.calculate_shorthash())
+
 
 re_strip_checksum = re.compile(r"\s*\[[^]]+]\s*$")
 
@@ -264,13 +288,15 @@ def get_state_dict_from_checkpoint(pl_sd):
     pl_sd.pop("state_dict", None)
 
     is_sd2_turbo = 'conditioner.embedders.0.model.ln_final.weight' in pl_sd and pl_sd['conditioner.embedders.0.model.ln_final.weight'].size()[0] == 1024
+    replacements = checkpoint_dict_replacements_sd2_turbo if is_sd2_turbo else checkpoint_dict_replacements_sd1
+
+    if isinstance(pl_sd, sd_models_streaming.LazyStateDict):
+        pl_sd.rename_keys(lambda k: transform_checkpoint_dict_key(k, replacements))
+        return pl_sd
 
     sd = {}
     for k, v in pl_sd.items():
-        if is_sd2_turbo:
-            new_key = transform_checkpoint_dict_key(k, checkpoint_dict_replacements_sd2_turbo)
-        else:
-            new_key = transform_checkpoint_dict_key(k, checkpoint_dict_replacements_sd1)
+        new_key = transform_checkpoint_dict_key(k, replacements)
 
         if new_key is not None:
             sd[new_key] = v
@@ -309,12 +335,19 @@ def read_metadata_from_safetensors(filename):
         return res
 
 
-def read_state_dict(checkpoint_file, print_global_state=False, map_location=None):
+def read_state_dict(checkpoint_file, print_global_state=False, map_location=None, streaming=False):
+    """
+    Reads a checkpoint. With streaming=True, a .safetensors file is returned as a LazyStateDict that reads tensors from the
+    memory-mapped file on demand; it should be loaded into a model with sd_disable_initialization.LoadStateDictOnMeta.
+    """
+
     _, extension = os.path.splitext(checkpoint_file)
     if extension.lower() == ".safetensors":
         device = map_location or shared.weight_load_location or devices.get_optimal_device_name()
 
-        if not shared.opts.disable_mmap_load_safetensors:
+        if streaming and not shared.opts.disable_mmap_load_safetensors:
+            pl_sd = sd_models_streaming.LazyStateDict(checkpoint_file, device=device)
+        elif not shared.opts.disable_mmap_load_safetensors:
             pl_sd = safetensors.torch.load_file(checkpoint_file, device=device)
         else:
             pl_sd = safetensors.torch.load(open(checkpoint_file, 'rb').read())
@@ -329,8 +362,13 @@ def read_state_dict(checkpoint_file, print_global_state=False, map_location=None
     return sd
 
 
+def streaming_load_enabled():
+    # the checkpoint cache keeps whole state dicts in RAM, which defeats the purpose
+    return shared.opts.sd_checkpoint_streaming_load and shared.opts.sd_checkpoint_cache == 0 and not shared.cmd_opts.disable_model_loading_ram_optimization
+
+
 def get_checkpoint_state_dict(checkpoint_info: CheckpointInfo, timer):
-    sd_model_hash = checkpoint_info.calculate_shorthash()
+    sd_model_hash = checkpoint_info.calculate_shorthash(blocking=False)
     timer.record("calculate hash")
 
     if checkpoint_info in checkpoints_loaded:
@@ -341,7 +379,7 @@ def get_checkpoint_state_dict(checkpoint_info: CheckpointInfo, timer):
         return checkpoints_loaded[checkpoint_info]
 
     print(f"Loading weights [{sd_model_hash}] from {checkpoint_info.filename}")
-    res = read_state_dict(checkpoint_info.filename)
+    res = read_state_dict(checkpoint_info.filename, streaming=streaming_load_enabled())
     timer.record("load weights from disk")
 
     return res
@@ -408,7 +446,7 @@ def set_model_fields(model):
 
 
 def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer):
-    sd_model_hash = checkpoint_info.calculate_shorthash()
+    sd_model_hash = checkpoint_info.calculate_shorthash(blocking=False)
     timer.record("calculate hash")
 
     if devices.fp8:
@@ -524,7 +562,7 @@ def load_model_weights(model, checkpoint_info: CheckpointInfo, state_dict, timer
     while len(checkpoints_loaded) > shared.opts.sd_checkpoint_cache:
         checkpoints_loaded.popitem(last=False)
 
-    model.sd_model_hash = sd_model_hash
+    model.sd_model_hash = sd_model_hash or checkpoint_info.shorthash
     model.sd_model_checkpoint = checkpoint_info.filename
     model.sd_checkpoint_info = checkpoint_info
     shared.opts.data["sd_checkpoint_hash"] = checkpoint_info.sha256
@@ -735,10 +773,16 @@ def get_empty_cond(sd_model):
     return d
 
 
+def pinned_memory_offload_enabled(m):
+    return shared.opts.sd_checkpoints_pin_memory and not m.lowvram and model_offload.available()
+
+
 def send_model_to_cpu(m):
     if m is not None:
         if m.lowvram:
             lowvram.send_everything_to_cpu()
+        elif pinned_memory_offload_enabled(m):
+            model_offload.offload_to_pinned(m)
         else:
             m.to(devices.cpu)
 
@@ -755,15 +799,130 @@ def model_target_device(m):
 def send_model_to_device(m):
     lowvram.apply(m)
 
-    if not m.lowvram:
+    if pinned_memory_offload_enabled(m):
+        model_offload.load_from_pinned(m, shared.device)
+    elif not m.lowvram:
         m.to(shared.device)
 
 
 def send_model_to_trash(m):
     m.to(device="meta")
+    model_offload.free_pinned(m)
     devices.torch_gc()
 
 
+def model_memory_usage(m):
+    """Returns the size in bytes of the model's parameters and buffers as (on device, in RAM).
+
+    Pinned host buffers used for offloading stay allocated while the model is on device, so they count as RAM either way."""
+
+    pinned_buffers = getattr(m, 'pinned_buffers', None) or {}
+    pinned_ptrs = {buffer.data_ptr() for buffer in pinned_buffers.values()}
+
+    device_bytes = 0
+    ram_bytes = sum(buffer.numel() * buffer.element_size() for buffer in pinned_buffers.values())
+    for t in itertools.chain(m.parameters(), m.buffers()):
+        size = t.numel() * t.element_size()
+        if t.device.type == 'cpu':
+            if t.data_ptr() not in pinned_ptrs:
+                ram_bytes += size
+        elif t.device.type != 'meta':
+            device_bytes += size
+
+    return device_bytes, ram_bytes
+
+
+def checkpoint_budgets():
+    """Returns VRAM and RAM budgets for loaded checkpoints in bytes; 0 means the budget is not used."""
+
+    mb = 1024 * 1024
+    return int(shared.opts.sd_checkpoints_vram_budget_mb or 0) * mb, int(shared.opts.sd_checkpoints_ram_budget_mb or 0) * mb
+
+
+def estimate_model_size(checkpoint_info):
+    """Estimates the size in bytes of the checkpoint's weights after loading, from dtypes and shapes of its tensors and the dtype they are converted to."""
+
+    import json
+
+    unet_bytes = 4 if shared.cmd_opts.no_half else 2
+    vae_bytes = 4 if shared.cmd_opts.no_half or shared.cmd_opts.no_half_vae else 2
+    filename = checkpoint_info.filename
+
+    # for other formats dtypes are unknown without loading the file; fp16 weights take twice as much in fp32
+    fallback = os.path.getsize(filename) * (2 if shared.cmd_opts.no_half else 1)
+    if not checkpoint_info.is_safetensors:
+        return fallback
+
+    try:
+        with open(filename, mode="rb") as file:
+            header_len = int.from_bytes(file.read(8), "little")
+            header = json.loads(file.read(header_len))
+
+        size = 0
+        for key, tensor in header.items():
+            if key == "__metadata__":
+                continue
+
+            if tensor["dtype"].startswith(("F", "BF")):
+                size += int(np.prod(tensor["shape"])) * (vae_bytes if key.startswith("first_stage_model.") else unet_bytes)
+            else:
+                start, end = tensor["data_offsets"]
+                size += end - start
+
+        return size
+    except Exception:
+        return fallback
+
+
+def evict_loaded_models(keep=None, reserve_device=0, reserve_ram=0, timer=None):
+    """
+    Makes loaded models fit the byte budgets from settings, leaving reserve_device bytes free on device and reserve_ram
+    bytes free in RAM for a model that is about to be loaded or moved there. Least recently used models are moved from
+    device to RAM first, then unloaded from RAM; they are loaded again from disk when needed. The keep model is never evicted.
+    """
+
+    vram_budget, ram_budget = checkpoint_budgets()
+    mb = 1024 * 1024
+
+    usage = {id(m): model_memory_usage(m) for m in model_data.loaded_sd_models}
+
+    if vram_budget:
+        device_total = sum(device_bytes for device_bytes, _ in usage.values()) + reserve_device
+        for m in reversed(model_data.loaded_sd_models):
+            if device_total <= vram_budget:
+                break
+
+            device_bytes = usage[id(m)][0]
+            if m is keep or device_bytes == 0:
+                continue
+
+            print(f"Moving model {m.sd_checkpoint_info.title} to RAM: {device_total / mb:.0f} MB over VRAM budget of {vram_budget / mb:.0f} MB")
+            send_model_to_cpu(m)
+            usage[id(m)] = model_memory_usage(m)
+            device_total -= device_bytes
+
+            if timer:
+                timer.record("send model to cpu")
+
+    if ram_budget:
+        ram_total = sum(ram_bytes for _, ram_bytes in usage.values()) + reserve_ram
+        for m in list(reversed(model_data.loaded_sd_models)):
+            if ram_total <= ram_budget:
+                break
+
+            ram_bytes = usage[id(m)][1]
+            if m is keep or ram_bytes == 0:
+                continue
+
+            print(f"Unloading model {m.sd_checkpoint_info.title}: {ram_total / mb:.0f} MB over RAM budget of {ram_budget / mb:.0f} MB")
+            model_data.loaded_sd_models.remove(m)
+            send_model_to_trash(m)
+            ram_total -= ram_bytes
+
+            if timer:
+                timer.record("send model to trash")
+
+
 def instantiate_from_config(config, state_dict=None):
     constructor = get_obj_from_str(config["target"])
 
@@ -788,6 +947,7 @@ def load_model(checkpoint_info=None, already_loaded_state_dict=None):
     checkpoint_info = checkpoint_info or select_checkpoint()
 
     timer = Timer()
+    timer.track_peak_rss()
 
     if model_data.sd_model:
         send_model_to_trash(model_data.sd_model)
@@ -881,13 +1041,16 @@ def reuse_model_from_already_loaded(sd_model, checkpoint_info, timer):
     If it is loaded, returns that (moving it to GPU if necessary, and moving the currently loadded model to CPU if necessary).
     If not, returns the model that can be used to load weights from checkpoint_info's file.
     If no such model exists, returns None.
-    Additionally deletes loaded models that are over the limit set in settings (sd_checkpoints_limit).
+    Additionally deletes loaded models that are over the limit set in settings (sd_checkpoints_limit), or, if VRAM/RAM
+    budgets are set, evicts least recently used models until the loaded ones fit the budgets.
     """
 
     if sd_model is not None and sd_model.sd_checkpoint_info.filename == checkpoint_info.filename:
         return sd_model
 
-    if shared.opts.sd_checkpoints_keep_in_cpu:
+    vram_budget, ram_budget = checkpoint_budgets()
+
+    if shared.opts.sd_checkpoints_keep_in_cpu and not vram_budget:
         send_model_to_cpu(sd_model)
         timer.record("send model to cpu")
 
@@ -898,17 +1061,20 @@ def reuse_model_from_already_loaded(sd_model, checkpoint_info, timer):
             already_loaded = loaded_model
             continue
 
-        if len(model_data.loaded_sd_models) > shared.opts.sd_checkpoints_limit > 0:
+        if not ram_budget and len(model_data.loaded_sd_models) > shared.opts.sd_checkpoints_limit > 0:
             print(f"Unloading model {len(model_data.loaded_sd_models)} over the limit of {shared.opts.sd_checkpoints_limit}: {loaded_model.sd_checkpoint_info.title}")
             del model_data.loaded_sd_models[i]
             send_model_to_trash(loaded_model)
             timer.record("send model to trash")
 
     if already_loaded is not None:
+        evict_loaded_models(keep=already_loaded, reserve_device=model_memory_usage(already_loaded)[1], timer=timer)
+
         send_model_to_device(already_loaded)
         timer.record("send model to device")
 
         model_data.set_sd_model(already_loaded, already_loaded=True)
+        evict_loaded_models(keep=already_loaded, timer=timer)
 
         if not SkipWritingToConfig.skip:
             shared.opts.data["sd_model_checkpoint"] = already_loaded.sd_checkpoint_info.title
@@ -917,7 +1083,21 @@ def reuse_model_from_already_loaded(sd_model, checkpoint_info, timer):
         print(f"Using already loaded model {already_loaded.sd_checkpoint_info.title}: done in {timer.summary()}")
         sd_vae.reload_vae_weights(already_loaded)
         return model_data.sd_model
+    elif ram_budget:
+        # the state dict is read into RAM before weights are moved to device
+        model_size = estimate_model_size(checkpoint_info)
+        evict_loaded_models(reserve_device=model_size, reserve_ram=model_size, timer=timer)
+
+        print(f"Loading model {checkpoint_info.title} ({len(model_data.loaded_sd_models) + 1} loaded)")
+
+        model_data.sd_model = None
+        load_model(checkpoint_info)
+        evict_loaded_models(keep=model_data.sd_model, timer=timer)
+        return model_data.sd_model
     elif shared.opts.sd_checkpoints_limit > 1 and len(model_data.loaded_sd_models) < shared.opts.sd_checkpoints_limit:
+        if vram_budget:
+            evict_loaded_models(reserve_device=estimate_model_size(checkpoint_info), timer=timer)
+
         print(f"Loading model {checkpoint_info.title} ({len(model_data.loaded_sd_models) + 1} out of {shared.opts.sd_checkpoints_limit})")
 
         model_data.sd_model = None
@@ -941,6 +1121,7 @@ def reload_model_weights(sd_model=None, info=None, forced_reload=False):
     checkpoint_info = info or select_checkpoint()
 
     timer = Timer()
+    timer.track_peak_rss()
 
     if not sd_model:
         sd_model = model_data.sd_model
@@ -977,8 +1158,15 @@ def reload_model_weights(sd_model=None, info=None, forced_reload=False):
         load_model(checkpoint_info, already_loaded_state_dict=state_dict)
         return model_data.sd_model
 
+    if isinstance(state_dict, sd_models_streaming.LazyStateDict):
+        # copy tensors into the existing parameters one by one as they are read from the file
+        load_context = sd_disable_initialization.LoadStateDictOnMeta(state_dict, device=model_target_device(sd_model))
+    else:
+        load_context = contextlib.nullcontext()
+
     try:
-        load_model_weights(sd_model, checkpoint_info, state_dict, timer)
+        with load_context:
+            load_model_weights(sd_model, checkpoint_info, state_dict, timer)
     except Exception:
         print("Failed to load checkpoint, restoring previous")
         load_model_weights(sd_model, current_checkpoint_info, None, timer)
@@ -0,0 +1,84 @@
+from collections.abc import MutableMapping
+
+import torch
+from safetensors import safe_open
+
+safetensors_dtypes = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+    "F8_E4M3": getattr(torch, "float8_e4m3fn", None),
+    "F8_E5M2": getattr(torch, "float8_e5m2", None),
+}
+
+
+class LazyStateDict(MutableMapping):
+    """
+    A state dict backed by a memory-mapped .safetensors file: a tensor is read from the file and created on device only when
+    it is requested, so loading it into a model with sd_disable_initialization.LoadStateDictOnMeta, which pops tensors one
+    by one as modules load them, never holds more than one tensor of the checkpoint in memory at a time.
+
+    Keys can be renamed without reading anything, and tensors assigned to the dict are kept as they are.
+    """
+
+    def __init__(self, filename, device="cpu"):
+        self.filename = filename
+        self.device = device
+        self.file = safe_open(filename, framework="pt", device=str(device))
+        self.sources = {key: key for key in self.file.keys()}
+        self.assigned = {}
+
+    def __getitem__(self, key):
+        if key in self.assigned:
+            return self.assigned[key]
+
+        return self.file.get_tensor(self.sources[key])
+
+    def __setitem__(self, key, value):
+        self.sources.pop(key, None)
+        self.assigned[key] = value
+
+    def __delitem__(self, key):
+        if key in self.assigned:
+            del self.assigned[key]
+        else:
+            del self.sources[key]
+
+    def __contains__(self, key):
+        return key in self.sources or key in self.assigned
+
+    def __iter__(self):
+        yield from list(self.sources)
+        yield from list(self.assigned)
+
+    def __len__(self):
+        return len(self.sources) + len(self.assigned)
+
+    def copy(self):
+        return dict(self.items())
+
+    def rename_keys(self, transform):
+        """Renames keys with transform(key) -> new key, dropping keys for which it returns None."""
+
+        self.sources = {new_key: source for new_key, source in ((transform(key), source) for key, source in self.sources.items()) if new_key is not None}
+        self.assigned = {new_key: value for new_key, value in ((transform(key), value) for key, value in self.assigned.items()) if new_key is not None}
+
+    def meta_dict(self):
+        """Returns a regular dict with the same keys and tensors of the same shapes and dtypes on meta device, without reading the file."""
+
+        res = {}
+        for key, source in self.sources.items():
+            tensor_slice = self.file.get_slice(source)
+            res[key] = torch.empty(tensor_slice.get_shape(), dtype=safetensors_dtypes[tensor_slice.get_dtype()], device="meta")
+
+        for key, value in self.assigned.items():
+            res[key] = value.to(device="meta", dtype=value.dtype)
+
+        return res
@@ -1,5 +1,7 @@
+import time
+
 import torch
-from modules import prompt_parser, sd_samplers_common
+from modules import prompt_parser, sd_samplers_common, devices
 
 from modules.shared import opts, state
 import modules.shared as shared
@@ -63,6 +65,9 @@ class CFGDenoiser(torch.nn.Module):
         self.need_last_noise_uncond = False
         self.last_noise_uncond = None
 
+        self.last_uncond = None
+        self.last_uncond_step = None
+
         # NOTE: masking before denoising can cause the original latents to be oversmoothed
         # as the original latents do not have noise
         self.mask_before_denoising = False
@@ -77,7 +82,7 @@ class CFGDenoiser(torch.nn.Module):
 
         for i, conds in enumerate(conds_list):
             for cond_index, weight in conds:
-                denoised[i] += (x_out[cond_index] - denoised_uncond[i]) * (weight * cond_scale)
+                denoised[i] += (x_out[cond_index] - denoised_uncond[i]) * (weight * (cond_scale[i] if isinstance(cond_scale, list) else cond_scale))
 
         return denoised
 
@@ -87,6 +92,37 @@ class CFGDenoiser(torch.nn.Module):
 
         return denoised
 
+    def batch_cond_scale(self, cond_scale):
+        """CFG scale for the current batch: a number, or a list with a scale for every image if p.cfg_scales is set."""
+
+        cfg_scales = getattr(self.p, 'cfg_scales', None)
+        if not cfg_scales:
+            return cond_scale * self.cond_scale_miltiplier
+
+        offset = self.p.iteration * self.p.batch_size
+        return [x * self.cond_scale_miltiplier for x in cfg_scales[offset:offset + self.p.batch_size]]
+
+    def guidance_is_noop(self, conds_list, cond_scale):
+        """True if CFG does not change the result: the scale is 1 and every image has a single prompt with weight 1"""
+
+        scales = cond_scale if isinstance(cond_scale, list) else [cond_scale]
+
+        return all(x == 1.0 for x in scales) and all(len(conds) == 1 and conds[0][1] == 1.0 for conds in conds_list)
+
+    def record_step_time(self, start, sigma, uncond_mode):
+        if devices.device.type == 'cuda':
+            torch.cuda.synchronize(devices.device)
+
+        if self.p.sampling_step_times is None:
+            self.p.sampling_step_times = []
+
+        self.p.sampling_step_times.append({
+            "step": self.step,
+            "sigma": float(sigma[0]),
+            "uncond": uncond_mode,
+            "seconds": time.perf_counter() - start,
+        })
+
     def get_pred_x0(self, x_in, x_out, sigma):
         return x_out
 
@@ -157,6 +193,8 @@ class CFGDenoiser(torch.nn.Module):
         if state.interrupted or state.skipped:
             raise sd_samplers_common.InterruptedException
 
+        start = time.perf_counter() if shared.opts.sampling_step_timing else None
+
         if sd_samplers_common.apply_refiner(self, sigma):
             cond = self.sampler.sampler_extra_args['cond']
             uncond = self.sampler.sampler_extra_args['uncond']
@@ -216,6 +254,7 @@ class CFGDenoiser(torch.nn.Module):
         tensor = denoiser_params.text_cond
         uncond = denoiser_params.text_uncond
         skip_uncond = False
+        reuse_uncond = False
 
         if shared.opts.skip_early_cond != 0. and self.step / self.total_steps <= shared.opts.skip_early_cond:
             skip_uncond = True
@@ -225,6 +264,12 @@ class CFGDenoiser(torch.nn.Module):
             self.p.extra_generation_params["NGMS"] = s_min_uncond
             if shared.opts.s_min_uncond_all:
                 self.p.extra_generation_params["NGMS all steps"] = shared.opts.s_min_uncond_all
+        elif shared.opts.cfg_skip_uncond_at_scale_1 and not is_edit_model and not self.need_last_noise_uncond and self.guidance_is_noop(conds_list, self.batch_cond_scale(cond_scale)):
+            skip_uncond = True
+        elif shared.opts.cfg_uncond_reuse and self.step % 2 and self.last_uncond_step == self.step - 1 and self.last_uncond.shape == x.shape and not is_edit_model:
+            skip_uncond = True
+            reuse_uncond = True
+            self.p.extra_generation_params["Uncond reuse"] = True
 
         if skip_uncond:
             x_in = x_in[:-batch_size]
@@ -271,9 +316,14 @@ class CFGDenoiser(torch.nn.Module):
                 x_out[-uncond.shape[0]:] = self.inner_model(x_in[-uncond.shape[0]:], sigma_in[-uncond.shape[0]:], cond=make_condition_dict(uncond, image_cond_in[-uncond.shape[0]:]))
 
         denoised_image_indexes = [x[0][0] for x in conds_list]
-        if skip_uncond:
+        if reuse_uncond:
+            x_out = torch.cat([x_out, self.last_uncond])  # uncond-denoised image from the previous step stands in for this one
+        elif skip_uncond:
             fake_uncond = torch.cat([x_out[i:i+1] for i in denoised_image_indexes])
             x_out = torch.cat([x_out, fake_uncond])  # we skipped uncond denoising, so we put cond-denoised image to where the uncond-denoised image should be
+        elif shared.opts.cfg_uncond_reuse:
+            self.last_uncond = torch.clone(x_out[-uncond.shape[0]:])
+            self.last_uncond_step = self.step
 
         denoised_params = CFGDenoisedParams(x_out, state.sampling_step, state.sampling_steps, self.inner_model)
         cfg_denoised_callback(denoised_params)
@@ -283,10 +333,10 @@ class CFGDenoiser(torch.nn.Module):
 
         if is_edit_model:
             denoised = self.combine_denoised_for_edit_model(x_out, cond_scale * self.cond_scale_miltiplier)
-        elif skip_uncond:
+        elif skip_uncond and not reuse_uncond:
             denoised = self.combine_denoised(x_out, conds_list, uncond, 1.0)
         else:
-            denoised = self.combine_denoised(x_out, conds_list, uncond, cond_scale * self.cond_scale_miltiplier)
+            denoised = self.combine_denoised(x_out, conds_list, uncond, self.batch_cond_scale(cond_scale))
 
         # Blend in the original latents (after)
         if not self.mask_before_denoising and self.mask is not None:
@@ -307,6 +357,9 @@ class CFGDenoiser(torch.nn.Module):
         cfg_after_cfg_callback(after_cfg_callback_params)
         denoised = after_cfg_callback_params.x
 
+        if start is not None:
+            self.record_step_time(start, sigma, "reused" if reuse_uncond else "skipped" if skip_uncond else "computed")
+
         self.step += 1
         return denoised
 
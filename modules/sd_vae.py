@@ -2,7 +2,7 @@ import os
 import collections
 from dataclasses import dataclass
 
-from modules import paths, shared, devices, script_callbacks, sd_models, extra_networks, lowvram, sd_hijack, hashes
+from modules import paths, shared, devices, script_callbacks, sd_models, extra_networks, lowvram, sd_hijack, hashes, dir_index
 
 import glob
 from copy import deepcopy
@@ -69,35 +69,64 @@ def get_filename(filepath):
     return os.path.basename(filepath)
 
 
-def refresh_vae_list():
-    vae_dict.clear()
-
-    paths = [
-        os.path.join(sd_models.model_path, '**/*.vae.ckpt'),
-        os.path.join(sd_models.model_path, '**/*.vae.pt'),
-        os.path.join(sd_models.model_path, '**/*.vae.safetensors'),
-        os.path.join(vae_path, '**/*.ckpt'),
-        os.path.join(vae_path, '**/*.pt'),
-        os.path.join(vae_path, '**/*.safetensors'),
-    ]
+def vae_candidates_from_index():
+    vae_near_checkpoint_dirs = [sd_models.model_path]
+    vae_dirs = [vae_path]
 
     if shared.cmd_opts.ckpt_dir is not None and os.path.isdir(shared.cmd_opts.ckpt_dir):
-        paths += [
-            os.path.join(shared.cmd_opts.ckpt_dir, '**/*.vae.ckpt'),
-            os.path.join(shared.cmd_opts.ckpt_dir, '**/*.vae.pt'),
-            os.path.join(shared.cmd_opts.ckpt_dir, '**/*.vae.safetensors'),
-        ]
+        vae_near_checkpoint_dirs.append(shared.cmd_opts.ckpt_dir)
 
     if shared.cmd_opts.vae_dir is not None and os.path.isdir(shared.cmd_opts.vae_dir):
-        paths += [
-            os.path.join(shared.cmd_opts.vae_dir, '**/*.ckpt'),
-            os.path.join(shared.cmd_opts.vae_dir, '**/*.pt'),
-            os.path.join(shared.cmd_opts.vae_dir, '**/*.safetensors'),
-        ]
+        vae_dirs.append(shared.cmd_opts.vae_dir)
+
+    def walk(path):
+        # like the glob patterns used without the index, files and directories starting with a dot are skipped
+        for filename in dir_index.index.walk_files(path, ['.ckpt', '.pt', '.safetensors'], include_hidden=True):
+            if not any(part.startswith('.') for part in os.path.relpath(filename, path).split(os.sep)):
+                yield filename
 
     candidates = []
-    for path in paths:
-        candidates += glob.iglob(path, recursive=True)
+    for path in vae_near_checkpoint_dirs:
+        candidates += [x for x in walk(path) if x.endswith(('.vae.ckpt', '.vae.pt', '.vae.safetensors'))]
+
+    for path in vae_dirs:
+        candidates += walk(path)
+
+    return candidates
+
+
+def refresh_vae_list():
+    vae_dict.clear()
+
+    if dir_index.enabled():
+        candidates = vae_candidates_from_index()
+    else:
+        paths = [
+            os.path.join(sd_models.model_path, '**/*.vae.ckpt'),
+            os.path.join(sd_models.model_path, '**/*.vae.pt'),
+            os.path.join(sd_models.model_path, '**/*.vae.safetensors'),
+            os.path.join(vae_path, '**/*.ckpt'),
+            os.path.join(vae_path, '**/*.pt'),
+            os.path.join(vae_path, '**/*.safetensors'),
+        ]
+
+        if shared.cmd_opts.ckpt_dir is not None and os.path.isdir(shared.cmd_opts.ckpt_dir):
+            paths += [
+                os.path.join(shared.cmd_opts.ckpt_dir, '**/*.vae.ckpt'),
+                os.path.join(shared.cmd_opts.ckpt_dir, '**/*.vae.pt'),
+                os.path.join(shared.cmd_opts.ckpt_dir, '**/*.vae.safetensors'),
+            ]
+
+        if shared.cmd_opts.vae_dir is not None and os.path.isdir(shared.cmd_opts.vae_dir):
+            paths += [
+                os.path.join(shared.cmd_opts.vae_dir, '**/*.ckpt'),
+                os.path.join(shared.cmd_opts.vae_dir, '**/*.pt'),
+                os.path.join(shared.cmd_opts.vae_dir, '**/*.safetensors'),
+            ]
+
+        candidates = []
+        for path in paths:
+            candidates += glob.iglob(path, recursive=True)
 
     for filepath in candidates:
         name = get_filename(filepath)
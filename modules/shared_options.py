@@ -125,7 +125,12 @@ options_templates.update(options_section(('system', "System", "system"), {
     "enable_upscale_progressbar": OptionInfo(True, "Show a progress bar in the console for tiled upscaling."),
     "print_hypernet_extra": OptionInfo(False, "Print extra hypernetwork information to console."),
     "list_hidden_files": OptionInfo(True, "Load models/files in hidden directories").info("directory is hidden if its name starts with \".\""),
+    "dir_index_enable": OptionInfo(False, "Keep an index of files in model directories").info("refreshing lists of checkpoints, VAE, Lora and embeddings only re-reads directories that changed; useful for large or network directories"),
+    "dir_index_watch": OptionInfo(True, "Watch indexed directories for changes").info("requires the watchdog package; disable for network filesystems shared with other machines, where changes are not reported").needs_restart(),
     "disable_mmap_load_safetensors": OptionInfo(False, "Disable memmapping for loading .safetensors files.").info("fixes very slow loading speed in some cases"),
+    "hash_in_background": OptionInfo(False, "Calculate hashes of models in background").info("newly found checkpoints, Lora and embeddings are hashed by worker threads instead of when they are first used; until then infotext has no hash for them; progress is at /sdapi/v1/hashing-progress"),
+    "hash_background_workers": OptionInfo(2, "Number of files to hash at the same time in background", gr.Slider, {"minimum": 1, "maximum": 16, "step": 1}).needs_restart(),
+    "sd_checkpoint_streaming_load": OptionInfo(False, "Stream .safetensors checkpoints into the model tensor by tensor").info("reads each weight from the memory-mapped file only when it is loaded into the model instead of reading the whole checkpoint first; lowers peak RAM usage; not used when checkpoints are cached in RAM"),
     "hide_ldm_prints": OptionInfo(True, "Prevent Stability-AI's ldm/sgm modules from printing noise to console."),
     "dump_stacks_on_signal": OptionInfo(False, "Print stack traces before exiting the program with ctrl+c."),
 }))
@@ -152,6 +157,23 @@ options_templates.update(options_section(('API', "API", "system"), {
     "api_useragent": OptionInfo("", "User agent for requests", restrict_api=True),
 }))
 
+options_templates.update(options_section(('points', "Points", "system"), {
+    "points_metering_enable": OptionInfo(False, "Charge logged in users points for txt2img/img2img generation").info("points are held when a task is queued and the unused part is returned when it finishes; interrupted batches are not charged; requires login for generation"),
+    "points_cost_per_image": OptionInfo(1.0, "Points per generated image", gr.Number, restrict_api=True),
+    "points_cost_per_megapixel_step": OptionInfo(0.0, "Additional points per image per megapixel per sampling step", gr.Number, restrict_api=True).info("0 = flat price per image"),
+}))
+
+options_templates.update(options_section(('queue', "Queue", "system"), {
+    "queue_max_tasks_per_user": OptionInfo(0, "Maximum queued or running generation tasks per user", gr.Number, {"precision": 0}, restrict_api=True).info("0 = unlimited"),
+    "queue_rate_limit_per_minute": OptionInfo(0, "Maximum generation tasks a user can submit per minute", gr.Number, restrict_api=True).info("0 = unlimited"),
+    "queue_rate_limit_burst": OptionInfo(5, "Number of tasks a user can submit at once before the per-minute limit applies", gr.Number, {"precision": 0}, restrict_api=True),
+    "job_store_enable": OptionInfo(False, "Keep generation tasks in a database so they survive a restart", restrict_api=True).info("tasks still waiting in the queue when the server stops are resumed on the next start if their inputs can be stored; running tasks are marked interrupted"),
+    "job_store_resume": OptionInfo(True, "Resume unfinished tasks on startup", restrict_api=True).info("otherwise they are marked as interrupted"),
+    "job_store_keep_days": OptionInfo(7, "Days to keep finished tasks and their results in the job database", gr.Number, {"precision": 0}, restrict_api=True),
+    "txt2img_batching_max_images": OptionInfo(0, "Maximum images in a batch combined from concurrent txt2img API requests", gr.Number, {"precision": 0}, restrict_api=True).info("requests that differ only in prompt, seed, CFG scale and batch size are generated together; 0 = disabled"),
+    "txt2img_batching_window_ms": OptionInfo(50, "Time to wait for more txt2img API requests to add to a batch (ms)", gr.Number, {"precision": 0}, restrict_api=True),
+}))
+
 options_templates.update(options_section(('training', "Training", "training"), {
     "unload_models_when_training": OptionInfo(False, "Move VAE and CLIP to RAM when training if possible. Saves VRAM."),
     "pin_memory": OptionInfo(False, "Turn on pin_memory for DataLoader. Makes training slightly faster but can increase memory usage."),
@@ -171,7 +193,10 @@ options_templates.update(options_section(('sd', "Stable Diffusion", "sd"), {
     "sd_model_checkpoint": OptionInfo(None, "Stable Diffusion checkpoint", gr.Dropdown, lambda: {"choices": shared_items.list_checkpoint_tiles(shared.opts.sd_checkpoint_dropdown_use_short)}, refresh=shared_items.refresh_checkpoints, infotext='Model hash'),
     "sd_checkpoints_limit": OptionInfo(1, "Maximum number of checkpoints loaded at the same time", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}),
     "sd_checkpoints_keep_in_cpu": OptionInfo(True, "Only keep one model on device").info("will keep models other than the currently used one in RAM rather than VRAM"),
-    "sd_checkpoint_cache": OptionInfo(0, "Checkpoints to cache in RAM", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1}).info("obsolete; set to 0 and use the two settings above instead"),
+    "sd_checkpoints_pin_memory": OptionInfo(False, "Keep checkpoints moved out of VRAM in pinned memory").info("makes switching back to them faster; pinned RAM stays allocated for each checkpoint while it is loaded; CUDA only"),
+    "sd_checkpoints_vram_budget_mb": OptionInfo(0, "VRAM budget for loaded checkpoints (MB)", gr.Number, {"precision": 0}).info("0 = disabled; if set, replaces the option above: least recently used checkpoints are moved to RAM only when their total size on device would exceed the budget"),
+    "sd_checkpoints_ram_budget_mb": OptionInfo(0, "RAM budget for checkpoints moved out of VRAM (MB)", gr.Number, {"precision": 0}).info("0 = disabled; if set, replaces the maximum number of checkpoints: least recently used checkpoints are unloaded only when their total size in RAM would exceed the budget"),
+    "sd_checkpoint_cache": OptionInfo(0, "Checkpoints to cache in RAM", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1}).info("obsolete; set to 0 and use the settings above instead"),
     "sd_unet": OptionInfo("Automatic", "SD Unet", gr.Dropdown, lambda: {"choices": shared_items.sd_unet_items()}, refresh=shared_items.refresh_unet_list).info("choose Unet model: Automatic = use one with same filename as checkpoint; None = use Unet from checkpoint"),
     "enable_quantization": OptionInfo(False, "Enable quantization in K samplers for sharper and cleaner results. This may change existing seeds").needs_reload_ui(),
     "emphasis": OptionInfo("Original", "Emphasis mode", gr.Radio, lambda: {"choices": [x.name for x in sd_emphasis.options]}, infotext="Emphasis").info("makes it possible to make model to pay (more:1.1) or (less:0.9) attention to text when you use the syntax in prompt; " + sd_emphasis.get_options_descriptions()),
@@ -233,12 +258,17 @@ options_templates.update(options_section(('optimizations', "Optimizations", "sd"
     "cross_attention_optimization": OptionInfo("Automatic", "Cross attention optimization", gr.Dropdown, lambda: {"choices": shared_items.cross_attention_optimizations()}),
     "s_min_uncond": OptionInfo(0.0, "Negative Guidance minimum sigma", gr.Slider, {"minimum": 0.0, "maximum": 15.0, "step": 0.01}, infotext='NGMS').link("PR", "https://github.com/AUTOMATIC1111/stablediffusion-webui/pull/9177").info("skip negative prompt for some steps when the image is almost ready; 0=disable, higher=faster"),
     "s_min_uncond_all": OptionInfo(False, "Negative Guidance minimum sigma all steps", infotext='NGMS all steps').info("By default, NGMS above skips every other step; this makes it skip all steps"),
+    "cfg_skip_uncond_at_scale_1": OptionInfo(False, "Skip negative prompt when CFG scale is 1").info("at CFG scale 1 the negative prompt has no effect on the image, so it does not need to be computed; faster"),
+    "cfg_uncond_reuse": OptionInfo(False, "Reuse negative prompt prediction on every other step", infotext='Uncond reuse').info("the negative prompt is computed on even steps and reused on odd ones; faster, lower quality"),
+    "sampling_step_timing": OptionInfo(False, "Record time of every sampling step").info("returned by API as sampling_step_times, along with whether the negative prompt was computed, skipped or reused; waits for GPU after each step, which is slightly slower"),
     "token_merging_ratio": OptionInfo(0.0, "Token merging ratio", gr.Slider, {"minimum": 0.0, "maximum": 0.9, "step": 0.1}, infotext='Token merging ratio').link("PR", "https://github.com/AUTOMATIC1111/stable-diffusion-webui/pull/9256").info("0=disable, higher=faster"),
     "token_merging_ratio_img2img": OptionInfo(0.0, "Token merging ratio for img2img", gr.Slider, {"minimum": 0.0, "maximum": 0.9, "step": 0.1}).info("only applies if non-zero and overrides above"),
     "token_merging_ratio_hr": OptionInfo(0.0, "Token merging ratio for high-res pass", gr.Slider, {"minimum": 0.0, "maximum": 0.9, "step": 0.1}, infotext='Token merging ratio hr').info("only applies if non-zero and overrides above"),
     "pad_cond_uncond": OptionInfo(False, "Pad prompt/negative prompt", infotext='Pad conds').info("improves performance when prompt and negative prompt have different lengths; changes seeds"),
     "pad_cond_uncond_v0": OptionInfo(False, "Pad prompt/negative prompt (v0)", infotext='Pad conds v0').info("alternative implementation for the above; used prior to 1.6.0 for DDIM sampler; overrides the above if set; WARNING: truncates negative prompt if it's too long; changes seeds"),
     "persistent_cond_cache": OptionInfo(True, "Persistent cond cache").info("do not recalculate conds from prompts if prompts have not changed since previous calculation"),
+    "cond_cache_mb": OptionInfo(0, "Shared cond cache size (MB)", gr.Number, {"precision": 0}).info("remember conds of individual prompts in RAM for all generations, so that prompts used before, such as common negative prompts, are not recalculated; 0 = disable"),
+    "clip_chunk_cache_size": OptionInfo(0, "Cached prompt chunks per text encoder", gr.Number, {"precision": 0}).info("when a long prompt only changes in its later 75-token chunks, earlier chunks are not encoded again; kept in VRAM; 0 = disable"),
     "batch_cond_uncond": OptionInfo(True, "Batch cond/uncond").info("do both conditional and unconditional denoising in one batch; uses a bit more VRAM during sampling, but improves speed; previously this was controlled by --always-batch-cond-uncond commandline argument"),
     "fp8_storage": OptionInfo("Disable", "FP8 weight", gr.Radio, {"choices": ["Disable", "Enable for SDXL", "Enable"]}).info("Use FP8 to store Linear/Conv layers' weight. Require pytorch>=2.1.0."),
     "cache_fp16_weight": OptionInfo(False, "Cache FP16 weight for LoRA").info("Cache fp16 weight when enabling FP8, will increase the quality of LoRA. Use more system ram."),
@@ -283,6 +313,10 @@ options_templates.update(options_section(('extra_networks', "Extra Networks", "s
     "extra_networks_card_description_is_html": OptionInfo(False, "Treat card description as HTML"),
     "extra_networks_card_order_field": OptionInfo("Path", "Default order field for Extra Networks cards", gr.Dropdown, {"choices": ['Path', 'Name', 'Date Created', 'Date Modified']}).needs_reload_ui(),
     "extra_networks_card_order": OptionInfo("Ascending", "Default order for Extra Networks cards", gr.Dropdown, {"choices": ['Ascending', 'Descending']}).needs_reload_ui(),
+    "extra_networks_thumbnail_size": OptionInfo(0, "Size of Extra Networks preview thumbnails (px)", gr.Number, {"precision": 0}).info("0 = serve full-size previews; otherwise previews are served as WebP thumbnails no larger than this, created on first request and cached on disk"),
+    "extra_networks_thumbnail_quality": OptionInfo(80, "WebP quality of Extra Networks preview thumbnails", gr.Slider, {"minimum": 1, "maximum": 100, "step": 1}),
+    "extra_networks_thumbnail_workers": OptionInfo(4, "Number of Extra Networks thumbnails to create at the same time", gr.Slider, {"minimum": 1, "maximum": 16, "step": 1}).needs_restart(),
+    "extra_networks_cards_page_size": OptionInfo(0, "Number of Extra Networks cards to load at a time", gr.Number, {"precision": 0}).info("0 = load all cards with the page; otherwise more cards are loaded as you scroll, and search and sort are done by the server; useful for large collections").needs_reload_ui(),
     "extra_networks_tree_view_style": OptionInfo("Dirs", "Extra Networks directory view style", gr.Radio, {"choices": ["Tree", "Dirs"]}).needs_reload_ui(),
     "extra_networks_tree_view_default_enabled": OptionInfo(True, "Show the Extra Networks directory view by default").needs_reload_ui(),
     "extra_networks_tree_view_default_width": OptionInfo(180, "Default width for the Extra Networks directory tree view", gr.Number).needs_reload_ui(),
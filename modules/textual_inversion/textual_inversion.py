@@ -12,7 +12,7 @@ import safetensors.torch
 import numpy as np
 from PIL import Image, PngImagePlugin
 
-from modules import shared, devices, sd_hijack, sd_models, images, sd_samplers, sd_hijack_checkpoint, errors, hashes
+from modules import shared, devices, sd_hijack, sd_models, images, sd_samplers, sd_hijack_checkpoint, errors, hashing_service, dir_index, cond_cache
 import modules.textual_inversion.dataset
 from modules.textual_inversion.learn_schedule import LearnRateScheduler
 
@@ -196,6 +196,20 @@ class EmbeddingDatabase:
         if not os.path.isdir(embdir.path):
             return
 
+        if dir_index.enabled():
+            for fullfn, size, _ in dir_index.list_files(embdir.path, include_hidden=True):
+                fn = os.path.basename(fullfn)
+                try:
+                    if size == 0:
+                        continue
+
+                    self.load_from_file(fullfn, fn)
+                except Exception:
+                    errors.report(f"Error loading embedding {fn}", exc_info=True)
+                    continue
+
+            return
+
         for root, _, fns in os.walk(embdir.path, followlinks=True):
             for fn in fns:
                 try:
@@ -224,6 +238,7 @@ class EmbeddingDatabase:
         self.word_embeddings.clear()
         self.skipped_embeddings.clear()
         self.expected_shape = self.get_expected_shape()
+        cond_cache.cache.clear()
 
         for embdir in self.embedding_dirs.values():
             self.load_from_dir(embdir)
@@ -318,7 +333,7 @@ def create_embedding_from_data(data, name, filename='unknown embedding file', fi
 
     if filepath:
         embedding.filename = filepath
-        embedding.set_hash(hashes.sha256(filepath, "textual_inversion/" + name) or '')
+        embedding.set_hash(hashing_service.sha256(filepath, "textual_inversion/" + name, callback=embedding.set_hash) or '')
 
     return embedding
 
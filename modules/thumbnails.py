@@ -0,0 +1,92 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from modules import shared
+import modules.cache
+
+thumbnails_dir = os.path.join(modules.cache.cache_dir, "thumbnails")
+
+# thumbnail URLs include the file's mtime and thumbnail settings, so a response for a given URL never changes
+cache_control = "public, max-age=31536000, immutable"
+
+executor = None
+executor_lock = threading.Lock()
+in_progress = {}
+in_progress_lock = threading.Lock()
+
+
+def enabled():
+    return shared.opts.extra_networks_thumbnail_size > 0
+
+
+def get_executor():
+    global executor
+
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max(1, int(shared.opts.extra_networks_thumbnail_workers)), thread_name_prefix="thumbnails")
+
+    return executor
+
+
+def settings_tag():
+    """Changes when thumbnails are turned on or off, or their size or quality changes."""
+
+    return f"{shared.opts.extra_networks_thumbnail_size}-{shared.opts.extra_networks_thumbnail_quality}"
+
+
+def file_key(filename):
+    """Cache key for a thumbnail of an image file; changes when the file or the thumbnail settings change."""
+
+    st = os.stat(filename)
+    return hashlib.sha1(f"{os.path.abspath(filename)}:{st.st_mtime_ns}:{st.st_size}:{settings_tag()}".encode()).hexdigest()
+
+
+def data_key(data):
+    """Cache key for a thumbnail of an image stored in a string, such as base64 cover images in safetensors metadata."""
+
+    return hashlib.sha1(f"{settings_tag()}:".encode() + data.encode()).hexdigest()
+
+
+def thumbnail_path(key):
+    return os.path.join(thumbnails_dir, key[:2], f"{key}.webp")
+
+
+def create_thumbnail(open_image, path):
+    size = shared.opts.extra_networks_thumbnail_size
+
+    with open_image() as image:
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            image.save(tmp_path, format="WEBP", quality=shared.opts.extra_networks_thumbnail_quality, method=4)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return path
+
+
+def get_thumbnail(key, open_image):
+    """Returns path to the thumbnail with this key, creating it in the worker pool from open_image() if it's not cached yet."""
+
+    path = thumbnail_path(key)
+    if os.path.isfile(path):
+        return path
+
+    with in_progress_lock:
+        future = in_progress.get(key)
+        if future is None:
+            future = in_progress[key] = get_executor().submit(create_thumbnail, open_image, path)
+            future.add_done_callback(lambda _: in_progress.pop(key, None))
+
+    return future.result()
@@ -1,7 +1,39 @@
+import sys
 import time
 import argparse
 
 
+def reset_peak_rss():
+    """Resets the peak resident set size of the process so that peak_rss() reports the peak from this point on; Linux only."""
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """Returns peak resident set size of the process in bytes, or None if it can't be determined."""
+
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
 class TimerSubcategory:
     def __init__(self, timer, category):
         self.timer = timer
@@ -33,6 +65,7 @@ class Timer:
         self.base_category = ''
         self.print_log = print_log
         self.subcategory_level = 0
+        self.tracks_peak_rss = False
 
     def elapsed(self):
         end = time.time()
@@ -62,21 +95,33 @@ class Timer:
         subcat = TimerSubcategory(self, name)
         return subcat
 
+    def track_peak_rss(self):
+        """Makes summary() also report peak RAM usage of the process since this call."""
+
+        reset_peak_rss()
+        self.tracks_peak_rss = True
+
     def summary(self):
         res = f"{self.total:.1f}s"
 
         additions = [(category, time_taken) for category, time_taken in self.records.items() if time_taken >= 0.1 and '/' not in category]
-        if not additions:
-            return res
+        if additions:
+            res += " ("
+            res += ", ".join([f"{category}: {time_taken:.1f}s" for category, time_taken in additions])
+            res += ")"
 
-        res += " ("
-        res += ", ".join([f"{category}: {time_taken:.1f}s" for category, time_taken in additions])
-        res += ")"
+        rss = peak_rss() if self.tracks_peak_rss else None
+        if rss is not None:
+            res += f", peak RAM: {rss / 2 ** 30:.2f} GB"
 
         return res
 
     def dump(self):
-        return {'total': self.total, 'records': self.records}
+        res = {'total': self.total, 'records': self.records}
+        if self.tracks_peak_rss:
+            res['peak_rss'] = peak_rss()
+
+        return res
 
     def reset(self):
         self.__init__()
@@ -7,18 +7,20 @@ from pathlib import Path
 from typing import Optional, Union
 from dataclasses import dataclass
 
-from modules import shared, ui_extra_networks_user_metadata, errors, extra_networks, util
+from modules import shared, ui_extra_networks_user_metadata, errors, extra_networks, util, thumbnails
 from modules.images import read_info_from_image, save_image_with_geninfo
 import gradio as gr
 import json
 import html
 from fastapi.exceptions import HTTPException
+from starlette.requests import Request
 from PIL import Image
 
 from modules.infotext_utils import image_from_url_text
 
 extra_pages = []
 allowed_dirs = set()
+sort_keys_for_order_field = {"Path": "default", "Name": "name", "Date Created": "date_created", "Date Modified": "date_modified"}
 default_allowed_preview_extensions = ["png", "jpg", "jpeg", "webp", "gif"]
 
 @functools.cache
@@ -94,7 +96,25 @@ def register_page(page):
     allowed_dirs.update(set(sum([x.allowed_directories_for_previews() for x in extra_pages], [])))
 
 
-def fetch_file(filename: str = ""):
+def cached_image_response(request: Request, key: str, make_response, immutable=False):
+    """Returns 304 if the browser already has the image with this key, otherwise the response from make_response()."""
+
+    from starlette.responses import Response
+
+    headers = {
+        "ETag": f'"{key}"',
+        "Cache-Control": thumbnails.cache_control if immutable else "public, max-age=3600",
+    }
+
+    if request is not None and request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    response = make_response()
+    response.headers.update(headers)
+    return response
+
+
+def fetch_file(request: Request, filename: str = ""):
     from starlette.responses import FileResponse
 
     if not os.path.isfile(filename):
@@ -107,12 +127,18 @@ def fetch_file(filename: str = ""):
     if ext not in allowed_preview_extensions():
         raise ValueError(f"File cannot be fetched: {filename}. Extensions allowed: {allowed_preview_extensions()}.")
 
-    # would profit from returning 304
-    return FileResponse(filename, headers={"Accept-Ranges": "bytes"})
+    key = thumbnails.file_key(filename)
+    immutable = "mtime" in request.query_params
 
+    # gifs are served as they are to keep animation
+    if thumbnails.enabled() and ext != "gif":
+        return cached_image_response(request, key, lambda: FileResponse(thumbnails.get_thumbnail(key, lambda: Image.open(filename)), media_type="image/webp"), immutable=immutable)
 
-def fetch_cover_images(page: str = "", item: str = "", index: int = 0):
-    from starlette.responses import Response
+    return cached_image_response(request, key, lambda: FileResponse(filename, headers={"Accept-Ranges": "bytes"}), immutable=immutable)
+
+
+def fetch_cover_images(request: Request, page: str = "", item: str = "", index: int = 0):
+    from starlette.responses import FileResponse, Response
 
     page = next(iter([x for x in extra_pages if x.name == page]), None)
     if page is None:
@@ -128,10 +154,18 @@ def fetch_cover_images(page: str = "", item: str = "", index: int = 0):
         raise HTTPException(status_code=404, detail="File not found")
 
     try:
-        image = Image.open(BytesIO(b64decode(image)))
-        buffer = BytesIO()
-        image.save(buffer, format=image.format)
-        return Response(content=buffer.getvalue(), media_type=image.get_format_mimetype())
+        key = thumbnails.data_key(image)
+
+        if thumbnails.enabled():
+            return cached_image_response(request, key, lambda: FileResponse(thumbnails.get_thumbnail(key, lambda: Image.open(BytesIO(b64decode(image)))), media_type="image/webp"))
+
+        def make_response():
+            cover = Image.open(BytesIO(b64decode(image)))
+            buffer = BytesIO()
+            cover.save(buffer, format=cover.format)
+            return Response(content=buffer.getvalue(), media_type=cover.get_format_mimetype())
+
+        return cached_image_response(request, key, make_response)
     except Exception as err:
         raise ValueError(f"File cannot be fetched: {item}. Failed to load cover image.") from err
 
@@ -170,11 +204,27 @@ def get_single_card(page: str = "", tabname: str = "", name: str = ""):
     return JSONResponse({"html": item_html})
 
 
+def get_cards(page: str = "", tabname: str = "", search: str = "", sort: str = "default", sort_dir: str = "Ascending", offset: int = 0, limit: int = 100):
+    """Returns HTML for one page of cards matching search, in the requested order, and the total number of matching cards."""
+
+    from starlette.responses import JSONResponse
+
+    page = next(iter([x for x in extra_pages if x.extra_networks_tabname == page]), None)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Page not found")
+
+    total, names = page.query_cards(search, sort, sort_dir == "Descending", offset, limit)
+    cards = [{"name": name, "html": page.create_item_html(tabname, page.items[name], page.card_tpl)} for name in names]
+
+    return JSONResponse({"total": total, "offset": offset, "cards": cards})
+
+
 def add_pages_to_demo(app):
     app.add_api_route("/sd_extra_networks/thumb", fetch_file, methods=["GET"])
     app.add_api_route("/sd_extra_networks/cover-images", fetch_cover_images, methods=["GET"])
     app.add_api_route("/sd_extra_networks/metadata", get_metadata, methods=["GET"])
     app.add_api_route("/sd_extra_networks/get-single-card", get_single_card, methods=["GET"])
+    app.add_api_route("/sd_extra_networks/cards", get_cards, methods=["GET"])
 
 
 def quote_js(s):
@@ -193,6 +243,7 @@ class ExtraNetworksPage:
         self.allow_negative_prompt = False
         self.metadata = {}
         self.items = {}
+        self.card_index = []
         self.lister = util.MassFileLister()
         # HTML Templates
         self.pane_tpl = shared.html("extra-networks-pane.html")
@@ -220,7 +271,7 @@ class ExtraNetworksPage:
     def link_preview(self, filename):
         quoted_filename = urllib.parse.quote(filename.replace('\\', '/'))
         mtime, _ = self.lister.mctime(filename)
-        return f"./sd_extra_networks/thumb?filename={quoted_filename}&mtime={mtime}"
+        return f"./sd_extra_networks/thumb?filename={quoted_filename}&mtime={mtime}&t={thumbnails.settings_tag()}"
 
     def search_terms_from_path(self, filename, possible_directories=None):
         abspath = os.path.abspath(filename)
@@ -286,21 +337,7 @@ class ExtraNetworksPage:
             }
         )
 
-        local_path = ""
-        filename = item.get("filename", "")
-        for reldir in self.allowed_directories_for_previews():
-            absdir = os.path.abspath(reldir)
-
-            if filename.startswith(absdir):
-                local_path = filename[len(absdir):]
-
-        # if this is true, the item must not be shown in the default view, and must instead only be
-        # shown when searching for it
-        if shared.opts.extra_networks_hidden_models == "Always":
-            search_only = False
-        else:
-            search_only = "/." in local_path or "\\." in local_path
-
+        search_only = self.is_search_only(item)
         if search_only and shared.opts.extra_networks_hidden_models == "Never":
             return ""
 
@@ -350,6 +387,50 @@ class ExtraNetworksPage:
         else:
             return args
 
+    def is_search_only(self, item):
+        """If this is true, the item must not be shown in the default view, and must instead only be shown when searching for it."""
+
+        if shared.opts.extra_networks_hidden_models == "Always":
+            return False
+
+        local_path = ""
+        filename = item.get("filename", "")
+        for reldir in self.allowed_directories_for_previews():
+            absdir = os.path.abspath(reldir)
+
+            if filename.startswith(absdir):
+                local_path = filename[len(absdir):]
+
+        return "/." in local_path or "\\." in local_path
+
+    def build_card_index(self):
+        """Builds the index used by query_cards to search and sort cards without creating their HTML."""
+
+        self.card_index = []
+        for name, item in self.items.items():
+            search_only = self.is_search_only(item)
+            if search_only and shared.opts.extra_networks_hidden_models == "Never":
+                continue
+
+            description = (item.get("description", "") or "") if shared.opts.extra_networks_card_show_desc else ""
+            search_text = " ".join([*item.get("search_terms", []), description]).lower()
+
+            self.card_index.append((name, item.get("sort_keys", {}), search_text, search_only))
+
+    def query_cards(self, search, sort, reverse, offset, limit):
+        """Same filtering and ordering as the client-side search and sort in extraNetworks.js; returns the total number of matching cards and names of cards in the requested range."""
+
+        search = search.lower()
+
+        def sort_key(entry):
+            value = entry[1].get(sort, "")
+            return (0, value, "") if isinstance(value, (int, float)) else (1, 0, str(value))
+
+        matching = [entry for entry in self.card_index if search in entry[2] and not (entry[3] and len(search) < 4)]
+        matching.sort(key=sort_key, reverse=reverse)
+
+        return len(matching), [entry[0] for entry in matching[offset:offset + limit]]
+
     def create_tree_dir_item_html(
         self,
         tabname: str,
@@ -562,15 +643,29 @@ class ExtraNetworksPage:
         Returns:
             HTML formatted string.
         """
+        page_size = shared.opts.extra_networks_cards_page_size
+        sentinel = ""
+        if page_size > 0:
+            # only the first page is created here; the rest is requested from /sd_extra_networks/cards as the user scrolls
+            sort = sort_keys_for_order_field.get(shared.opts.extra_networks_card_order_field, "default")
+            sort_dir = shared.opts.extra_networks_card_order
+            total, names = self.query_cards("", sort, sort_dir == "Descending", 0, page_size)
+            items = [self.items[name] for name in names]
+
+            # tells the page what is already loaded so that it doesn't request the first page again
+            sentinel = f'<div class="extra-network-cards-sentinel" data-total="{total}" data-count="{len(names)}" data-sort="{html.escape(sort)}" data-sort-dir="{html.escape(sort_dir)}"></div>'
+        else:
+            items = self.items.values()
+
         res = []
-        for item in self.items.values():
+        for item in items:
             res.append(self.create_item_html(tabname, item, self.card_tpl))
 
         if not res:
             dirs = "".join([f"<li>{x}</li>" for x in self.allowed_directories_for_previews()])
             res = [none_message or shared.html("extra-networks-no-cards.html").format(dirs=dirs)]
 
-        return "".join(res)
+        return "".join(res) + sentinel
 
     def create_html(self, tabname, *, empty=False):
         """Generates an HTML string for the current pane.
@@ -599,6 +694,8 @@ class ExtraNetworksPage:
             if "user_metadata" not in item:
                 self.read_user_metadata(item)
 
+        self.build_card_index()
+
         show_tree = shared.opts.extra_networks_tree_view_default_enabled
 
         page_params = {
@@ -1,9 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Body
-import sqlite3
 import json
 import logging
 from typing import Optional
 from modules import custom_auth
+from database import db_utils
 
 # 创建API路由
 router = APIRouter()
@@ -12,12 +12,6 @@ router = APIRouter()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("user_api")
 
-# 获取数据库连接
-def get_db_connection():
-    conn = sqlite3.connect('database/users.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
 # 获取当前用户信息
 @router.get("/user/info")
 async def get_user_info(request: Request):
@@ -44,9 +38,8 @@ async def get_user_info(request: Request):
     
     # 尝试使用自定义认证模块验证会话
     try:
-        from database import db_utils
         # 首先尝试验证session_token
-        session_data = db_utils.validate_session(session_id)
+        session_data = await custom_auth.validate_session_async(session_id)
         if session_data:
             logger.info(f"通过数据库验证会话成功: {session_data.get('username')}")
             
@@ -64,7 +57,7 @@ async def get_user_info(request: Request):
     
     # 如果上面的方法失败，尝试使用自定义认证模块
     try:
-        account = custom_auth.verify_session(session_id)
+        account = await custom_auth.run_in_auth_pool(custom_auth.verify_session, session_id)
         logger.info(f"通过custom_auth验证会话: {account}")
     except Exception as e:
         logger.error(f"通过custom_auth验证会话时出错: {str(e)}")
@@ -74,31 +67,25 @@ async def get_user_info(request: Request):
         raise HTTPException(status_code=401, detail="会话已过期")
     
     # 从数据库获取用户详细信息
-    conn = get_db_connection()
     try:
-        user = conn.execute(
-            "SELECT username, account, email, points FROM users WHERE account = ?", 
-            (account,)
-        ).fetchone()
-        
-        if not user:
-            logger.warning(f"数据库中未找到用户: {account}")
-            raise HTTPException(status_code=404, detail="用户不存在")
-        
-        logger.info(f"成功获取用户信息: {user['username']}")
-        
-        # 返回用户信息
-        return {
-            "username": user["username"],
-            "account": user["account"],
-            "email": user["email"],
-            "points": user["points"]
-        }
+        user = await custom_auth.run_in_auth_pool(db_utils.get_user_by_account, account)
     except Exception as e:
         logger.error(f"查询数据库时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取用户信息失败: {str(e)}")
-    finally:
-        conn.close()
+
+    if not user:
+        logger.warning(f"数据库中未找到用户: {account}")
+        raise HTTPException(status_code=404, detail="用户不存在")
+
+    logger.info(f"成功获取用户信息: {user['username']}")
+
+    # 返回用户信息
+    return {
+        "username": user["username"],
+        "account": user["account"],
+        "email": user["email"],
+        "points": user["points"]
+    }
 
 # 更新用户信息
 @router.post("/user/update")
@@ -125,8 +112,7 @@ async def update_user_info(
     
     # 尝试使用数据库方法验证会话
     try:
-        from database import db_utils
-        session_data = db_utils.validate_session(session_id)
+        session_data = await custom_auth.validate_session_async(session_id)
         if session_data:
             account = session_data.get("account")
     except Exception:
@@ -135,7 +121,7 @@ async def update_user_info(
     # 如果上面的方法失败，尝试使用自定义认证模块
     if not account:
         try:
-            account = custom_auth.verify_session(session_id)
+            account = await custom_auth.run_in_auth_pool(custom_auth.verify_session, session_id)
         except Exception as e:
             logger.error(f"验证会话时出错: {str(e)}")
     
@@ -150,49 +136,22 @@ async def update_user_info(
     if not username:
         raise HTTPException(status_code=400, detail="用户名不能为空")
     
-    # 更新数据库中的用户信息
-    conn = get_db_connection()
+    # 更新数据库中的用户信息（单个事务，出错时自动回滚）
     try:
-        # 开始事务
-        conn.execute("BEGIN TRANSACTION")
-        
-        # 更新用户信息
-        if email:
-            conn.execute(
-                "UPDATE users SET username = ?, email = ? WHERE account = ?",
-                (username, email, account)
-            )
-        else:
-            conn.execute(
-                "UPDATE users SET username = ? WHERE account = ?",
-                (username, account)
-            )
-        
-        # 提交事务
-        conn.commit()
-        
-        # 返回更新后的用户信息
-        user = conn.execute(
-            "SELECT username, account, email, points FROM users WHERE account = ?", 
-            (account,)
-        ).fetchone()
-        
-        return {
-            "success": True,
-            "message": "用户信息更新成功",
-            "data": {
-                "username": user["username"],
-                "account": user["account"],
-                "email": user["email"],
-                "points": user["points"]
-            }
-        }
+        user = await custom_auth.run_in_auth_pool(db_utils.update_user_profile, account, username, email)
     except Exception as e:
-        # 回滚事务
-        conn.rollback()
         raise HTTPException(status_code=500, detail=f"更新用户信息失败: {str(e)}")
-    finally:
-        conn.close()
+
+    return {
+        "success": True,
+        "message": "用户信息更新成功",
+        "data": {
+            "username": user["username"],
+            "account": user["account"],
+            "email": user["email"],
+            "points": user["points"]
+        }
+    }
 
 # 设置API路由
 def setup_user_api(app):
@@ -0,0 +1,145 @@
+import hashlib
+import threading
+import time
+
+import pytest
+
+from database import db_utils, init_db, passwords
+from database.points_ledger import LedgerWriter
+from database.session_cache import SessionCache
+from database.session_reaper import SessionReaper
+
+
+@pytest.fixture
+def user_db(tmp_path, monkeypatch):
+    db_utils.close_all_connections()
+    monkeypatch.setattr(db_utils, "DB_PATH", str(tmp_path / "user.db"))
+    init_db.init_database(db_utils.DB_PATH)
+    yield db_utils.verify_user(init_db.DEFAULT_USERNAME, init_db.DEFAULT_PASSWORD)
+    db_utils.close_all_connections()
+
+
+def test_wal_mode(user_db):
+    assert db_utils.get_db_connection().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_connection_reused_per_thread(user_db):
+    conn = db_utils.get_db_connection()
+    assert db_utils.get_db_connection() is conn
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(db_utils.get_db_connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+
+def test_session_roundtrip(user_db):
+    token = db_utils.create_session(user_db["id"])
+    session = db_utils.validate_session(token)
+    assert session["account"] == init_db.DEFAULT_USERNAME
+
+    assert db_utils.delete_session(token)
+    assert db_utils.validate_session(token) is None
+
+
+def test_expired_session(user_db):
+    token = db_utils.create_session(user_db["id"], expiry_seconds=-1)
+    assert db_utils.validate_session(token) is None
+    assert db_utils.clean_expired_sessions() == 0
+
+
+def test_session_cache_hit_and_invalidation(user_db):
+    token = db_utils.create_session(user_db["id"])
+    hits = db_utils.session_cache.stats()["hits"]
+    db_utils.validate_session(token)
+    db_utils.validate_session(token)
+    assert db_utils.session_cache.stats()["hits"] == hits + 1
+
+    db_utils.update_user_points(user_db["id"], -10)
+    assert db_utils.validate_session(token)["points"] == user_db["points"] - 10
+
+    db_utils.delete_session(token)
+    assert db_utils.validate_session(token) is None
+
+
+def test_session_cache_eviction():
+    cache = SessionCache(max_size=2, ttl=60)
+    for i in range(3):
+        cache.put(str(i), {"user_id": i, "expires_at": time.time() + 60})
+
+    assert cache.get("0") is None
+    assert cache.get("2")["user_id"] == 2
+    assert cache.stats()["evictions"] == 1
+
+
+def test_change_points_is_conditional_and_idempotent(user_db):
+    points = user_db["points"]
+
+    assert db_utils.change_points(user_db["id"], -points - 1)["success"] is False
+
+    result = db_utils.change_points(user_db["id"], -10, idempotency_key="task(1)")
+    assert result == {"success": True, "points": points - 10, "duplicate": False}
+
+    result = db_utils.change_points(user_db["id"], -10, idempotency_key="task(1)")
+    assert result == {"success": True, "points": points - 10, "duplicate": True}
+    assert len(db_utils.get_points_ledger(user_db["id"])) == 1
+
+    result = db_utils.change_points(user_db["id"], -1, idempotency_key="task(1)")
+    assert result["success"] is False and result["conflict"] is True
+    assert db_utils.get_user_points(user_db["id"]) == points - 10
+
+
+def test_idempotency_key_is_per_user(user_db):
+    other_id = db_utils.add_user("other", "other", "password", "other@example.com", 100)
+
+    db_utils.change_points(user_db["id"], -10, idempotency_key="task(1)")
+    result = db_utils.change_points(other_id, -10, idempotency_key="task(1)")
+
+    assert result == {"success": True, "points": 90, "duplicate": False}
+    assert len(db_utils.get_points_ledger(other_id)) == 1
+
+
+def test_legacy_ledger_migrated(tmp_path):
+    conn = db_utils.connect(str(tmp_path / "legacy.db"))
+    conn.execute("CREATE TABLE points_ledger (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, delta INTEGER NOT NULL, balance INTEGER NOT NULL, reason TEXT, idempotency_key TEXT UNIQUE, created_at REAL NOT NULL)")
+    conn.execute("CREATE TABLE sessions (token TEXT, user_id INTEGER, expires_at REAL)")
+    conn.execute("INSERT INTO points_ledger (user_id, delta, balance, reason, idempotency_key, created_at) VALUES (1, -1, 9, '', 'task(1)', 0)")
+    conn.commit()
+
+    db_utils.ensure_schema(conn)
+    conn.execute("INSERT INTO points_ledger (user_id, delta, balance, reason, idempotency_key, created_at) VALUES (2, -1, 9, '', 'task(1)', 0)")
+    assert conn.execute("SELECT COUNT(*) FROM points_ledger").fetchone()[0] == 2
+    conn.close()
+
+
+def test_ledger_writer_never_overdraws(user_db):
+    writer = LedgerWriter()
+    futures = [writer.submit(user_db["id"], -1, idempotency_key=f"task({i})") for i in range(user_db["points"] + 50)]
+    results = [future.result(timeout=10) for future in futures]
+
+    assert sum(result["success"] for result in results) == user_db["points"]
+    assert db_utils.get_user_by_account(init_db.DEFAULT_USERNAME)["points"] == 0
+    assert writer.stats()["batches"] < len(futures)
+
+
+def test_legacy_password_rehashed_on_login(user_db):
+    legacy = hashlib.sha256(init_db.DEFAULT_PASSWORD.encode("utf-8")).hexdigest()
+    db_utils.get_db_connection().execute("UPDATE users SET password = ? WHERE id = ?", (legacy, user_db["id"])).connection.commit()
+
+    assert db_utils.verify_user(init_db.DEFAULT_USERNAME, "wrong") is None
+    assert db_utils.verify_user(init_db.DEFAULT_USERNAME, init_db.DEFAULT_PASSWORD)["id"] == user_db["id"]
+
+    stored = db_utils.get_db_connection().execute("SELECT password FROM users WHERE id = ?", (user_db["id"],)).fetchone()[0]
+    assert stored.startswith(passwords.PASSWORD_HASHER + "$")
+    assert passwords.verify_password(init_db.DEFAULT_PASSWORD, stored) == (True, False)
+
+
+def test_reaper_deletes_expired_sessions_in_batches(user_db):
+    for _ in range(7):
+        db_utils.create_session(user_db["id"], expiry_seconds=-1)
+    db_utils.create_session(user_db["id"])
+
+    reaper = SessionReaper(batch_size=3, pause=0)
+    assert reaper.reap() == 7
+    assert reaper.stats()["table_size"] == 1
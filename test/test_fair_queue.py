@@ -0,0 +1,55 @@
+import threading
+import time
+
+import pytest
+
+from modules import fair_queue
+
+
+def wait_for_waiters(lock, count):
+    while sum(lock.queue_depths().values()) < count:
+        time.sleep(0.001)
+
+
+def test_round_robin_between_users():
+    lock = fair_queue.FairQueueLock()
+    order = []
+
+    def task(user, name):
+        with lock.for_user(user):
+            order.append(name)
+
+    lock.acquire()
+    threads = []
+    for user, name in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"), ("b", "b2")]:
+        thread = threading.Thread(target=task, args=(user, name))
+        thread.start()
+        threads.append(thread)
+        wait_for_waiters(lock, len(threads))
+
+    assert lock.queue_depths() == {"a": 3, "b": 2}
+    lock.release()
+    for thread in threads:
+        thread.join()
+
+    assert order == ["a1", "b1", "a2", "b2", "a3"]
+    assert not lock.locked()
+
+
+def test_user_limiter():
+    limiter = fair_queue.UserLimiter(max_tasks=lambda: 2, rate_per_minute=lambda: 60, burst=lambda: 3)
+
+    limiter.admit(1)
+    limiter.admit(1)
+    with pytest.raises(fair_queue.QueueLimitExceeded):
+        limiter.admit(1)
+
+    limiter.release(1)
+    limiter.admit(1)
+    limiter.release(1)
+    limiter.release(1)
+    with pytest.raises(fair_queue.QueueLimitExceeded):
+        limiter.admit(1)
+
+    limiter.admit(None)
+    assert limiter.active_tasks() == {}
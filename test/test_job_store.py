@@ -0,0 +1,74 @@
+import json
+import threading
+from types import SimpleNamespace
+
+import gradio as gr
+import pytest
+
+from modules import job_store
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_store, "JOB_DB_PATH", str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(job_store, "_conn", None)
+    monkeypatch.setattr(job_store, "_resumed", False)
+    monkeypatch.setattr(job_store.shared, "opts", SimpleNamespace(job_store_enable=True, job_store_resume=True, job_store_keep_days=7))
+
+    resumed = []
+    done = threading.Event()
+
+    def run_resumed_jobs(jobs):
+        resumed.extend(jobs)
+        done.set()
+
+    monkeypatch.setattr(job_store, "run_resumed_jobs", run_resumed_jobs)
+    yield SimpleNamespace(resumed=resumed, done=done)
+
+    if job_store._conn is not None:
+        job_store._conn.close()
+
+
+def test_params_roundtrip():
+    params = job_store.serialize_params(("a cat", 20, gr.Request()), {"seed": [1, 2]})
+    args, kwargs = job_store.deserialize_params(params)
+
+    assert args[:2] == ["a cat", 20]
+    assert isinstance(args[2], gr.Request)
+    assert kwargs == {"seed": [1, 2]}
+
+
+def test_params_that_cant_be_stored():
+    assert job_store.serialize_params((object(),), {}) is None
+
+
+def test_resume_only_pending_jobs(jobs):
+    job_store.add_job("pending", 1, json.dumps, ("a cat",), {"indent": 2})
+    job_store.add_job("running", 1, json.dumps, ("a dog",), {})
+    job_store.start_job("running")
+    job_store.add_job("unstorable", 1, json.dumps, (object(),), {})
+
+    job_store.resume_pending_jobs()
+    assert jobs.done.wait(5)
+
+    assert jobs.resumed == [("pending", 1, json.dumps, ["a cat"], {"indent": 2})]
+
+    for id_task in ("pending", "running", "unstorable"):
+        assert job_store.get_job(id_task)["status"] == job_store.STATUS_INTERRUPTED
+
+    assert job_store.get_job("running")["error"] == "server stopped while the job was running"
+
+
+def test_interrupted_jobs_not_resumed_again(jobs):
+    job_store.add_job("pending", 1, json.dumps, ("a cat",), {})
+    job_store.resume_pending_jobs()
+    assert jobs.done.wait(5)
+
+    # the job was not admitted to the queue again before the next restart
+    jobs.resumed.clear()
+    jobs.done.clear()
+    job_store._resumed = False
+    job_store.resume_pending_jobs()
+
+    assert not jobs.done.wait(0.1)
+    assert jobs.resumed == []
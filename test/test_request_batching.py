@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+
+from modules import request_batching
+
+
+def request(**args):
+    return request_batching.BatchedRequest(None, args, [])
+
+
+def test_batch_key_ignores_per_request_fields():
+    a = {"prompt": "a cat", "negative_prompt": "blurry", "seed": 1, "cfg_scale": 5, "batch_size": 1, "steps": 20}
+    b = {"prompt": "a dog", "negative_prompt": "ugly", "seed": 2, "cfg_scale": 9, "batch_size": 3, "steps": 20}
+
+    assert request_batching.batch_key(a) == request_batching.batch_key(b)
+    assert request_batching.batch_key(a) != request_batching.batch_key({**b, "steps": 30})
+
+
+def test_batch_key_includes_extra_networks():
+    a = {"prompt": "a cat <lora:style:1>", "steps": 20}
+    b = {"prompt": "a dog <lora:style:1>", "steps": 20}
+
+    assert request_batching.batch_key(a) == request_batching.batch_key(b)
+    assert request_batching.batch_key(a) != request_batching.batch_key({**b, "prompt": "a dog <lora:style:0.5>"})
+    assert request_batching.batch_key(a) != request_batching.batch_key({**b, "prompt": "a dog"})
+
+
+def test_combined_args_keeps_per_request_values():
+    requests = [
+        request(prompt="a", negative_prompt="na", seed=10, subseed=100, cfg_scale=5, batch_size=2),
+        request(prompt="b", negative_prompt="nb", seed=20, subseed=200, cfg_scale=9),
+        request(prompt="c", seed=30, subseed=300, subseed_strength=0.5, batch_size=2),
+    ]
+
+    args, cfg_scales = request_batching.combined_args(requests)
+
+    assert args["prompt"] == ["a", "a", "b", "c", "c"]
+    assert args["negative_prompt"] == ["na", "na", "nb", "", ""]
+    assert args["seed"] == [10, 11, 20, 30, 30]
+    assert args["subseed"] == [100, 101, 200, 300, 301]
+    assert args["batch_size"] == 5
+    assert args["n_iter"] == 1
+    assert args["do_not_save_grid"]
+    assert cfg_scales == [5, 5, 9, 7.0, 7.0]
+
+
+def test_split_processed_gives_each_request_its_images():
+    requests = [
+        request(prompt="a", cfg_scale=5, batch_size=2),
+        request(prompt="b", cfg_scale=9),
+    ]
+
+    processed = SimpleNamespace(
+        images=["img a1", "img a2", "img b"],
+        all_prompts=["a", "a", "b"],
+        all_negative_prompts=["na", "na", "nb"],
+        all_seeds=[10, 11, 20],
+        all_subseeds=[100, 101, 200],
+        infotexts=["info a1", "info a2", "info b"],
+        info="info a1",
+        prompt="a",
+        negative_prompt="na",
+        seed=10,
+        subseed=100,
+        cfg_scale=7.0,
+        batch_size=3,
+        index_of_first_image=0,
+    )
+
+    first, second = request_batching.split_processed(processed, requests)
+
+    assert first.images == ["img a1", "img a2"]
+    assert first.all_seeds == [10, 11]
+    assert first.infotexts == ["info a1", "info a2"]
+    assert (first.info, first.prompt, first.seed, first.cfg_scale, first.batch_size) == ("info a1", "a", 10, 5, 2)
+
+    assert second.images == ["img b"]
+    assert second.all_prompts == ["b"]
+    assert second.all_negative_prompts == ["nb"]
+    assert second.all_subseeds == [200]
+    assert (second.info, second.prompt, second.negative_prompt, second.seed, second.subseed, second.cfg_scale, second.batch_size) == ("info b", "b", "nb", 20, 200, 9, 1)
+
+    assert processed.images == ["img a1", "img a2", "img b"]
+    assert processed.batch_size == 3
@@ -51,7 +51,7 @@ def webui():
     launch_api = cmd_opts.api
     initialize.initialize()
 
-    from modules import shared, ui_tempdir, script_callbacks, ui, progress, ui_extra_networks
+    from modules import shared, ui_tempdir, script_callbacks, ui, progress, ui_extra_networks, job_store
 
     while 1:
         if shared.opts.clean_temp_dir_at_start:
@@ -204,6 +204,8 @@ def webui():
         with startup_timer.subcategory("app_started_callback"):
             script_callbacks.app_started_callback(shared.demo, app)
 
+        job_store.resume_pending_jobs()
+
         timer.startup_record = startup_timer.dump()
         print(f"Startup time: {startup_timer.summary()}.")
 